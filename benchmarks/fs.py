@@ -0,0 +1,86 @@
+# Runs the file system operations of the mkdir, symlink, copy and chmod processors through the
+# commands the old processors forked and through the os based ones. Needs the worker dependencies.
+#
+#     python benchmarks/fs.py [actions] [files]
+
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from hqcodedeployer.worker.fs import walk_tree, parse_mode, copy_tree
+
+
+def timed(name, function):
+    started = time.time()
+    function()
+    print("%-28s %8.2f s" % (name, time.time() - started))
+
+
+def main():
+    actions = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    files = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+
+    work = tempfile.mkdtemp()
+    try:
+        source = os.path.join(work, "source")
+        for index in range(files):
+            directory = os.path.join(source, "pkg" + str(index % 50))
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(os.path.join(directory, "module" + str(index) + ".py"), "wb") as f:
+                f.write(b"value = 1\n" * 100)
+
+        def command_mkdir():
+            for index in range(actions):
+                subprocess.check_call(['mkdir', '-p', os.path.join(work, "cmd-dirs", str(index), "a", "b")])
+
+        def os_mkdir():
+            for index in range(actions):
+                os.makedirs(os.path.join(work, "os-dirs", str(index), "a", "b"))
+
+        def command_symlink():
+            for index in range(actions):
+                subprocess.check_call(['ln', '-sfn', source, os.path.join(work, "cmd-current")])
+
+        def os_symlink():
+            link = os.path.join(work, "os-current")
+            for index in range(actions):
+                tmp_link = link + ".tmp"
+                os.symlink(source, tmp_link)
+                os.rename(tmp_link, link)
+
+        def command_copy():
+            subprocess.check_call(['cp', '-r', source, os.path.join(work, "cmd-copy")])
+
+        def os_copy():
+            copy_tree(source, os.path.join(work, "os-copy"))
+
+        def command_chmod():
+            subprocess.check_call(['chmod', '-R', 'go-w', os.path.join(work, "cmd-copy")])
+
+        def os_chmod():
+            for path in walk_tree(os.path.join(work, "os-copy")):
+                if not os.path.islink(path):
+                    os.chmod(path, stat.S_IMODE(parse_mode("go-w", os.stat(path).st_mode)))
+
+        print("%d actions, tree of %d files" % (actions, files))
+        timed("mkdir -p", command_mkdir)
+        timed("os.makedirs", os_mkdir)
+        timed("ln -sfn", command_symlink)
+        timed("os.symlink + rename", os_symlink)
+        timed("cp -r", command_copy)
+        timed("copy_tree", os_copy)
+        timed("chmod -R", command_chmod)
+        timed("walk_tree + os.chmod", os_chmod)
+    finally:
+        shutil.rmtree(work)
+
+
+if __name__ == '__main__':
+    main()
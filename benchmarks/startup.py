@@ -0,0 +1,48 @@
+# Times a fresh interpreter importing the worker with the lazy processor registry and with every
+# built in processor imported up front, as the worker used to. Needs the worker dependencies.
+#
+#     python benchmarks/startup.py [runs]
+
+import os
+import subprocess
+import sys
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+LAZY = "import hqcodedeployer.worker"
+
+EAGER = """
+import importlib
+import hqcodedeployer.worker
+from hqcodedeployer.worker.processors import BUILTIN_PROCESSORS
+for path in BUILTIN_PROCESSORS.values():
+    importlib.import_module(path.partition(":")[0])
+"""
+
+
+def timed(name, code, runs):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = SRC + os.pathsep + env.get('PYTHONPATH', '')
+
+    durations = []
+    for run in range(runs):
+        started = time.time()
+        subprocess.check_call([sys.executable, '-c', code], env=env)
+        durations.append(time.time() - started)
+
+    durations.sort()
+    print("%-28s %8.1f ms" % (name, durations[len(durations) // 2] * 1000))
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+    print("median of %d interpreter starts" % runs)
+    timed("interpreter only", "pass", runs)
+    timed("lazy processors", LAZY, runs)
+    timed("every processor imported", EAGER, runs)
+
+
+if __name__ == '__main__':
+    main()
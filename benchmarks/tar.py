@@ -0,0 +1,85 @@
+# Archives and extracts a build tree with /bin/tar, like the old processors did, and with the tarfile
+# based ones. Needs the worker dependencies installed.
+#
+#     python benchmarks/tar.py [files] [large file MB]
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from hqcodedeployer.worker.processors.tar import compression_tool, extract_archive, write_archive, COMPRESSORS
+
+
+def build_tree(root, files, large_mb):
+    for index in range(files):
+        directory = os.path.join(root, "pkg" + str(index % 50))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(os.path.join(directory, "module" + str(index) + ".py"), "wb") as f:
+            f.write(("value = %d\n" % index).encode() * 400)
+
+    with open(os.path.join(root, "large.bin"), "wb") as f:
+        for _ in range(large_mb):
+            f.write(os.urandom(512 * 1024) + b"\0" * 512 * 1024)
+
+
+def timed(name, function):
+    started = time.time()
+    function()
+    print("%-28s %8.2f s" % (name, time.time() - started))
+
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    large_mb = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    work = tempfile.mkdtemp()
+    try:
+        source = os.path.join(work, "source")
+        os.makedirs(source)
+        build_tree(source, files, large_mb)
+
+        baseline = os.path.join(work, "baseline.tar.gz")
+        native = os.path.join(work, "native.tar.gz")
+
+        def tar_create():
+            subprocess.check_call(['/bin/tar', '-zcf', baseline, '.'], cwd=source)
+
+        def native_create():
+            tool = compression_tool('gzip')
+            with open(native, 'wb') as f:
+                if tool is None:
+                    write_archive(f, 'w|gz', source, native)
+                else:
+                    proc = subprocess.Popen(COMPRESSORS[tool], stdin=subprocess.PIPE, stdout=f)
+                    write_archive(proc.stdin, 'w|', source, native)
+                    proc.stdin.close()
+                    proc.wait()
+
+        def tar_extract():
+            target = os.path.join(work, "tar-extract")
+            os.makedirs(target)
+            subprocess.check_call(['/bin/tar', '-xzf', baseline], cwd=target)
+
+        def native_extract():
+            target = os.path.join(work, "native-extract")
+            os.makedirs(target)
+            with open(native, 'rb') as f:
+                extract_archive(f, 'gzip', target)
+
+        print("%d files and %d MB, gzip with %s" % (files, large_mb, compression_tool('gzip') or 'tarfile'))
+        timed("tar -zcf", tar_create)
+        timed("tarfile create", native_create)
+        timed("tar -xzf", tar_extract)
+        timed("tarfile extract", native_extract)
+    finally:
+        shutil.rmtree(work)
+
+
+if __name__ == '__main__':
+    main()
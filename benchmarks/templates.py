@@ -0,0 +1,59 @@
+# Renders the action arguments of an app type for many workers with the old regex and replace loop
+# and with compiled templates.
+#
+#     python benchmarks/templates.py
+
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from hqcodedeployer.framework.templates import compile_template
+
+WORKERS = 200
+ACTIONS = 30
+
+ARGUMENTS = [
+    {'dir': '{build_path}/{app_name}/{stage_id}', 'url': '{artifact_url}/{app_name}-{stage_id}.tar.gz',
+     'user': '{user}', 'extra_args': '--exclude .git'}
+    for _ in range(ACTIONS)
+]
+
+VARIABLES = [
+    {'target': 'worker' + str(index), 'build_path': '/srv/builds', 'app_name': 'app', 'stage_id': '42',
+     'artifact_url': 'http://artifacts', 'user': 'deploy'}
+    for index in range(WORKERS)
+]
+
+
+def regex_loop():
+    reobj = re.compile("{(.*?)}")
+
+    for variables in VARIABLES:
+        for arguments in ARGUMENTS:
+            rendered = {}
+            for key, value in arguments.items():
+                for var_key in reobj.findall(value):
+                    if var_key in variables:
+                        value = value.replace("{" + var_key + "}", variables[var_key])
+                rendered[key] = value
+
+
+def compiled_templates():
+    for variables in VARIABLES:
+        for arguments in ARGUMENTS:
+            rendered = {}
+            for key, value in arguments.items():
+                rendered[key] = compile_template(value).render(variables)
+
+
+def main():
+    for name, function in [('regex loop', regex_loop), ('compiled templates', compiled_templates)]:
+        seconds = min(timeit.repeat(function, number=5, repeat=3)) / 5
+        print("%-20s %8.2f ms per render of %d actions for %d workers" % (name, seconds * 1000, ACTIONS, WORKERS))
+
+
+if __name__ == '__main__':
+    main()
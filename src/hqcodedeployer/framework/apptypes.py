@@ -0,0 +1,113 @@
+import json
+import logging
+import os
+import threading
+
+from schematics.exceptions import ModelValidationError, ModelConversionError
+
+from hqcodedeployer.validators import AppTypeValidator
+
+
+class AppTypeError(Exception):
+
+    def __init__(self, status, message):
+        super(AppTypeError, self).__init__(message)
+        self.status = status
+        self.message = message
+
+
+class AppTypeRegistry(object):
+
+    # Validated app types of one kind (stage, deploy or rollback) kept in memory.
+    #
+    # Every <type>-<kind>.json file is loaded and validated up front so broken files show up at
+    # startup. Afterwards a file is only read again when its mtime changes. The returned app types
+    # are shared between requests and must not be modified. Until load_all is given the app type
+    # path every lookup fails with a 503.
+
+    def __init__(self, kind):
+        self.logger = logging.getLogger("hq.framework.codedeployer.apptypes")
+        self.path = None
+        self.kind = kind
+        self.suffix = "-" + kind + ".json"
+        self.lock = threading.Lock()
+        self.app_types = {}
+
+    def file_name(self, name):
+        return self.path + "/" + name + self.suffix
+
+    def load_all(self, path):
+        self.path = path
+
+        try:
+            file_names = sorted(os.listdir(path))
+        except OSError as e:
+            self.logger.error("Error listing " + self.kind + " app types in " + path + ": " + str(e))
+            return
+
+        for file_name in file_names:
+            if not file_name.endswith(self.suffix):
+                continue
+
+            name = file_name[:-len(self.suffix)]
+
+            try:
+                self.get(name)
+                self.logger.info("Loaded " + self.kind + " app type " + name)
+            except AppTypeError as e:
+                self.logger.error("Error loading " + self.kind + " app type " + name + ": " + e.message)
+
+    def get(self, name):
+        if self.path is None:
+            raise AppTypeError(503, "App " + self.kind + " types are not loaded yet")
+
+        file_name = self.file_name(name)
+
+        try:
+            mtime = os.stat(file_name).st_mtime
+        except OSError:
+            with self.lock:
+                self.app_types.pop(name, None)
+            raise AppTypeError(404, "Unknown app " + self.kind + " type " + name)
+
+        with self.lock:
+            cached = self.app_types.get(name)
+
+        if cached is None or cached[0] != mtime:
+            try:
+                cached = (mtime, self.load(file_name), None)
+            except AppTypeError as e:
+                cached = (mtime, None, e)
+
+            with self.lock:
+                self.app_types[name] = cached
+
+        if cached[2] is not None:
+            raise cached[2]
+
+        return cached[1]
+
+    def load(self, file_name):
+        try:
+            with open(file_name) as f:
+                app_json = json.load(f)
+
+        except IOError as e:
+            raise AppTypeError(500, "Error opening app type file " + str(e))
+        except ValueError as e:
+            raise AppTypeError(500, "Error loading app type json " + e.message)
+
+        try:
+            app_type = AppTypeValidator(app_json)
+        except ModelConversionError as e:
+            raise AppTypeError(400, "App Type JSON Error " + json.dumps(e.message))
+
+        try:
+            app_type.validate()
+        except ModelValidationError as e:
+            raise AppTypeError(400, "App Type JSON Error " + json.dumps(e.message))
+
+        if app_type.tasks is not None:
+            app_type.tasks.sort(key=lambda x: x.priority)
+
+        return app_type
@@ -0,0 +1,76 @@
+import hashlib
+import json
+import re
+import subprocess
+import threading
+
+from hqcodedeployer.framework.bulk import GRAPH_PROCESSOR
+
+REVISION_REGEX = re.compile("^[0-9a-f]{40}$")
+CLONE_PROCESSOR = 'git:clone'
+
+
+def resolve_revision(repo, branch, timeout):
+    # Commit the branch currently points at, None when the repo can not be asked within timeout seconds
+    if REVISION_REGEX.match(branch) is not None:
+        return branch
+
+    try:
+        process = subprocess.Popen(['git', 'ls-remote', repo, branch], stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+    except OSError:
+        return None
+
+    # Never let an unreachable remote hold up the request, kill git once the timeout passes
+    timer = threading.Timer(timeout, process.kill)
+    timer.start()
+
+    try:
+        output = process.communicate()[0]
+    finally:
+        timer.cancel()
+
+    if process.returncode != 0:
+        return None
+
+    refs = {}
+    for line in output.splitlines():
+        parts = line.split()
+        if len(parts) == 2:
+            refs[parts[1]] = parts[0]
+
+    for ref in [branch, 'refs/heads/' + branch, 'refs/tags/' + branch + '^{}', 'refs/tags/' + branch]:
+        if ref in refs:
+            return refs[ref]
+
+    return None
+
+
+def build_key(app_type, repo, revision, tasks, variables, tags):
+    # Everything that decides what a stage builds. Variables that change with every stage, like
+    # its id, are filled in when tasks are rendered and are deliberately not part of the key.
+    build = {'app_type': app_type,
+             'repo': repo,
+             'revision': revision,
+             'tasks': [task_data.to_primitive() for task_data in tasks],
+             'variables': variables,
+             'tags': tags}
+
+    return hashlib.sha256(json.dumps(build, sort_keys=True)).hexdigest()
+
+
+def pin_revision(rendered_tasks, revision):
+    # Makes every git:clone of the rendered tasks check out the resolved revision unless it already
+    # names one, so the build matches its build key even when the branch moves in the meantime
+    for name, actions in rendered_tasks:
+        for processor, arguments in actions:
+            if processor == CLONE_PROCESSOR and arguments is not None and not arguments.get('revision'):
+                arguments['revision'] = revision
+            elif processor == GRAPH_PROCESSOR:
+                for key, value in list(arguments.items()):
+                    if key.endswith(":processor") and value == CLONE_PROCESSOR:
+                        prefix = key[:-len("processor")]
+                        if not arguments.get(prefix + "arg:revision"):
+                            arguments[prefix + "arg:revision"] = revision
+
+    return rendered_tasks
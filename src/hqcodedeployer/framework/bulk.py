@@ -0,0 +1,132 @@
+from sqlalchemy.orm.interfaces import ONETOMANY
+
+from hqlib.sql.models import Task, Action, JobTarget
+from hqcodedeployer.framework.templates import compile_template
+from hqcodedeployer.validators import TaskValidator
+
+INSERT_CHUNK_SIZE = 1000
+GRAPH_PROCESSOR = 'actions:graph'
+
+
+def render_arguments(arguments, variables):
+    if arguments is None:
+        return None
+
+    return dict((key, compile_template(argument).render(variables)) for key, argument in arguments.iteritems())
+
+
+def render_tasks(tasks, variables):
+    # Substitutes variables into the action arguments of validated app type tasks.
+    # Returns a list of (task name, [(processor, arguments)]) without touching the templates.
+    rendered = []
+
+    for task_data in tasks:
+        if TaskValidator.has_action_graph(task_data.actions):
+            actions = [(GRAPH_PROCESSOR, graph_arguments(task_data.actions, variables))]
+        else:
+            actions = [(action.processor, render_arguments(action.arguments, variables))
+                       for action in task_data.actions]
+
+        rendered.append((task_data.name, actions))
+
+    return rendered
+
+
+def graph_arguments(actions, variables):
+    # Actions with dependencies between them run as a single graph action on the worker. Each action
+    # is flattened into <index>:<field> arguments so they are rendered like any other argument.
+    indexes = dict((action.name, index) for index, action in enumerate(actions))
+    arguments = {}
+
+    for index, (action, dependencies) in enumerate(zip(actions, TaskValidator.action_dependencies(actions))):
+        prefix = str(index) + ":"
+        arguments[prefix + "name"] = action.name
+        arguments[prefix + "processor"] = action.processor
+        arguments[prefix + "depends_on"] = ",".join(str(indexes[name]) for name in dependencies)
+
+        for key, argument in (render_arguments(action.arguments, variables) or {}).iteritems():
+            arguments[prefix + "arg:" + key] = argument
+
+    return arguments
+
+
+def foreign_key(relationship):
+    # Column name a relationship is joined on, works for both sides of a one to many
+    prop = relationship.property
+
+    if prop.direction is ONETOMANY:
+        return list(prop.remote_side)[0].key
+
+    return list(prop.local_columns)[0].key
+
+
+def insert_returning_ids(session, table, rows):
+    ids = []
+
+    for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+        chunk = rows[start:start + INSERT_CHUNK_SIZE]
+        result = session.execute(table.insert().values(chunk).returning(table.c.id))
+        ids.extend([row[0] for row in result])
+
+    return ids
+
+
+def insert_rows(session, table, rows):
+    for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+        session.execute(table.insert(), rows[start:start + INSERT_CHUNK_SIZE])
+
+
+def create_job_targets(session, job, worker_ids, rendered_tasks, target_variables=None):
+    # Creates a job target per worker, each with a copy of the rendered tasks and their actions,
+    # using one multi row insert per table instead of an ORM object per row.
+    #
+    # target_variables optionally maps worker ids to variables that differ per target. Rendering
+    # leaves unknown variables in place, so only arguments still referencing them are rendered again.
+    job_key = foreign_key(JobTarget.job)
+    job_target_key = foreign_key(Task.job_target)
+    task_key = foreign_key(Task.actions)
+
+    target_ids = insert_returning_ids(session, JobTarget.__table__,
+                                      [{job_key: job.id, 'worker_id': worker_id} for worker_id in worker_ids])
+
+    task_rows = []
+    for target_id in target_ids:
+        for task_index, (name, actions) in enumerate(rendered_tasks):
+            task_rows.append({'name': name, 'order': task_index, job_target_key: target_id})
+
+    task_ids = insert_returning_ids(session, Task.__table__, task_rows)
+
+    target_keys = {}
+    if target_variables is not None:
+        names = set()
+        for variables in target_variables.itervalues():
+            names.update(variables)
+
+        for task_index, (name, actions) in enumerate(rendered_tasks):
+            for action_index, (processor, arguments) in enumerate(actions):
+                keys = [key for key, argument in (arguments or {}).iteritems()
+                        if compile_template(argument).variables & names]
+                if len(keys) > 0:
+                    target_keys[(task_index, action_index)] = keys
+
+    worker_by_target = dict(zip(target_ids, worker_ids))
+
+    action_rows = []
+    for task_row, task_id in zip(task_rows, task_ids):
+        name, actions = rendered_tasks[task_row['order']]
+
+        for action_index, (processor, arguments) in enumerate(actions):
+            keys = target_keys.get((task_row['order'], action_index))
+
+            if keys is not None:
+                variables = target_variables.get(worker_by_target[task_row[job_target_key]], {})
+                arguments = arguments.copy()
+                for key in keys:
+                    arguments[key] = compile_template(arguments[key]).render(variables)
+
+            action_rows.append({'processor': processor, 'order': action_index, 'arguments': arguments,
+                                task_key: task_id})
+
+    insert_rows(session, Action.__table__, action_rows)
+
+    return target_ids
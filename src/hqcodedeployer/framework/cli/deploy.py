@@ -5,7 +5,7 @@ import sys
 import os.path
 
 from hqcli.plugins import AbstractPlugin
-import time
+from hqcodedeployer.framework.cli.stream import watch_job
 
 
 class Plugin(AbstractPlugin):
@@ -19,6 +19,9 @@ class Plugin(AbstractPlugin):
 
         list_parser = subparsers.add_parser('list')
         list_parser.add_argument('-p', '--page', default=1, type=int, help='List page')
+        list_parser.add_argument('-pp', '--per_page', default=10, type=int, help='Results per page')
+        list_parser.add_argument('--before_id', default=None, type=int,
+                                 help='Only list results older than this id instead of using pages')
         list_parser.add_argument('-a', '--app', default=None, type=str, help='The application to filter by')
         list_parser.set_defaults(func=self.list)
 
@@ -26,6 +29,10 @@ class Plugin(AbstractPlugin):
         get_parser.add_argument('deploy_id', type=int, help='Deploy ID')
         get_parser.set_defaults(func=self.get)
 
+        watch_parser = subparsers.add_parser('watch')
+        watch_parser.add_argument('deploy_id', type=int, help='Deploy ID')
+        watch_parser.set_defaults(func=self.watch)
+
         self.create_parser = subparsers.add_parser('create')
         self.create_parser.add_argument('-sid', '--stage_id', type=int, help='The stage to deploy')
         self.create_parser.add_argument('-w', '--wait', action='store_true',
@@ -36,11 +43,22 @@ class Plugin(AbstractPlugin):
         self.create_parser.add_argument('-min', '--min_nodes', type=int,
                                         help='The minimum amount of nodes to deploy to')
         self.create_parser.add_argument('-t', '--targets', nargs='+', type=str, help='The targets to deploy to')
+        self.create_parser.add_argument('-b', '--batch_size', type=int,
+                                        help='The amount of nodes to roll the deploy through at once')
+        self.create_parser.add_argument('-bp', '--batch_percentage', type=int,
+                                        help='The percentage of nodes to roll the deploy through at once')
+        self.create_parser.add_argument('-mif', '--max_in_flight', type=int,
+                                        help='The maximum amount of tasks running at once')
+        self.create_parser.add_argument('-p', '--parallel', action='store_true',
+                                        help='Let every node move through its tasks without waiting on the others')
         self.create_parser.add_argument('-f', '--file', default=None, type=str, help='The json file to use instead')
         self.create_parser.set_defaults(func=self.create)
 
     def list(self, args):
-        url = self.config.framework_url + "/cd/deploy?page=" + str(args.page)
+        url = self.config.framework_url + "/cd/deploy?page=" + str(args.page) + "&per_page=" + str(args.per_page)
+
+        if args.before_id is not None:
+            url += "&before_id=" + str(args.before_id)
 
         if args.app is not None:
             url += "&app=" + args.app
@@ -64,6 +82,12 @@ class Plugin(AbstractPlugin):
 
         self.logger.info("Deploy " + str(args.deploy_id) + "\n" + json.dumps(json.loads(r.text), indent=2))
 
+    def watch(self, args):
+        status = watch_job(self, self.config.framework_url + "/cd/deploy/events/" + str(args.deploy_id))
+
+        if status != 'COMPLETED':
+            sys.exit(1)
+
     def create(self, args):
 
         data = {}
@@ -96,6 +120,18 @@ class Plugin(AbstractPlugin):
             if isinstance(args.tags, dict):
                 data['tags'] = args.tags
 
+        if args.batch_size is not None:
+            data['batch_size'] = args.batch_size
+
+        if args.batch_percentage is not None:
+            data['batch_percentage'] = args.batch_percentage
+
+        if args.max_in_flight is not None:
+            data['max_in_flight'] = args.max_in_flight
+
+        if args.parallel:
+            data['parallel'] = True
+
         if 'stage_id' is not data and 'env' not in data:
             self.create_parser.print_help(sys.stderr)
             sys.exit(1)
@@ -105,25 +141,13 @@ class Plugin(AbstractPlugin):
             sys.exit(2)
 
         if args.wait:
-            status = None
-
-            while status != 'COMPLETED':
-                self.logger.info("Waiting for stage " + str(data['stage_id']) + " to complete")
-
-                if status == 'FAILED':
-                    self.logger.error("Stage " + str(data['stage_id']) + " has failed")
-                    sys.exit(1)
+            self.logger.info("Waiting for stage " + str(data['stage_id']) + " to complete")
 
-                r = self.api_call_get(self.config.framework_url + "/cd/stage/" + str(data['stage_id']))
+            status = watch_job(self, self.config.framework_url + "/cd/stage/events/" + str(data['stage_id']))
 
-                if r.status_code != 200:
-                    self.logger.error(r.text)
-                    sys.exit(1)
-
-                rdata = json.loads(r.text)
-                status = rdata['status']
-
-                time.sleep(5)
+            if status == 'FAILED':
+                self.logger.error("Stage " + str(data['stage_id']) + " has failed")
+                sys.exit(1)
 
             if status != 'COMPLETED':
                 self.logger.error("Stage " + str(data['stage_id']) + " has not completed")
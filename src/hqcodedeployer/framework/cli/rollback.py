@@ -4,6 +4,8 @@ import json
 import sys
 import os.path
 
+from hqcodedeployer.framework.cli.stream import watch_job
+
 
 class Plugin(AbstractPlugin):
 
@@ -17,6 +19,9 @@ class Plugin(AbstractPlugin):
 
         list_parser = subparsers.add_parser('list')
         list_parser.add_argument('-p', '--page', default=1, type=int, help='List page')
+        list_parser.add_argument('-pp', '--per_page', default=10, type=int, help='Results per page')
+        list_parser.add_argument('--before_id', default=None, type=int,
+                                 help='Only list results older than this id instead of using pages')
         list_parser.add_argument('-a', '--app', default=None, type=str, help='The application to filter by')
         list_parser.set_defaults(func=self.list)
 
@@ -24,16 +29,25 @@ class Plugin(AbstractPlugin):
         get_parser.add_argument('rollback_id', type=int, help='Rollback ID')
         get_parser.set_defaults(func=self.get)
 
+        watch_parser = subparsers.add_parser('watch')
+        watch_parser.add_argument('rollback_id', type=int, help='Rollback ID')
+        watch_parser.set_defaults(func=self.watch)
+
         self.create_parser = subparsers.add_parser('create')
         self.create_parser.add_argument('-a', '--app', type=str, help='Application Name')
         self.create_parser.add_argument('-e', '--env', type=str, help='The environment to deploy to')
         self.create_parser.add_argument('-t', '--type', type=str, help='Application Type')
         self.create_parser.add_argument('-d', '--datacenter', type=str, help='The datacenter to deploy to')
+        self.create_parser.add_argument('-p', '--parallel', action='store_true',
+                                        help='Let every node move through its tasks without waiting on the others')
         self.create_parser.add_argument('-f', '--file', default=None, type=str, help='The json file to use instead')
         self.create_parser.set_defaults(func=self.create)
 
     def list(self, args):
-        url = self.config.framework_url+"/cd/rollback?page="+str(args.page)
+        url = self.config.framework_url+"/cd/rollback?page="+str(args.page)+"&per_page="+str(args.per_page)
+
+        if args.before_id is not None:
+            url += "&before_id="+str(args.before_id)
 
         if args.app is not None:
             url += "&app="+args.app
@@ -57,6 +71,12 @@ class Plugin(AbstractPlugin):
 
         self.logger.info("Deploy "+str(args.rollback_id)+"\n"+json.dumps(json.loads(r.text), indent=2))
 
+    def watch(self, args):
+        status = watch_job(self, self.config.framework_url+"/cd/rollback/events/"+str(args.rollback_id))
+
+        if status != 'COMPLETED':
+            sys.exit(1)
+
     def create(self, args):
 
         data = {}
@@ -82,6 +102,9 @@ class Plugin(AbstractPlugin):
         if args.datacenter is not None:
             data['datacenter'] = args.datacenter
 
+        if args.parallel:
+            data['parallel'] = True
+
         if 'name' is not data and 'env' not in data and 'type' not in data:
             self.create_parser.print_help(sys.stderr)
             sys.exit(2)
@@ -4,6 +4,8 @@ import json
 import sys
 import os.path
 
+from hqcodedeployer.framework.cli.stream import watch_job
+
 
 class Plugin(AbstractPlugin):
 
@@ -17,6 +19,9 @@ class Plugin(AbstractPlugin):
 
         list_parser = subparsers.add_parser('list')
         list_parser.add_argument('-p', '--page', default=1, type=int, help='List page')
+        list_parser.add_argument('-pp', '--per_page', default=10, type=int, help='Results per page')
+        list_parser.add_argument('--before_id', default=None, type=int,
+                                 help='Only list results older than this id instead of using pages')
         list_parser.add_argument('-a', '--app', default=None, type=str, help='The application to filter by')
         list_parser.add_argument('-b', '--branch', default=None, type=str, help='The branch to filter by')
         list_parser.set_defaults(func=self.list)
@@ -25,17 +30,26 @@ class Plugin(AbstractPlugin):
         get_parser.add_argument('stage_id', type=int, help='Stage ID')
         get_parser.set_defaults(func=self.get)
 
+        watch_parser = subparsers.add_parser('watch')
+        watch_parser.add_argument('stage_id', type=int, help='Stage ID')
+        watch_parser.set_defaults(func=self.watch)
+
         self.create_parser = subparsers.add_parser('create')
         self.create_parser.add_argument('-a', '--app', type=str, help='Application Name')
         self.create_parser.add_argument('-t', '--type', type=str, help='Application Type')
         self.create_parser.add_argument('-r', '--repo', type=str, help='Application Repo')
         self.create_parser.add_argument('-b', '--branch', type=str, help='Branch to deploy')
         self.create_parser.add_argument('--tags', type=json.loads, help='Additional worker tags to filter')
+        self.create_parser.add_argument('--force', action='store_true',
+                                        help='Build even if this revision was already staged')
         self.create_parser.add_argument('-f', '--file', default=None, type=str, help='The json file to use instead')
         self.create_parser.set_defaults(func=self.create)
 
     def list(self, args):
-        url = self.config.framework_url+"/cd/stage?page="+str(args.page)
+        url = self.config.framework_url+"/cd/stage?page="+str(args.page)+"&per_page="+str(args.per_page)
+
+        if args.before_id is not None:
+            url += "&before_id="+str(args.before_id)
 
         if args.app is not None:
             url += "&app="+args.app
@@ -62,6 +76,12 @@ class Plugin(AbstractPlugin):
 
         self.logger.info("Stage "+str(args.stage_id)+"\n"+json.dumps(json.loads(r.text), indent=2))
 
+    def watch(self, args):
+        status = watch_job(self, self.config.framework_url+"/cd/stage/events/"+str(args.stage_id))
+
+        if status != 'COMPLETED':
+            sys.exit(1)
+
     def create(self, args):
 
         data = {}
@@ -91,6 +111,9 @@ class Plugin(AbstractPlugin):
         if args.branch is not None:
             data['branch'] = args.branch
 
+        if args.force:
+            data['force'] = True
+
         if 'name' not in data and 'type' not in data and 'repo' not in data:
             self.create_parser.print_help(sys.stderr)
             sys.exit(2)
@@ -0,0 +1,39 @@
+import json
+import sys
+
+
+def job_events(plugin, url):
+    # Yields (event, data) pairs from a framework job event stream until the job stops
+    r = plugin.api_call_get(url, stream=True)
+
+    if r.status_code != 200:
+        plugin.logger.error(r.text)
+        sys.exit(1)
+
+    event = None
+
+    for line in r.iter_lines():
+        if line.startswith("event: "):
+            event = line[len("event: "):]
+        elif line.startswith("data: "):
+            yield event, json.loads(line[len("data: "):])
+
+
+def watch_job(plugin, url):
+    # Logs job progress as it happens and returns the final job status
+    status = None
+
+    for event, data in job_events(plugin, url):
+        if event == 'job':
+            status = data['status']
+            plugin.logger.info("Job " + str(data['job_id']) + " " + status +
+                               " (task " + str(data['current_task_index']) + ")")
+        elif event == 'task':
+            message = data['target'] + " " + data['task_name'] + " " + data['status']
+
+            if 'task_error' in data:
+                message += ": " + data['task_error']
+
+            plugin.logger.info(message)
+
+    return status
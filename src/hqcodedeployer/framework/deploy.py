@@ -1,26 +1,37 @@
 import json
 import datetime
 import logging
+import math
 
-import os.path
 import cherrypy
 
-from schematics.exceptions import ModelValidationError, ModelConversionError
-import re
+from schematics.exceptions import ModelValidationError, ModelConversionError, ValidationError
 
-from schematics.types import StringType
+from schematics.types import StringType, IntType
 
 from hqframework.framework import AbstractFramework, AbstractFrameworkAPI
-from hqlib.sql.models import Task, TaskStatus, Action, Job, JobTarget, JobStatus
+from hqcodedeployer.framework.events import TaskEventMixin
+from hqcodedeployer.framework.apptypes import AppTypeRegistry, AppTypeError
+from hqcodedeployer.framework.workers import WorkerIndexMixin
+from hqcodedeployer.framework.graph import load_job_graph, TaskStatusCounts, load_current_tasks, targets_data, \
+    job_targets_loader, page_size, critical_path
+from hqcodedeployer.framework.bulk import create_job_targets, render_tasks
+from hqcodedeployer.framework.timeouts import task_timeouts
+from hqcodedeployer.framework.peers import peer_variables
+from hqcodedeployer.framework.templates import resolve_variables, TemplateError
+from hqcodedeployer.framework.stream import JobEventsAPI
+from hqlib.sql.models import TaskStatus, Job, JobStatus
 from hqcodedeployer.models import Deploy, Stage, Rollback
 from hqframework.exceptions import LaunchTaskException, GetWorkersException
-from hqcodedeployer.validators import DeployValidator, AppTypeValidator
+from hqcodedeployer.validators import DeployValidator
+from hqcodedeployer.framework.scheduler import RollingScheduler, GraphScheduler, resolve_task_dependencies
 
 
-class Framework(AbstractFramework):
+class Framework(TaskEventMixin, WorkerIndexMixin, AbstractFramework):
     def __init__(self):
         super(Framework, self).__init__("codedeployer-deploy", Deploy)
         self.logger = logging.getLogger("hq.framework.codedeployer.deploy")
+        self.app_types = AppTypeRegistry("deploy")
 
     def config_class(self):
         config_class = super(Framework, self).config_class()
@@ -28,20 +39,26 @@ class Framework(AbstractFramework):
         class ConfigValidator(config_class):
             app_type_path = StringType(required=True)
             deploy_path = StringType(required=True)
+            artifact_peer_port = IntType()
+            artifact_peer_fanout = IntType(min_value=1, default=2)
 
         return ConfigValidator
 
     def on_stop(self):
-        pass
+        self.stop_task_events()
 
-    def process_job(self, job_id):
+    def reconcile_job(self, job_id):
         with self.database.session() as session:
-            deploy = session.query(Deploy).join(Job, Deploy.job_id == Job.id). \
-                filter(Job.id == job_id).filter(Job.stopped_at == None).first()
+            deploy = load_job_graph(session, Deploy, job_id)
+
+            if deploy is None:
+                return
+
+            task_counts = TaskStatusCounts(session, job_id)
 
             if deploy.job.status == JobStatus.PENDING:
 
-                if self.tasks_have_status(deploy.job, TaskStatus.PENDING):
+                if task_counts.all(TaskStatus.PENDING):
                     self.logger.info("All deploy tasks are now pending. Starting Deploy "
                                      + deploy.stage.app + " (" + str(deploy.id) + ")")
                     deploy.job.status = JobStatus.RUNNING
@@ -49,7 +66,7 @@ class Framework(AbstractFramework):
             elif deploy.job.status == JobStatus.RUNNING:
 
                 # check if completed
-                if self.tasks_have_status(deploy.job, TaskStatus.FINISHED):
+                if task_counts.all(TaskStatus.FINISHED):
                     self.logger.info("Deploy Completed (" + str(deploy.id) + ")")
                     deploy.job.status = JobStatus.COMPLETED
                     deploy.job.stopped_at = datetime.datetime.now()
@@ -57,7 +74,7 @@ class Framework(AbstractFramework):
                     return
 
                 # check if failed
-                if self.some_task_has_status(deploy.job, TaskStatus.FAILED):
+                if task_counts.some(TaskStatus.FAILED):
                     self.logger.info("Deploy Failed (" + str(deploy.id) + ")")
                     for target_task in deploy.job.targets:
                         for task in target_task.tasks:
@@ -70,48 +87,41 @@ class Framework(AbstractFramework):
                     session.commit()
                     return
 
-                all_finished = True
+                if deploy.task_dependencies is not None:
+                    scheduler = GraphScheduler(deploy.job.targets, deploy.task_dependencies,
+                                               batch_size=deploy.batch_size, max_in_flight=deploy.max_in_flight,
+                                               sync_tasks=deploy.sync_tasks)
+                else:
+                    scheduler = RollingScheduler(deploy.job.targets, batch_size=deploy.batch_size,
+                                                 max_in_flight=deploy.max_in_flight, sync_tasks=deploy.sync_tasks)
 
-                for target_task in deploy.job.targets:
-                    task = target_task.tasks[deploy.job.current_task_index]
+                for target_task, task in scheduler.launchable():
 
                     if task.status == TaskStatus.LOST:
                         self.logger.info("Deploy Task " + str(task.id) + " is lost. Retrying...")
 
-                    if task.status == TaskStatus.PENDING or task.status == TaskStatus.LOST:
-
-                        worker = target_task.worker
-
-                        try:
-                            self.logger.info("Launching Task " + task.name)
-                            self.launch_task(worker, task)
-                        except LaunchTaskException as e:
-                            self.logger.error("Error launching deploy tasks: " + e.message)
-                            task.error_message = e.message
-                            task.stopped_at = datetime.datetime.now()
-                            task.status = TaskStatus.FAILED
-                            session.commit()
-
-                    elif task.status == TaskStatus.RUNNING:
-                        if self.unix_time_millis(datetime.datetime.now()) - \
-                                self.unix_time_millis(task.updated_at) > 60000:
-                            self.logger.warning("Deploy Task " + str(task.id) + " timed out. It is now lost.")
-                            task.status = TaskStatus.LOST
-                            session.commit()
-
-                    if task.status != TaskStatus.FINISHED:
-                        all_finished = False
-
-                if all_finished:
-                    deploy.job.current_task_index += 1
-
-                    if deploy.job.current_task_index >= len(deploy.job.targets[0].tasks):
-                        deploy.job.current_task_index = len(deploy.job.targets[0].tasks)
+                    worker = target_task.worker
 
+                    try:
+                        self.logger.info("Launching Task " + task.name)
+                        self.launch_task(worker, task)
+                    except LaunchTaskException as e:
+                        self.logger.error("Error launching deploy tasks: " + e.message)
+                        task.error_message = e.message
+                        task.stopped_at = datetime.datetime.now()
+                        task.status = TaskStatus.FAILED
+                        session.commit()
+
+                self.track_running_tasks([task for _, task in scheduler.current_tasks()], deploy.task_timeouts)
+                self.expire_tasks(session)
+
+                if deploy.job.current_task_index != scheduler.low:
+                    deploy.job.current_task_index = scheduler.low
                     session.commit()
 
     def registered(self):
-        pass
+        self.app_types.load_all(self.config.app_type_path)
+        self.start_task_events()
 
     def deploy_app(self, data):
 
@@ -150,71 +160,41 @@ class Framework(AbstractFramework):
             session.add(deploy)
             session.flush()
 
-            if not os.path.isfile(self.config.app_type_path + "/" + stage.type + "-deploy.json"):
-                raise cherrypy.HTTPError(404, "Unknown app deploy type " + stage.type)
-
-            try:
-                with open(self.config.app_type_path + "/" + stage.type + "-deploy.json") as f:
-                    app_json = json.load(f)
-
-            except IOError as e:
-                raise cherrypy.HTTPError(500, "Error opening app type file " + e.message)
-            except ValueError as e:
-                raise cherrypy.HTTPError(500, "Error loading app type json " + e.message)
-
             try:
-                app_type = AppTypeValidator(app_json)
-            except ModelConversionError as e:
-                raise cherrypy.HTTPError(400, "App Type JSON Error " + json.dumps(e.message))
+                app_type = self.app_types.get(stage.type)
+            except AppTypeError as e:
+                raise cherrypy.HTTPError(e.status, e.message)
 
-            try:
-                app_type.validate()
-            except ModelValidationError as e:
-                raise cherrypy.HTTPError(400, "App Type JSON Error " + json.dumps(e.message))
+            tasks = list(app_type.tasks or [])
 
             if data.deploy_tasks is not None:
 
                 # Allow tasks to be overwritten
-                for task_index, app_task in enumerate(list(app_type.tasks)):
+                for task_index, app_task in enumerate(list(tasks)):
                     for config_task in list(data.deploy_tasks):
                         if app_task.name == config_task.name \
                                 and app_task.priority == config_task.priority:
-                            app_type.tasks[task_index] = config_task
+                            tasks[task_index] = config_task
                             data.deploy_tasks.remove(config_task)
 
-                app_type.tasks.extend(data.deploy_tasks)
+                tasks.extend(data.deploy_tasks)
 
-            app_type.tasks.sort(key=lambda x: x.priority)
+            tasks.sort(key=lambda x: x.priority)
 
             try:
-                workers = self.get_workers(job.datacenter)
+                worker_index = self.worker_index(job.datacenter)
             except GetWorkersException as e:
                 raise cherrypy.HTTPError(500, e.message)
 
-            for worker in list(workers):
-                if worker.tags['environment'] != data.env:
-                    workers.remove(worker)
-                    continue
-                if data.tags is not None:
-                    for key, value in data.tags.iteritems():
-                        if key not in worker.tags:
-                            workers.remove(worker)
-                            continue
-                        if worker.tags[key] != value:
-                            workers.remove(worker)
-                            continue
-                if data.targets is not None:
-                    if worker.target not in data.targets:
-                        workers.remove(worker)
-                        continue
-                    else:
-                        if stage.app in worker.tags['apps']:
-                            raise cherrypy.HTTPError(400, "Worker " + worker.target + " already has app "
-                                                     + stage.app + " deployed. Cannot bootstrap worker.")
-                else:
-                    if stage.app not in worker.tags['apps']:
-                        workers.remove(worker)
-                        continue
+            if data.targets is not None:
+                workers = worker_index.select(environment=data.env, tags=data.tags, targets=data.targets)
+
+                for worker in workers:
+                    if worker_index.has_app(worker, stage.app):
+                        raise cherrypy.HTTPError(400, "Worker " + worker.target + " already has app "
+                                                 + stage.app + " deployed. Cannot bootstrap worker.")
+            else:
+                workers = worker_index.select(environment=data.env, tags=data.tags, app=stage.app)
 
             if len(workers) == 0:
                 raise cherrypy.HTTPError(500, "No workers to deploy to")
@@ -225,7 +205,18 @@ class Framework(AbstractFramework):
             if data.targets is not None and len(workers) < len(data.targets):
                 raise cherrypy.HTTPError(500, "Could not find all targets to deploy to")
 
-            reobj = re.compile("{(.*?)}")
+            if data.batch_percentage is not None:
+                deploy.batch_size = int(math.ceil(len(workers) * data.batch_percentage / 100.0))
+            else:
+                deploy.batch_size = data.batch_size
+
+            deploy.max_in_flight = data.max_in_flight
+
+            # Targets only wait on each other at sync tasks when rolling or parallel, otherwise every task is a sync point
+            if data.parallel or deploy.batch_size is not None or deploy.max_in_flight is not None:
+                deploy.sync_tasks = [task_index for task_index, task_data in enumerate(tasks)
+                                     if task_data.sync]
+
             variables = {
                 'worker_count': str(len(workers)),
                 'workers': json.dumps([worker.target for worker in workers]),
@@ -237,74 +228,35 @@ class Framework(AbstractFramework):
                 'deploy_id': str(deploy.id),
                 'environment': deploy.environment
             }
+            if stage.artifact_digest is not None:
+                variables['artifact_digest'] = stage.artifact_digest
             if data.tags is not None:
                 deploy.job.tags = data.tags
                 variables = variables.copy()
                 variables.update(data.tags)
 
-            if app_type.variables is not None:
-                for key, value in dict(app_type.variables).iteritems():
-                    variables[key] = value
-
-                for key, value in app_type.variables.iteritems():
-                    result = reobj.findall(value)
-
-                    for var_key in result:
-                        if var_key in variables:
-                            value = value.replace("{" + var_key + "}", variables[var_key])
-
-                    variables[key] = value
-
-            if data.deploy_variables is not None:
-                for key, value in dict(data.deploy_variables).iteritems():
-                    variables[key] = value
-
-                for key, value in data.deploy_variables.iteritems():
-                    result = reobj.findall(value)
-
-                    for var_key in result:
-                        if var_key in variables:
-                            value = value.replace("{" + var_key + "}", variables[var_key])
-
-                    variables[key] = value
-
-            for worker in workers:
-
-                job_target = JobTarget(job=job, worker_id=worker.id)
-                session.add(job_target)
-
-                for task_index, task_data in enumerate(app_type.tasks):
-
-                    try:
-                        task_data.validate()
-                    except ModelValidationError as e:
-                        raise cherrypy.HTTPError(400, "Task validation error " + json.dumps(e.message))
-
-                    task = Task(name=task_data.name, order=task_index, job_target=job_target)
-                    session.add(task)
-                    job_target.tasks.append(task)
-
-                    for action_index, action in enumerate(task_data.actions):
-                        action_obj = Action(processor=action.processor, order=action_index)
-                        session.add(action_obj)
-                        task.actions.append(action_obj)
-
-                        if action.arguments is not None:
-                            for key in action.arguments:
-                                argument = action.arguments[key]
+            try:
+                variables = resolve_variables(variables, app_type.variables, data.deploy_variables)
+            except TemplateError as e:
+                raise cherrypy.HTTPError(400, "Variable error " + e.message)
 
-                                result = reobj.findall(argument)
+            if len(tasks) == 0:
+                raise cherrypy.HTTPError(400, "Deploy has no tasks")
 
-                                for var_key in result:
-                                    if var_key in variables:
-                                        argument = argument.replace("{" + var_key + "}", variables[var_key])
+            deploy.task_timeouts = task_timeouts(tasks, app_type.processor_timeouts)
 
-                                action.arguments[key] = argument
+            try:
+                deploy.task_dependencies = resolve_task_dependencies(tasks)
+            except ValidationError as e:
+                raise cherrypy.HTTPError(400, "Invalid task dependencies " + json.dumps(e.message))
 
-                            action_obj.arguments = action.arguments
+            target_variables = None
+            if self.config.artifact_peer_port is not None:
+                target_variables = peer_variables(workers, self.config.artifact_peer_port,
+                                                  self.config.artifact_peer_fanout)
 
-                if len(job_target.tasks) == 0:
-                    raise cherrypy.HTTPError(400, "Deploy has no tasks")
+            create_job_targets(session, job, [worker.id for worker in workers],
+                               render_tasks(tasks, variables), target_variables)
 
             session.commit()
             session.refresh(job)
@@ -318,105 +270,76 @@ class FrameworkAPI(AbstractFrameworkAPI):
     def __init__(self, framework):
         super(FrameworkAPI, self).__init__(framework, '/cd/deploy')
         self.logger = logging.getLogger("hq.framework.api.codedeployer.deploy")
+        self.events = JobEventsAPI(framework, Deploy, "herqles.framework.cd_deploy.get")
 
     @cherrypy.tools.json_out()
     @cherrypy.tools.auth(permission="herqles.framework.cd_deploy.get")
-    def GET(self, deploy_id=None, page=1, app=None):
+    def GET(self, deploy_id=None, page=1, app=None, before_id=None, per_page=10):
         if deploy_id is None:
 
             deploys = []
 
-            per_page = 10
-            offset = (int(page) - 1) * per_page
+            per_page = page_size(per_page)
 
             with self.framework.database.session() as session:
                 deploy_objects = session.query(Deploy).join(Job, Deploy.job_id == Job.id). \
-                    join(Stage, Deploy.stage_id == Stage.id).order_by(Deploy.id.desc())
+                    join(Stage, Deploy.stage_id == Stage.id).options(job_targets_loader(Deploy, joined=True)). \
+                    order_by(Deploy.id.desc())
 
                 if app is not None:
                     deploy_objects = deploy_objects.filter(Stage.app == app)
 
-                deploy_objects = deploy_objects.limit(per_page).offset(offset)
-
-                for deploy in deploy_objects:
-                    data = {'id': deploy.id,
-                            'job_id': deploy.job.id,
-                            'stage_id': deploy.stage_id,
-                            'environment': deploy.environment,
-                            'datacenter': deploy.job.datacenter,
-                            'status': deploy.job.status.value,
-                            'created_at': self.framework.unix_time_millis(deploy.job.created_at),
-                            'updated_at': self.framework.unix_time_millis(deploy.job.updated_at)}
-
-                    if deploy.job.tags is not None:
-                        data['tags'] = [{key: value} for key, value in deploy.job.tags.iteritems()]
-
-                    if deploy.job.stopped_at is not None:
-                        data['stopped_at'] = self.framework.unix_time_millis(deploy.job.stopped_at)
-
-                    targets = []
-
-                    for job_target in deploy.job.targets:
-                        target = {'target': job_target.worker.target}
-
-                        if deploy.job.status == JobStatus.RUNNING:
-                            target['task_id'] = job_target.tasks[deploy.job.current_task_index].id
-                            target['task_name'] = job_target.tasks[deploy.job.current_task_index].name
+                if before_id is not None:
+                    deploy_objects = deploy_objects.filter(Deploy.id < int(before_id))
+                else:
+                    deploy_objects = deploy_objects.offset((int(page) - 1) * per_page)
 
-                        if deploy.job.status == JobStatus.FAILED:
-                            target['task_id'] = job_target.tasks[deploy.job.current_task_index].id
-                            target['task_name'] = job_target.tasks[deploy.job.current_task_index].name
-                            target['task_error'] = job_target.tasks[deploy.job.current_task_index].error_message
+                deploy_objects = deploy_objects.limit(per_page).all()
+                current_tasks = load_current_tasks(session, [deploy.job for deploy in deploy_objects])
 
-                        targets.append(target)
+                for deploy in deploy_objects:
+                    deploys.append(self.deploy_data(deploy, current_tasks))
 
-                    data['targets'] = targets
+            result = {"deploys": deploys}
 
-                    deploys.append(data)
+            if len(deploys) == per_page:
+                result['next_before_id'] = deploys[-1]['id']
 
-            return {"deploys": deploys}
+            return result
         else:
 
             with self.framework.database.session() as session:
-                deploy = session.query(Deploy).filter(Deploy.id == deploy_id).first()
+                deploy = session.query(Deploy).options(job_targets_loader(Deploy)). \
+                    filter(Deploy.id == deploy_id).first()
 
                 if deploy is None:
                     return {}
 
-                data = {'id': deploy.id,
-                        'job_id': deploy.job.id,
-                        'stage_id': deploy.stage_id,
-                        'environment': deploy.environment,
-                        'datacenter': deploy.job.datacenter,
-                        'status': deploy.job.status.value,
-                        'created_at': self.framework.unix_time_millis(deploy.job.created_at),
-                        'updated_at': self.framework.unix_time_millis(deploy.job.updated_at)}
-
-                if deploy.job.tags is not None:
-                    data['tags'] = [{key: value} for key, value in deploy.job.tags.iteritems()]
-
-                if deploy.job.stopped_at is not None:
-                    data['stopped_at'] = self.framework.unix_time_millis(deploy.job.stopped_at)
+                data = self.deploy_data(deploy, load_current_tasks(session, [deploy.job]))
+                data['critical_path'] = critical_path(session, deploy.job, self.framework.unix_time_millis,
+                                                      deploy.task_dependencies)
 
-                targets = []
-
-                for job_target in deploy.job.targets:
-                    target = {'target': job_target.worker.target}
+                return data
 
-                    if deploy.job.status == JobStatus.RUNNING:
-                        target['task_id'] = job_target.tasks[deploy.job.current_task_index].id
-                        target['task_name'] = job_target.tasks[deploy.job.current_task_index].name
+    def deploy_data(self, deploy, current_tasks):
+        data = {'id': deploy.id,
+                'job_id': deploy.job.id,
+                'stage_id': deploy.stage_id,
+                'environment': deploy.environment,
+                'datacenter': deploy.job.datacenter,
+                'status': deploy.job.status.value,
+                'created_at': self.framework.unix_time_millis(deploy.job.created_at),
+                'updated_at': self.framework.unix_time_millis(deploy.job.updated_at)}
 
-                    if deploy.job.status == JobStatus.FAILED:
-                        target['task_id'] = job_target.tasks[deploy.job.current_task_index].id
-                        target['task_name'] = job_target.tasks[deploy.job.current_task_index].name
-                        target['task_error'] = job_target.tasks[deploy.job.current_task_index].error_message
+        if deploy.job.tags is not None:
+            data['tags'] = [{key: value} for key, value in deploy.job.tags.iteritems()]
 
-                    targets.append(target)
+        if deploy.job.stopped_at is not None:
+            data['stopped_at'] = self.framework.unix_time_millis(deploy.job.stopped_at)
 
-                data['targets'] = targets
+        data['targets'] = targets_data(deploy.job, current_tasks)
 
-                return data
+        return data
 
     @cherrypy.tools.json_in()
     @cherrypy.tools.json_out()
@@ -0,0 +1,207 @@
+import json
+import logging
+import threading
+import time
+import datetime
+from abc import ABCMeta, abstractmethod
+
+import pika
+from schematics.types import StringType
+
+from hqlib.sql.models import Task, TaskStatus
+from hqcodedeployer.framework.timeouts import DeadlineQueue, DEFAULT_TASK_TIMEOUT
+
+
+class TaskEventListener(threading.Thread):
+
+    def __init__(self, url, exchange, callback):
+        super(TaskEventListener, self).__init__()
+        self.daemon = True
+        self.logger = logging.getLogger("hq.framework.codedeployer.events")
+        self.url = url
+        self.exchange = exchange
+        self.callback = callback
+        self.connection = None
+        self.stopped = False
+
+    def run(self):
+        while not self.stopped:
+            try:
+                self.connection = pika.BlockingConnection(pika.URLParameters(self.url))
+                channel = self.connection.channel()
+                channel.exchange_declare(exchange=self.exchange, type='fanout')
+
+                queue = channel.queue_declare(exclusive=True).method.queue
+                channel.queue_bind(exchange=self.exchange, queue=queue)
+
+                channel.basic_consume(self.on_message, queue=queue, no_ack=True)
+                channel.start_consuming()
+            except Exception as e:
+                if self.stopped:
+                    break
+                self.logger.error("Task event listener error " + str(e) + ". Reconnecting...")
+                time.sleep(5)
+
+    def on_message(self, channel, method, properties, body):
+        try:
+            message = json.loads(body)
+            task_id = message['task_id']
+        except (ValueError, KeyError, TypeError):
+            self.logger.warning("Ignoring malformed task event " + str(body))
+            return
+
+        try:
+            self.callback(task_id, message)
+        except Exception:
+            self.logger.exception("Error handling task event for task " + str(task_id))
+
+    def stop(self):
+        self.stopped = True
+
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+
+
+class TaskEventMixin(object):
+
+    # Listens for the heartbeats and artifact digests workers publish for their tasks when
+    # task_event_url is configured. Jobs only move forward when process_job reconciles them, which
+    # also wakes up the streams watching that job.
+    #
+    # Running tasks are timed out from a deadline queue. Every task event or worker heartbeat for a
+    # task pushes its deadline back, so a tick only has to look at tasks that are actually overdue.
+
+    __metaclass__ = ABCMeta
+
+    def __init__(self, *args, **kwargs):
+        super(TaskEventMixin, self).__init__(*args, **kwargs)
+        self.task_events = None
+        self.event_lock = threading.RLock()
+        self.job_changed = threading.Condition()
+        self.job_watchers = {}
+        self.task_deadlines = DeadlineQueue()
+
+    def config_class(self):
+        config_class = super(TaskEventMixin, self).config_class()
+
+        class ConfigValidator(config_class):
+            task_event_url = StringType()
+            task_event_exchange = StringType(default='hq-task-events')
+
+        return ConfigValidator
+
+    def start_task_events(self):
+        if self.config.task_event_url is None:
+            return
+
+        self.task_events = TaskEventListener(self.config.task_event_url, self.config.task_event_exchange,
+                                             self.task_event)
+        self.task_events.start()
+
+    def stop_task_events(self):
+        if self.task_events is not None:
+            self.task_events.stop()
+            self.task_events = None
+
+    def process_job(self, job_id):
+        with self.event_lock:
+            self.reconcile_job(job_id)
+
+        self.notify_job_change(job_id)
+
+    def watch_job(self, job_id):
+        # Job changes are only counted for jobs somebody is watching, as [watchers, version]
+        with self.job_changed:
+            self.job_watchers.setdefault(job_id, [0, 0])[0] += 1
+            return self.job_watchers[job_id][1]
+
+    def unwatch_job(self, job_id):
+        with self.job_changed:
+            watchers = self.job_watchers[job_id]
+            watchers[0] -= 1
+            if watchers[0] == 0:
+                del self.job_watchers[job_id]
+
+    def notify_job_change(self, job_id):
+        with self.job_changed:
+            if job_id in self.job_watchers:
+                self.job_watchers[job_id][1] += 1
+                self.job_changed.notify_all()
+
+    def wait_for_job_change(self, job_id, version, timeout):
+        # Waits until the watched job changed from version or the timeout passed, returns its version
+        deadline = time.time() + timeout
+
+        with self.job_changed:
+            while self.job_watchers[job_id][1] == version:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.job_changed.wait(remaining)
+
+            return self.job_watchers[job_id][1]
+
+    @abstractmethod
+    def reconcile_job(self, job_id):
+        pass
+
+    def task_event(self, task_id, message=None):
+        if message is not None and message.get('heartbeat', False):
+            self.task_heartbeat(task_id)
+            return
+
+        if message is not None and 'artifact' in message:
+            with self.database.session() as session:
+                task = session.query(Task).filter(Task.id == task_id).first()
+                if task is not None:
+                    self.task_artifact(session, task.job_target.job, message['artifact'])
+            return
+
+        self.logger.warning("Ignoring task event without a heartbeat or artifact for task " + str(task_id))
+
+    def task_artifact(self, session, job, digest):
+        # Called when a worker reports the digest of an artifact it stored for a task of the job
+        self.logger.warning("Ignoring artifact " + str(digest) + " reported for job " + str(job.id))
+
+    def task_heartbeat(self, task_id):
+        # Heartbeats only push the deadline of a running task back, they never touch the database
+        if task_id in self.task_deadlines:
+            self.task_deadlines.touch(task_id, self.now_seconds())
+
+    def now_seconds(self):
+        return self.unix_time_millis(datetime.datetime.now()) / 1000.0
+
+    def task_timeout(self, timeouts, task):
+        if timeouts is None or task.order >= len(timeouts):
+            return DEFAULT_TASK_TIMEOUT
+
+        return timeouts[task.order]
+
+    def track_running_tasks(self, tasks, timeouts):
+        # Starts the timeout clock for running tasks not being tracked yet, e.g. after a restart
+        for task in tasks:
+            if task.status == TaskStatus.RUNNING and task.id not in self.task_deadlines:
+                self.task_deadlines.track(task.id, self.unix_time_millis(task.updated_at) / 1000.0,
+                                          self.task_timeout(timeouts, task))
+
+    def expire_tasks(self, session):
+        now = self.now_seconds()
+
+        for task_id, last_seen, timeout in self.task_deadlines.expired(now):
+            task = session.query(Task).filter(Task.id == task_id).first()
+
+            if task is None or task.status != TaskStatus.RUNNING:
+                continue
+
+            last_seen = max(last_seen, self.unix_time_millis(task.updated_at) / 1000.0)
+
+            if now - last_seen < timeout:
+                self.task_deadlines.touch(task_id, last_seen, timeout)
+                continue
+
+            self.logger.warning("Task " + str(task.id) + " timed out after " + str(timeout) + "s. It is now lost.")
+            task.status = TaskStatus.LOST
+            session.commit()
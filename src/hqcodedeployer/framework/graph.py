@@ -0,0 +1,140 @@
+from sqlalchemy import func, and_, case
+from sqlalchemy.orm import contains_eager, joinedload
+
+from hqlib.sql.models import Task, TaskStatus, Job, JobTarget, JobStatus
+from hqcodedeployer.framework.bulk import foreign_key
+
+MAX_PER_PAGE = 100
+
+
+class TaskStatusCounts(object):
+
+    # Task status totals for a whole job from a single GROUP BY
+
+    def __init__(self, session, job_id):
+        rows = session.query(Task.status, func.count(Task.id)).join(Task.job_target). \
+            filter(JobTarget.job_id == job_id).group_by(Task.status).all()
+
+        self.counts = dict(rows)
+        self.total = sum(self.counts.values())
+
+    def all(self, status):
+        return self.total > 0 and self.counts.get(status, 0) == self.total
+
+    def some(self, status):
+        return self.counts.get(status, 0) > 0
+
+
+def load_job_graph(session, model, job_id):
+    # Loads a running stage/deploy/rollback with its job, targets, their tasks and workers in one query.
+    # Reconciling commits as it goes, keep those commits from expiring the graph and loading it again.
+    session.expire_on_commit = False
+
+    return session.query(model).join(Job, model.job_id == Job.id). \
+        options(contains_eager(model.job).joinedload(Job.targets).joinedload(JobTarget.tasks),
+                contains_eager(model.job).joinedload(Job.targets).joinedload(JobTarget.worker)). \
+        filter(Job.id == job_id).filter(Job.stopped_at == None).first()
+
+
+def load_current_tasks(session, jobs):
+    # The first unfinished task of every target of the given jobs, keyed by job target id, in one query.
+    # Targets can be on different tasks so the job wide current_task_index is not used.
+    job_ids = [job.id for job in jobs]
+
+    if len(job_ids) == 0:
+        return {}
+
+    job_target_key = foreign_key(Task.job_target)
+    job_target_column = Task.__table__.c[job_target_key]
+
+    cursors = session.query(job_target_column.label('job_target_id'), func.min(Task.order).label('order')). \
+        join(Task.job_target).filter(JobTarget.job_id.in_(job_ids)).filter(Task.status != TaskStatus.FINISHED). \
+        group_by(job_target_column).subquery()
+
+    tasks = session.query(Task).join(cursors, and_(job_target_column == cursors.c.job_target_id,
+                                                   Task.order == cursors.c.order)).all()
+
+    return dict((getattr(task, job_target_key), task) for task in tasks)
+
+
+def targets_data(job, current_tasks):
+    targets = []
+
+    for job_target in job.targets:
+        target = {'target': job_target.worker.target}
+        task = current_tasks.get(job_target.id)
+
+        if task is not None and job.status in [JobStatus.RUNNING, JobStatus.FAILED]:
+            target['task_id'] = task.id
+            target['task_name'] = task.name
+
+            if job.status == JobStatus.FAILED:
+                target['task_error'] = task.error_message
+
+        targets.append(target)
+
+    return targets
+
+
+def page_size(per_page):
+    return min(max(int(per_page), 1), MAX_PER_PAGE)
+
+
+def job_targets_loader(model, joined=False):
+    # Loader option for model.job with its targets and their workers, use joined when the query already joins Job
+    if joined:
+        job = contains_eager(model.job)
+    else:
+        job = joinedload(model.job)
+
+    return job.subqueryload(Job.targets).joinedload(JobTarget.worker)
+
+
+def critical_path(session, job, unix_time_millis, dependencies=None):
+    # The chain of tasks that decided how long the job took, or is taking.
+    #
+    # A task finishes when its last target finishes it. Each task is assumed to start as soon as its
+    # dependencies finished, so its duration is the time from then until it finished. Tasks that did
+    # not finish yet are left out of the duration. dependencies None means the tasks ran in order.
+    rows = session.query(Task.order, Task.name, func.max(Task.stopped_at),
+                         func.sum(case([(Task.status == TaskStatus.FINISHED, 0)], else_=1))). \
+        join(Task.job_target).filter(JobTarget.job_id == job.id).group_by(Task.order, Task.name). \
+        order_by(Task.order).all()
+
+    if dependencies is None:
+        dependencies = [[order - 1] if order > 0 else [] for order in range(len(rows))]
+
+    tasks = {}
+    for order, name, stopped_at, unfinished in rows:
+        finished_at = unix_time_millis(stopped_at) if stopped_at is not None and unfinished == 0 else None
+        tasks[order] = (name, finished_at)
+
+    paths = {}
+
+    def longest(order):
+        # (duration, path) of the longest chain ending with the task
+        if order in paths:
+            return paths[order]
+
+        start = unix_time_millis(job.created_at)
+        before = (0, [])
+
+        for dependency in dependencies[order]:
+            path = longest(dependency)
+            if (path[0], len(path[1])) > (before[0], len(before[1])):
+                before = path
+            if tasks[dependency][1] is not None:
+                start = max(start, tasks[dependency][1])
+
+        name, finished_at = tasks[order]
+        duration = finished_at - start if finished_at is not None else None
+
+        paths[order] = (before[0] + (duration or 0), before[1] + [{'name': name, 'duration': duration}])
+        return paths[order]
+
+    if len(tasks) == 0:
+        return {'duration': 0, 'tasks': []}
+
+    duration, path = max((longest(order) for order in tasks), key=lambda path: (path[0], len(path[1])))
+
+    return {'duration': duration, 'tasks': path}
@@ -0,0 +1,15 @@
+def peer_variables(workers, port, fanout):
+    # Arranges the workers of a deploy in a tree where every worker has up to fanout children.
+    # Each worker gets its parent as artifact_peer, the root fetches from the origin, so an artifact
+    # reaches every worker after log(N) hops instead of N downloads from the origin.
+    variables = {}
+
+    for index, worker in enumerate(workers):
+        if index == 0:
+            peer = ''
+        else:
+            peer = "http://" + workers[(index - 1) // fanout].target + ":" + str(port)
+
+        variables[worker.id] = {'artifact_peer': peer}
+
+    return variables
@@ -3,23 +3,32 @@ import logging
 import datetime
 
 import cherrypy
-import os
-from schematics.exceptions import ModelValidationError, ModelConversionError
+from schematics.exceptions import ModelValidationError, ModelConversionError, ValidationError
 
 from schematics.types import StringType
-import re
 
 from hqframework.framework import AbstractFramework, AbstractFrameworkAPI
+from hqcodedeployer.framework.events import TaskEventMixin
+from hqcodedeployer.framework.apptypes import AppTypeRegistry, AppTypeError
+from hqcodedeployer.framework.workers import WorkerIndexMixin
+from hqcodedeployer.framework.graph import load_job_graph, TaskStatusCounts, load_current_tasks, targets_data, \
+    job_targets_loader, page_size, critical_path
+from hqcodedeployer.framework.bulk import create_job_targets, render_tasks
+from hqcodedeployer.framework.timeouts import task_timeouts
+from hqcodedeployer.framework.templates import resolve_variables, TemplateError
+from hqcodedeployer.framework.stream import JobEventsAPI
+from hqcodedeployer.framework.scheduler import RollingScheduler, GraphScheduler, resolve_task_dependencies
 from hqcodedeployer.models import Deploy, Rollback, Stage
-from hqlib.sql.models import Task, TaskStatus, Job, JobStatus, JobTarget, Action
+from hqlib.sql.models import TaskStatus, Job, JobStatus
 from hqframework.exceptions import LaunchTaskException, GetWorkersException
-from hqcodedeployer.validators import RollbackValidator, AppTypeValidator
+from hqcodedeployer.validators import RollbackValidator
 
 
-class Framework(AbstractFramework):
+class Framework(TaskEventMixin, WorkerIndexMixin, AbstractFramework):
     def __init__(self):
         super(Framework, self).__init__("codedeployer-rollback", Rollback)
         self.logger = logging.getLogger("hq.framework.codedeployer.rollback")
+        self.app_types = AppTypeRegistry("rollback")
 
     def config_class(self):
         config_class = super(Framework, self).config_class()
@@ -31,16 +40,21 @@ class Framework(AbstractFramework):
         return ConfigValidator
 
     def registered(self):
-        pass
+        self.app_types.load_all(self.config.app_type_path)
+        self.start_task_events()
 
-    def process_job(self, job_id):
+    def reconcile_job(self, job_id):
         with self.database.session() as session:
-            rollback = session.query(Rollback).join(Job, Rollback.job_id == Job.id). \
-                filter(Job.id == job_id).filter(Job.stopped_at == None).first()
+            rollback = load_job_graph(session, Rollback, job_id)
+
+            if rollback is None:
+                return
+
+            task_counts = TaskStatusCounts(session, job_id)
 
             if rollback.job.status == JobStatus.PENDING:
 
-                if self.tasks_have_status(rollback.job, TaskStatus.PENDING):
+                if task_counts.all(TaskStatus.PENDING):
                     self.logger.info("All rollback tasks are now pending. Starting Rollback "
                                      + rollback.stage.app + " (" + str(rollback.id) + ")")
                     rollback.job.status = JobStatus.RUNNING
@@ -48,7 +62,7 @@ class Framework(AbstractFramework):
             elif rollback.job.status == JobStatus.RUNNING:
 
                 # check if completed
-                if self.tasks_have_status(rollback.job, TaskStatus.FINISHED):
+                if task_counts.all(TaskStatus.FINISHED):
                     self.logger.info("Rollback Completed (" + str(rollback.id) + ")")
                     rollback.job.status = JobStatus.COMPLETED
                     rollback.job.stopped_at = datetime.datetime.now()
@@ -56,7 +70,7 @@ class Framework(AbstractFramework):
                     return
 
                 # check if failed
-                if self.some_task_has_status(rollback.job, TaskStatus.FAILED):
+                if task_counts.some(TaskStatus.FAILED):
                     self.logger.info("Rollback Failed (" + str(rollback.id) + ")")
                     for target_task in rollback.job.targets:
                         for task in target_task.tasks:
@@ -70,48 +84,38 @@ class Framework(AbstractFramework):
                     session.commit()
                     return
 
-                all_finished = True
+                if rollback.task_dependencies is not None:
+                    scheduler = GraphScheduler(rollback.job.targets, rollback.task_dependencies,
+                                               sync_tasks=rollback.sync_tasks)
+                else:
+                    scheduler = RollingScheduler(rollback.job.targets, sync_tasks=rollback.sync_tasks)
 
-                for target_task in rollback.job.targets:
-                    task = target_task.tasks[rollback.job.current_task_index]
+                for target_task, task in scheduler.launchable():
 
                     if task.status == TaskStatus.LOST:
                         self.logger.info("Rollback Task " + str(task.id) + " is lost. Retrying...")
 
-                    if task.status == TaskStatus.PENDING or task.status == TaskStatus.LOST:
-
-                        worker = target_task.worker
-
-                        try:
-                            self.logger.info("Launching Task " + task.name)
-                            self.launch_task(worker, task)
-                        except LaunchTaskException as e:
-                            self.logger.error("Error launching rollback tasks: " + e.message)
-                            task.error_message = e.message
-                            task.stopped_at = datetime.datetime.now()
-                            task.status = TaskStatus.FAILED
-                            session.commit()
-
-                    elif task.status == TaskStatus.RUNNING:
-                        if self.unix_time_millis(datetime.datetime.now()) - \
-                                self.unix_time_millis(task.updated_at) > 60000:
-                            self.logger.warning("Rollback Task " + str(task.id) + " timed out. It is now lost.")
-                            task.status = TaskStatus.LOST
-                            session.commit()
-
-                    if task.status != TaskStatus.FINISHED:
-                        all_finished = False
-
-                if all_finished:
-                    rollback.job.current_task_index += 1
-
-                    if rollback.job.current_task_index >= len(rollback.job.targets[0].tasks):
-                        rollback.job.current_task_index = len(rollback.job.targets[0].tasks)
+                    worker = target_task.worker
 
+                    try:
+                        self.logger.info("Launching Task " + task.name)
+                        self.launch_task(worker, task)
+                    except LaunchTaskException as e:
+                        self.logger.error("Error launching rollback tasks: " + e.message)
+                        task.error_message = e.message
+                        task.stopped_at = datetime.datetime.now()
+                        task.status = TaskStatus.FAILED
+                        session.commit()
+
+                self.track_running_tasks([task for _, task in scheduler.current_tasks()], rollback.task_timeouts)
+                self.expire_tasks(session)
+
+                if rollback.job.current_task_index != scheduler.low:
+                    rollback.job.current_task_index = scheduler.low
                     session.commit()
 
     def on_stop(self):
-        pass
+        self.stop_task_events()
 
     def rollback_app(self, data):
 
@@ -144,68 +148,40 @@ class Framework(AbstractFramework):
             session.add(rollback)
             session.flush()
 
-            if not os.path.isfile(self.config.app_type_path + "/" + rollback.type + "-rollback.json"):
-                raise cherrypy.HTTPError(404, "Unknown app rollback type " + rollback.type)
-
-            try:
-                with open(self.config.app_type_path + "/" + rollback.type + "-rollback.json") as f:
-                    app_json = json.load(f)
-
-            except IOError as e:
-                raise cherrypy.HTTPError(500, "Error opening app type file " + e.message)
-            except ValueError as e:
-                raise cherrypy.HTTPError(500, "Error loading app type json " + e.message)
-
             try:
-                app_type = AppTypeValidator(app_json)
-            except ModelConversionError as e:
-                raise cherrypy.HTTPError(400, "App Type JSON Error " + json.dumps(e.message))
+                app_type = self.app_types.get(rollback.type)
+            except AppTypeError as e:
+                raise cherrypy.HTTPError(e.status, e.message)
 
-            try:
-                app_type.validate()
-            except ModelValidationError as e:
-                raise cherrypy.HTTPError(400, "App Type JSON Error " + json.dumps(e.message))
+            tasks = list(app_type.tasks or [])
 
             if data.rollback_tasks is not None:
 
                 # Allow tasks to be overwritten
-                for task_index, app_task in enumerate(list(app_type.tasks)):
+                for task_index, app_task in enumerate(list(tasks)):
                     for config_task in list(data.rollback_tasks):
                         if app_task.name == config_task.name \
                                 and app_task.priority == config_task.priority:
-                            app_type.tasks[task_index] = config_task
+                            tasks[task_index] = config_task
                             data.rollback_tasks.remove(config_task)
 
-                app_type.tasks.extend(data.rollback_tasks)
+                tasks.extend(data.rollback_tasks)
 
-            app_type.tasks.sort(key=lambda x: x.priority)
+            tasks.sort(key=lambda x: x.priority)
 
             try:
-                workers = self.get_workers(job.datacenter)
+                worker_index = self.worker_index(job.datacenter)
             except GetWorkersException as e:
                 raise cherrypy.HTTPError(500, e.message)
 
-            for worker in list(workers):
-                if worker.tags['environment'] != data.env:
-                    workers.remove(worker)
-                    continue
-                if data.tags is not None:
-                    for key, value in data.tags.iteritems():
-                        if key not in worker.tags:
-                            workers.remove(worker)
-                            continue
-                        if worker.tags[key] != value:
-                            workers.remove(worker)
-                            continue
-                else:
-                    if data.app not in worker.tags['apps']:
-                        workers.remove(worker)
-                        continue
+            if data.tags is not None:
+                workers = worker_index.select(environment=data.env, tags=data.tags)
+            else:
+                workers = worker_index.select(environment=data.env, app=data.app)
 
             if len(workers) == 0:
                 raise cherrypy.HTTPError(500, "No workers to rollback to")
 
-            reobj = re.compile("{(.*?)}")
             variables = {
                 'worker_count': str(len(workers)),
                 'workers': json.dumps([worker.target for worker in workers]),
@@ -221,69 +197,27 @@ class Framework(AbstractFramework):
                 variables = variables.copy()
                 variables.update(data.tags)
 
-            if app_type.variables is not None:
-                for key, value in dict(app_type.variables).iteritems():
-                    variables[key] = value
-
-                for key, value in app_type.variables.iteritems():
-                    result = reobj.findall(value)
-
-                    for var_key in result:
-                        if var_key in variables:
-                            value = value.replace("{" + var_key + "}", variables[var_key])
-
-                    variables[key] = value
-
-            if data.rollback_variables is not None:
-                for key, value in dict(data.rollback_variables).iteritems():
-                    variables[key] = value
-
-                for key, value in data.rollback_variables.iteritems():
-                    result = reobj.findall(value)
-
-                    for var_key in result:
-                        if var_key in variables:
-                            value = value.replace("{" + var_key + "}", variables[var_key])
-
-                    variables[key] = value
-
-            for worker in workers:
-
-                job_target = JobTarget(job=job, worker_id=worker.id)
-                session.add(job_target)
-
-                for task_index, task_data in enumerate(app_type.tasks):
-
-                    try:
-                        task_data.validate()
-                    except ModelValidationError as e:
-                        raise cherrypy.HTTPError(400, "Task validation error " + json.dumps(e.message))
-
-                    task = Task(name=task_data.name, order=task_index, job_target=job_target)
-                    session.add(task)
-                    job_target.tasks.append(task)
-
-                    for action_index, action in enumerate(task_data.actions):
-                        action_obj = Action(processor=action.processor, order=action_index)
-                        session.add(action_obj)
-                        task.actions.append(action_obj)
-
-                        if action.arguments is not None:
-                            for key in action.arguments:
-                                argument = action.arguments[key]
+            try:
+                variables = resolve_variables(variables, app_type.variables, data.rollback_variables)
+            except TemplateError as e:
+                raise cherrypy.HTTPError(400, "Variable error " + e.message)
 
-                                result = reobj.findall(argument)
+            if len(tasks) == 0:
+                raise cherrypy.HTTPError(400, "Rollback has no tasks")
 
-                                for var_key in result:
-                                    if var_key in variables:
-                                        argument = argument.replace("{" + var_key + "}", variables[var_key])
+            # Targets only wait on each other at sync tasks when parallel, otherwise every task is a sync point
+            if data.parallel:
+                rollback.sync_tasks = [task_index for task_index, task_data in enumerate(tasks) if task_data.sync]
 
-                                action.arguments[key] = argument
+            rollback.task_timeouts = task_timeouts(tasks, app_type.processor_timeouts)
 
-                            action_obj.arguments = action.arguments
+            try:
+                rollback.task_dependencies = resolve_task_dependencies(tasks)
+            except ValidationError as e:
+                raise cherrypy.HTTPError(400, "Invalid task dependencies " + json.dumps(e.message))
 
-                if len(job_target.tasks) == 0:
-                    raise cherrypy.HTTPError(400, "Rollback has no tasks")
+            create_job_targets(session, job, [worker.id for worker in workers],
+                               render_tasks(tasks, variables))
 
             session.commit()
             session.refresh(job)
@@ -297,105 +231,75 @@ class FrameworkAPI(AbstractFrameworkAPI):
     def __init__(self, framework):
         super(FrameworkAPI, self).__init__(framework, '/cd/rollback')
         self.logger = logging.getLogger("hq.framework.api.codedeployer.rollback")
+        self.events = JobEventsAPI(framework, Rollback, "herqles.framework.cd_rollback.get")
 
     @cherrypy.tools.json_out()
     @cherrypy.tools.auth(permission="herqles.framework.cd_rollback.get")
-    def GET(self, rollback_id=None, page=1, app=None):
+    def GET(self, rollback_id=None, page=1, app=None, before_id=None, per_page=10):
         if rollback_id is None:
 
             rollbacks = []
 
-            per_page = 10
-            offset = (int(page) - 1) * per_page
+            per_page = page_size(per_page)
 
             with self.framework.database.session() as session:
                 rollback_objects = session.query(Rollback).join(Job, Rollback.job_id == Job.id) \
-                    .order_by(Rollback.id.desc())
+                    .options(job_targets_loader(Rollback, joined=True)).order_by(Rollback.id.desc())
 
                 if app is not None:
-                    rollback_objects = rollback_objects.filter(Stage.app == app)
-
-                rollback_objects = rollback_objects.limit(per_page).offset(offset)
-
-                for rollback in rollback_objects:
-                    data = {'id': rollback.id,
-                            'job_id': rollback.job.id,
-                            'app': rollback.app,
-                            'environment': rollback.environment,
-                            'datacenter': rollback.job.datacenter,
-                            'status': rollback.job.status.value,
-                            'created_at': self.framework.unix_time_millis(rollback.job.created_at),
-                            'updated_at': self.framework.unix_time_millis(rollback.job.updated_at)}
-
-                    if rollback.job.tags is not None:
-                        data['tags'] = [{key: value} for key, value in rollback.job.tags.iteritems()]
-
-                    targets = []
+                    rollback_objects = rollback_objects.filter(Rollback.app == app)
 
-                    for job_target in rollback.job.targets:
-                        target = {'target': job_target.worker.target}
-
-                        if rollback.job.status == JobStatus.RUNNING:
-                            target['task_id'] = job_target.tasks[rollback.job.current_task_index].id
-                            target['task_name'] = job_target.tasks[rollback.job.current_task_index].name
-
-                        if rollback.job.status == JobStatus.FAILED:
-                            target['task_id'] = job_target.tasks[rollback.job.current_task_index].id
-                            target['task_name'] = job_target.tasks[rollback.job.current_task_index].name
-                            target['task_error'] = job_target.tasks[rollback.job.current_task_index].error_message
+                if before_id is not None:
+                    rollback_objects = rollback_objects.filter(Rollback.id < int(before_id))
+                else:
+                    rollback_objects = rollback_objects.offset((int(page) - 1) * per_page)
 
-                        targets.append(target)
+                rollback_objects = rollback_objects.limit(per_page).all()
+                current_tasks = load_current_tasks(session, [rollback.job for rollback in rollback_objects])
 
-                    data['targets'] = targets
+                for rollback in rollback_objects:
+                    rollbacks.append(self.rollback_data(rollback, current_tasks))
 
-                    if rollback.job.stopped_at is not None:
-                        data['stopped_at'] = self.framework.unix_time_millis(rollback.job.stopped_at)
+            result = {"rollbacks": rollbacks}
 
-                    rollbacks.append(data)
+            if len(rollbacks) == per_page:
+                result['next_before_id'] = rollbacks[-1]['id']
 
-            return {"rollbacks": rollbacks}
+            return result
         else:
 
             with self.framework.database.session() as session:
-                rollback = session.query(Rollback).filter(Rollback.id == rollback_id).first()
+                rollback = session.query(Rollback).options(job_targets_loader(Rollback)). \
+                    filter(Rollback.id == rollback_id).first()
 
                 if rollback is None:
                     return {}
 
-                data = {'id': rollback.id,
-                        'job_id': rollback.job.id,
-                        'app': rollback.app,
-                        'environment': rollback.environment,
-                        'datacenter': rollback.job.datacenter,
-                        'status': rollback.job.status.value,
-                        'created_at': self.framework.unix_time_millis(rollback.job.created_at),
-                        'updated_at': self.framework.unix_time_millis(rollback.job.updated_at)}
-
-                if rollback.job.tags is not None:
-                    data['tags'] = [{key: value} for key, value in rollback.job.tags.iteritems()]
-
-                targets = []
+                data = self.rollback_data(rollback, load_current_tasks(session, [rollback.job]))
+                data['critical_path'] = critical_path(session, rollback.job, self.framework.unix_time_millis,
+                                                      rollback.task_dependencies)
 
-                for job_target in rollback.job.targets:
-                    target = {'target': job_target.worker.target}
-
-                    if rollback.job.status == JobStatus.RUNNING:
-                        target['task_id'] = job_target.tasks[rollback.job.current_task_index].id
-                        target['task_name'] = job_target.tasks[rollback.job.current_task_index].name
+                return data
 
-                    if rollback.job.status == JobStatus.FAILED:
-                        target['task_id'] = job_target.tasks[rollback.job.current_task_index].id
-                        target['task_name'] = job_target.tasks[rollback.job.current_task_index].name
-                        target['task_error'] = job_target.tasks[rollback.job.current_task_index].error_message
+    def rollback_data(self, rollback, current_tasks):
+        data = {'id': rollback.id,
+                'job_id': rollback.job.id,
+                'app': rollback.app,
+                'environment': rollback.environment,
+                'datacenter': rollback.job.datacenter,
+                'status': rollback.job.status.value,
+                'created_at': self.framework.unix_time_millis(rollback.job.created_at),
+                'updated_at': self.framework.unix_time_millis(rollback.job.updated_at)}
 
-                    targets.append(target)
+        if rollback.job.tags is not None:
+            data['tags'] = [{key: value} for key, value in rollback.job.tags.iteritems()]
 
-                data['targets'] = targets
+        data['targets'] = targets_data(rollback.job, current_tasks)
 
-                if rollback.job.stopped_at is not None:
-                    data['stopped_at'] = self.framework.unix_time_millis(rollback.job.stopped_at)
+        if rollback.job.stopped_at is not None:
+            data['stopped_at'] = self.framework.unix_time_millis(rollback.job.stopped_at)
 
-                return data
+        return data
 
     @cherrypy.tools.json_in()
     @cherrypy.tools.json_out()
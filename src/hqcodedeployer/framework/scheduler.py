@@ -0,0 +1,212 @@
+from schematics.exceptions import ValidationError
+
+from hqlib.sql.models import TaskStatus
+from hqcodedeployer.validators.task import TaskValidator, check_dependencies
+
+
+def first_unfinished(target):
+    for index, task in enumerate(target.tasks):
+        if task.status != TaskStatus.FINISHED:
+            return index
+
+    return len(target.tasks)
+
+
+class RollingScheduler(object):
+
+    # Decides which task of which target may be launched on a tick.
+    #
+    # Every target moves through its own task list. A task index listed in
+    # sync_tasks is a barrier: no target starts it until every target has
+    # finished all tasks before it. When sync_tasks is None every task is a
+    # barrier, which is the old lockstep behaviour.
+    #
+    # batch_size limits how many targets may be working inside the current
+    # segment (between two barriers) at once; a target waiting on a barrier
+    # gives its slot up. max_in_flight limits how many tasks may be running
+    # across the whole job.
+
+    def __init__(self, targets, batch_size=None, max_in_flight=None, sync_tasks=None):
+        self.targets = targets
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+
+        self.task_count = len(targets[0].tasks) if len(targets) > 0 else 0
+
+        if sync_tasks is None:
+            self.sync_tasks = set(range(self.task_count))
+        else:
+            self.sync_tasks = set(sync_tasks)
+
+        self.cursors = [self.cursor(target) for target in targets]
+        self.low = min(self.cursors) if len(self.cursors) > 0 else 0
+
+    def cursor(self, target):
+        return first_unfinished(target)
+
+    def segment_start(self, index):
+        starts = [sync_index for sync_index in self.sync_tasks if sync_index <= index]
+
+        if len(starts) == 0:
+            return 0
+
+        return max(starts)
+
+    def is_blocked(self, index):
+        return index in self.sync_tasks and index > self.low
+
+    def is_active(self, target, index):
+        if index >= self.task_count or self.is_blocked(index):
+            return False
+
+        if target.tasks[index].status != TaskStatus.PENDING:
+            return True
+
+        return index != self.segment_start(index)
+
+    def current_tasks(self):
+        # (target, task) pairs for the task each unfinished target is on
+        current = []
+
+        for target, index in zip(self.targets, self.cursors):
+            if index < self.task_count:
+                current.append((target, target.tasks[index]))
+
+        return current
+
+    def launchable(self):
+        active = 0
+        in_flight = 0
+
+        for target, index in zip(self.targets, self.cursors):
+            if self.is_active(target, index):
+                active += 1
+
+            if index < self.task_count and target.tasks[index].status in [TaskStatus.RUNNING, TaskStatus.LOST]:
+                in_flight += 1
+
+        launch = []
+
+        for target, index in zip(self.targets, self.cursors):
+            if index >= self.task_count or self.is_blocked(index):
+                continue
+
+            task = target.tasks[index]
+
+            if task.status == TaskStatus.LOST:
+                # Lost tasks already hold their in flight and batch slots
+                launch.append((target, task))
+                continue
+
+            if task.status != TaskStatus.PENDING:
+                continue
+
+            if self.max_in_flight is not None and in_flight >= self.max_in_flight:
+                continue
+
+            if not self.is_active(target, index):
+                if self.batch_size is not None and active >= self.batch_size:
+                    continue
+                active += 1
+
+            in_flight += 1
+            launch.append((target, task))
+
+        return launch
+
+
+def resolve_task_dependencies(tasks):
+    # Task indexes each task depends on, or None when no task declared depends_on and tasks run in order.
+    # Tasks without depends_on wait for every task of the priority before theirs, so tasks of equal
+    # priority run side by side. Raises ValidationError for unknown names and cycles. App types are checked
+    # when they are loaded, this checks again because deploys may replace and add tasks.
+    if not any(task_data.depends_on is not None for task_data in tasks):
+        return None
+
+    indexes = {}
+    for index, task_data in enumerate(tasks):
+        if task_data.name in indexes:
+            raise ValidationError("Task names have to be unique when depends_on is used, " + task_data.name +
+                                  " is not")
+        indexes[task_data.name] = index
+
+    dependencies = TaskValidator.task_dependencies(tasks)
+
+    check_dependencies(dict(zip([task_data.name for task_data in tasks], dependencies)), "Task")
+
+    return [sorted(indexes[name] for name in names) for names in dependencies]
+
+
+class GraphScheduler(object):
+
+    # RollingScheduler for jobs whose tasks declared dependencies. Any task of a target whose
+    # dependencies finished on that target may run, several at once. A task listed in sync_tasks
+    # (every task when sync_tasks is None) only starts once its dependencies finished on every target.
+    #
+    # batch_size limits how many targets may have started without finishing, max_in_flight how many
+    # tasks may be running across the whole job.
+
+    def __init__(self, targets, dependencies, batch_size=None, max_in_flight=None, sync_tasks=None):
+        self.targets = targets
+        self.dependencies = [set(task_dependencies) for task_dependencies in dependencies]
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+
+        if sync_tasks is None:
+            self.sync_tasks = set(range(len(dependencies)))
+        else:
+            self.sync_tasks = set(sync_tasks)
+
+        self.finished = [set(index for index, task in enumerate(target.tasks) if task.status == TaskStatus.FINISHED)
+                         for target in targets]
+
+        cursors = [first_unfinished(target) for target in targets]
+        self.low = min(cursors) if len(cursors) > 0 else 0
+
+    def is_ready(self, target_index, index):
+        if index in self.sync_tasks:
+            return all(self.dependencies[index] <= finished for finished in self.finished)
+
+        return self.dependencies[index] <= self.finished[target_index]
+
+    def is_started(self, target_index):
+        target = self.targets[target_index]
+        return len(self.finished[target_index]) < len(target.tasks) and \
+            any(task.status != TaskStatus.PENDING for task in target.tasks)
+
+    def current_tasks(self):
+        # (target, task) pairs for every running or lost task
+        return [(target, task) for target in self.targets for task in target.tasks
+                if task.status in [TaskStatus.RUNNING, TaskStatus.LOST]]
+
+    def launchable(self):
+        in_flight = len(self.current_tasks())
+        active = len([target_index for target_index in range(len(self.targets)) if self.is_started(target_index)])
+
+        launch = []
+
+        for target_index, target in enumerate(self.targets):
+            started = self.is_started(target_index)
+
+            for index, task in enumerate(target.tasks):
+                if task.status == TaskStatus.LOST:
+                    # Lost tasks already hold their in flight and batch slots
+                    launch.append((target, task))
+                    continue
+
+                if task.status != TaskStatus.PENDING or not self.is_ready(target_index, index):
+                    continue
+
+                if self.max_in_flight is not None and in_flight >= self.max_in_flight:
+                    continue
+
+                if not started:
+                    if self.batch_size is not None and active >= self.batch_size:
+                        break
+                    active += 1
+                    started = True
+
+                in_flight += 1
+                launch.append((target, task))
+
+        return launch
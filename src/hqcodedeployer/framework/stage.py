@@ -2,26 +2,37 @@ import json
 import datetime
 import logging
 import random
+import re
 
-import os.path
 import cherrypy
 
-from schematics.exceptions import ModelValidationError, ModelConversionError
-import re
+from schematics.exceptions import ModelValidationError, ModelConversionError, ValidationError
 
 from hqframework.framework import AbstractFramework, AbstractFrameworkAPI
+from hqcodedeployer.framework.events import TaskEventMixin
+from hqcodedeployer.framework.apptypes import AppTypeRegistry, AppTypeError
+from hqcodedeployer.framework.workers import WorkerIndexMixin
+from hqcodedeployer.framework.graph import load_job_graph, TaskStatusCounts, load_current_tasks, targets_data, \
+    job_targets_loader, page_size, critical_path
+from hqcodedeployer.framework.bulk import create_job_targets, render_tasks
+from hqcodedeployer.framework.timeouts import task_timeouts
+from hqcodedeployer.framework.builds import resolve_revision, build_key, pin_revision
+from hqcodedeployer.framework.scheduler import GraphScheduler, resolve_task_dependencies
+from hqcodedeployer.framework.templates import resolve_variables, TemplateError
+from hqcodedeployer.framework.stream import JobEventsAPI
 from hqframework.exceptions import LaunchTaskException, GetWorkersException
-from hqlib.sql.models import Task, Action, TaskStatus, Job, JobStatus, JobTarget
+from hqlib.sql.models import TaskStatus, Job, JobStatus
 from hqcodedeployer.models import Stage
-from hqcodedeployer.validators import StageValidator, AppTypeValidator
-from schematics.types import StringType
+from hqcodedeployer.validators import StageValidator
+from schematics.types import StringType, IntType
 
 
-class Framework(AbstractFramework):
+class Framework(TaskEventMixin, WorkerIndexMixin, AbstractFramework):
 
     def __init__(self):
         super(Framework, self).__init__("codedeployer-stage", Stage)
         self.logger = logging.getLogger("hq.framework.codedeployer.stage")
+        self.app_types = AppTypeRegistry("stage")
 
     def config_class(self):
         config_class = super(Framework, self).config_class()
@@ -29,23 +40,25 @@ class Framework(AbstractFramework):
         class ConfigValidator(config_class):
             app_type_path = StringType(required=True)
             build_path = StringType(required=True)
+            revision_timeout = IntType(min_value=1, default=10)
 
         return ConfigValidator
 
     def on_stop(self):
-        pass
+        self.stop_task_events()
 
-    def process_job(self, job_id):
+    def reconcile_job(self, job_id):
         with self.database.session() as session:
-            stage = session.query(Stage).join(Job, Stage.job_id == Job.id). \
-                filter(Job.id == job_id).filter(Job.stopped_at == None).first()
+            stage = load_job_graph(session, Stage, job_id)
 
             if stage is None:
                 return
 
+            task_counts = TaskStatusCounts(session, job_id)
+
             if stage.job.status == JobStatus.PENDING:
 
-                if self.tasks_have_status(stage.job, TaskStatus.PENDING):
+                if task_counts.all(TaskStatus.PENDING):
                     self.logger.info("All stage tasks are now pending. Starting Stage "
                                      + stage.app + " (" + str(stage.id) + ")")
                     stage.job.status = JobStatus.RUNNING
@@ -54,7 +67,7 @@ class Framework(AbstractFramework):
             elif stage.job.status == JobStatus.RUNNING:
 
                 # check if completed
-                if self.tasks_have_status(stage.job, TaskStatus.FINISHED):
+                if task_counts.all(TaskStatus.FINISHED):
                     self.logger.info("Stage Completed (" + str(stage.id) + ")")
                     stage.job.status = JobStatus.COMPLETED
                     stage.job.stopped_at = datetime.datetime.now()
@@ -62,7 +75,7 @@ class Framework(AbstractFramework):
                     return
 
                 # check if failed
-                if self.some_task_has_status(stage.job, TaskStatus.FAILED):
+                if task_counts.some(TaskStatus.FAILED):
                     self.logger.info("Stage Failed (" + str(stage.id) + ")")
                     for task in stage.job.targets[0].tasks:
                         if task.status == TaskStatus.PENDING:
@@ -74,6 +87,10 @@ class Framework(AbstractFramework):
                     session.commit()
                     return
 
+                if stage.task_dependencies is not None:
+                    self.reconcile_task_graph(session, stage)
+                    return
+
                 all_finished = True
 
                 task = stage.job.targets[0].tasks[stage.job.current_task_index]
@@ -96,10 +113,8 @@ class Framework(AbstractFramework):
                         session.commit()
 
                 elif task.status == TaskStatus.RUNNING:
-                    if self.unix_time_millis(datetime.datetime.now()) - self.unix_time_millis(task.updated_at) > 60000:
-                        self.logger.warning("Stage Task " + str(task.id) + " timed out. It is now lost.")
-                        task.status = TaskStatus.LOST
-                        session.commit()
+                    self.track_running_tasks([task], stage.task_timeouts)
+                    self.expire_tasks(session)
 
                 if task.status != TaskStatus.FINISHED:
                     all_finished = False
@@ -112,89 +127,122 @@ class Framework(AbstractFramework):
 
                     session.commit()
 
+    def reconcile_task_graph(self, session, stage):
+        scheduler = GraphScheduler(stage.job.targets, stage.task_dependencies, sync_tasks=[])
+
+        for target_task, task in scheduler.launchable():
+
+            if task.status == TaskStatus.LOST:
+                self.logger.info("Stage Task " + str(task.id) + " is lost. Retrying...")
+
+            try:
+                self.logger.info("Launching Task " + task.name)
+                self.launch_task(target_task.worker, task)
+            except LaunchTaskException as e:
+                self.logger.error("Error launching stage tasks: " + e.message)
+                task.error_message = e.message
+                task.stopped_at = datetime.datetime.now()
+                task.status = TaskStatus.FAILED
+                session.commit()
+
+        self.track_running_tasks([task for _, task in scheduler.current_tasks()], stage.task_timeouts)
+        self.expire_tasks(session)
+
+        if stage.job.current_task_index != scheduler.low:
+            stage.job.current_task_index = scheduler.low
+            session.commit()
+
     def registered(self):
-        pass
+        self.app_types.load_all(self.config.app_type_path)
+        self.start_task_events()
+
+    def task_artifact(self, session, job, digest):
+        stage = session.query(Stage).filter(Stage.job_id == job.id).first()
+
+        if stage is None or re.match("^[0-9a-f]{64}$", digest) is None:
+            self.logger.warning("Ignoring artifact " + str(digest) + " reported for job " + str(job.id))
+            return
+
+        self.logger.info("Stage " + str(stage.id) + " artifact " + digest)
+        stage.artifact_digest = digest
+        session.commit()
 
     def stage_app(self, data):
 
+        # Asked before opening a session so a slow remote does not hold a database connection
+        revision = resolve_revision(data.repo, data.branch, self.config.revision_timeout)
+
         with self.database.session() as session:
             stage = session.query(Stage).join(Job, Stage.job_id == Job.id).filter(Stage.app == data.name). \
                 filter(Job.stopped_at == None).first()
             if stage is not None:
                 raise cherrypy.HTTPError(400, "Staging for app " + data.name + " is already running")
 
-            job = Job(name='App Stage ' + data.name, datacenter=self.config.datacenter,
-                      user_assignment_id=cherrypy.request.user['id'])
-            session.add(job)
-            session.flush()
-
-            stage = Stage(app=data.name, job=job, type=data.type, branch=data.branch)
-            session.add(stage)
-            session.flush()
-
-            if not os.path.isfile(self.config.app_type_path + "/" + stage.type + "-stage.json"):
-                raise cherrypy.HTTPError(404, "Unknown app stage type " + stage.type)
-
             try:
-                with open(self.config.app_type_path + "/" + stage.type + "-stage.json") as f:
-                    app_json = json.load(f)
+                app_type = self.app_types.get(data.type)
+            except AppTypeError as e:
+                raise cherrypy.HTTPError(e.status, e.message)
 
-            except IOError as e:
-                raise cherrypy.HTTPError(500, "Error opening app type file " + e.message)
-            except ValueError as e:
-                raise cherrypy.HTTPError(500, "Error loading app type json " + e.message)
-
-            try:
-                app_type = AppTypeValidator(app_json)
-            except ModelConversionError as e:
-                raise cherrypy.HTTPError(400, "App Type JSON Error " + json.dumps(e.message))
-
-            try:
-                app_type.validate()
-            except ModelValidationError as e:
-                raise cherrypy.HTTPError(400, "App Type JSON Error " + json.dumps(e.message))
+            tasks = list(app_type.tasks or [])
 
             if data.stage_tasks is not None:
 
                 # Allow tasks to be overwritten
-                for task_index, app_task in enumerate(list(app_type.tasks)):
+                for task_index, app_task in enumerate(list(tasks)):
                     for config_task in list(data.stage_tasks):
                         if app_task.name == config_task.name \
                                 and app_task.priority == config_task.priority:
-                            app_type.tasks[task_index] = config_task
+                            tasks[task_index] = config_task
                             data.stage_tasks.remove(config_task)
 
-                app_type.tasks.extend(data.stage_tasks)
+                tasks.extend(data.stage_tasks)
+
+            tasks.sort(key=lambda x: x.priority)
+
+            key = None
+
+            if revision is not None:
+                key = build_key(data.type, data.repo, revision, tasks,
+                                [app_type.variables, data.stage_variables], data.tags)
+
+                # An unchanged revision with the same tasks has already been built, reuse that stage
+                if not data.force:
+                    built = session.query(Stage).join(Job, Stage.job_id == Job.id). \
+                        filter(Stage.app == data.name).filter(Stage.build_key == key). \
+                        filter(Job.status == JobStatus.COMPLETED).order_by(Stage.id.desc()).first()
+
+                    if built is not None:
+                        self.logger.info("Stage of " + data.name + " at " + revision + " already built by stage "
+                                         + str(built.id))
+                        return built, built.job, True
+            else:
+                self.logger.warning("Could not resolve " + data.branch + " of " + data.repo + ". Skipping build cache")
 
-            app_type.tasks.sort(key=lambda x: x.priority)
+            job = Job(name='App Stage ' + data.name, datacenter=self.config.datacenter,
+                      user_assignment_id=cherrypy.request.user['id'])
+            session.add(job)
+            session.flush()
+
+            stage = Stage(app=data.name, job=job, type=data.type, branch=data.branch, revision=revision,
+                          build_key=key)
+            session.add(stage)
+            session.flush()
 
             try:
-                workers = self.get_workers(job.datacenter)
+                workers = self.worker_index(job.datacenter).select(tags=data.tags)
             except GetWorkersException as e:
                 raise cherrypy.HTTPError(500, e.message)
 
-            for worker in workers:
-                if data.tags is not None:
-                    for key, value in data.tags.iteritems():
-                        if key not in worker.tags:
-                            workers.remove(worker)
-                            continue
-                        if worker.tags[key] != value:
-                            workers.remove(worker)
-                            continue
-
             if len(workers) == 0:
                 raise cherrypy.HTTPError(500, "No workers to build a stage on")
 
             worker = random.choice(workers)
-            job_target = JobTarget(job=job, worker_id=worker.id)
-            session.add(job_target)
 
-            reobj = re.compile("{(.*?)}")
             variables = {
                 'target': worker.target,
                 'repo': data.repo,
                 'branch': data.branch,
+                'revision': revision or data.branch,
                 'build_path': self.config.build_path,
                 'name': stage.app,
                 'app_name': stage.app,
@@ -206,69 +254,31 @@ class Framework(AbstractFramework):
                 variables = variables.copy()
                 variables.update(data.tags)
 
-            if app_type.variables is not None:
-                for key, value in dict(app_type.variables).iteritems():
-                    variables[key] = value
-
-                for key, value in app_type.variables.iteritems():
-                    result = reobj.findall(value)
-
-                    for var_key in result:
-                        if var_key in variables:
-                            value = value.replace("{" + var_key + "}", variables[var_key])
-
-                    variables[key] = value
-
-            if data.stage_variables is not None:
-                for key, value in dict(data.stage_variables).iteritems():
-                    variables[key] = value
-
-                for key, value in data.stage_variables.iteritems():
-                    result = reobj.findall(value)
-
-                    for var_key in result:
-                        if var_key in variables:
-                            value = value.replace("{" + var_key + "}", variables[var_key])
-
-                    variables[key] = value
-
-            for task_index, task_data in enumerate(app_type.tasks):
-
-                try:
-                    task_data.validate()
-                except ModelValidationError as e:
-                    raise cherrypy.HTTPError(400, "Task validation error " + e.message)
-
-                task = Task(name=task_data.name, order=task_index, job_target=job_target)
-                session.add(task)
-                job_target.tasks.append(task)
-
-                for action_index, action in enumerate(task_data.actions):
-                    action_obj = Action(processor=action.processor, order=action_index)
-                    session.add(action_obj)
-                    task.actions.append(action_obj)
-
-                    if action.arguments is not None:
-                        for key in action.arguments:
-                            argument = action.arguments[key]
+            try:
+                variables = resolve_variables(variables, app_type.variables, data.stage_variables)
+            except TemplateError as e:
+                raise cherrypy.HTTPError(400, "Variable error " + e.message)
 
-                            result = reobj.findall(argument)
+            if len(tasks) == 0:
+                raise cherrypy.HTTPError(400, "Stage has no tasks")
 
-                            for var_key in result:
-                                if var_key in variables:
-                                    argument = argument.replace("{" + var_key + "}", variables[var_key])
+            stage.task_timeouts = task_timeouts(tasks, app_type.processor_timeouts)
 
-                            action.arguments[key] = argument
+            try:
+                stage.task_dependencies = resolve_task_dependencies(tasks)
+            except ValidationError as e:
+                raise cherrypy.HTTPError(400, "Invalid task dependencies " + json.dumps(e.message))
 
-                        action_obj.arguments = action.arguments
+            rendered_tasks = render_tasks(tasks, variables)
+            if revision is not None:
+                rendered_tasks = pin_revision(rendered_tasks, revision)
 
-                if len(job_target.tasks) == 0:
-                    raise cherrypy.HTTPError(400, "Stage has no tasks")
+            create_job_targets(session, job, [worker.id], rendered_tasks)
 
             session.commit()
             session.refresh(job)
             session.refresh(stage)
-            return stage, job
+            return stage, job, False
 
 
 class FrameworkAPI(AbstractFrameworkAPI):
@@ -278,19 +288,20 @@ class FrameworkAPI(AbstractFrameworkAPI):
     def __init__(self, framework):
         super(FrameworkAPI, self).__init__(framework, '/cd/stage')
         self.logger = logging.getLogger("hq.framework.api.codedeployer.stage")
+        self.events = JobEventsAPI(framework, Stage, "herqles.framework.cd_stage.get")
 
     @cherrypy.tools.json_out()
     @cherrypy.tools.auth(permission="herqles.framework.cd_stage.get")
-    def GET(self, stage_id=None, app=None, branch=None, page=1):
+    def GET(self, stage_id=None, app=None, branch=None, page=1, before_id=None, per_page=10):
         if stage_id is None:
 
             stages = []
 
-            per_page = 10
-            offset = (int(page) - 1) * per_page
+            per_page = page_size(per_page)
 
             with self.framework.database.session() as session:
-                stage_objects = session.query(Stage).join(Job, Stage.job_id == Job.id).order_by(Stage.id.desc())
+                stage_objects = session.query(Stage).join(Job, Stage.job_id == Job.id). \
+                    options(job_targets_loader(Stage, joined=True)).order_by(Stage.id.desc())
 
                 if app is not None:
                     stage_objects = stage_objects.filter(Stage.app == app)
@@ -298,84 +309,57 @@ class FrameworkAPI(AbstractFrameworkAPI):
                 if branch is not None:
                     stage_objects = stage_objects.filter(Stage.branch == branch)
 
-                stage_objects = stage_objects.limit(per_page).offset(offset)
-
-                for stage in stage_objects:
-                    data = {'id': stage.id,
-                            'job_id': stage.job.id,
-                            'app': stage.app,
-                            'branch': stage.branch,
-                            'status': stage.job.status.value,
-                            'created_at': self.framework.unix_time_millis(stage.job.created_at),
-                            'updated_at': self.framework.unix_time_millis(stage.job.updated_at)}
-
-                    if stage.job.tags is not None:
-                        data['tags'] = [{key: value} for key, value in stage.job.tags.iteritems()]
-
-                    if stage.job.stopped_at is not None:
-                        data['stopped_at'] = self.framework.unix_time_millis(stage.job.stopped_at)
+                if before_id is not None:
+                    stage_objects = stage_objects.filter(Stage.id < int(before_id))
+                else:
+                    stage_objects = stage_objects.offset((int(page) - 1) * per_page)
 
-                    targets = []
+                stage_objects = stage_objects.limit(per_page).all()
+                current_tasks = load_current_tasks(session, [stage.job for stage in stage_objects])
 
-                    for job_target in stage.job.targets:
-                        target = {'target': job_target.worker.target}
-
-                        if stage.job.status == JobStatus.RUNNING:
-                            target['task_id'] = job_target.tasks[stage.job.current_task_index].id
-                            target['task_name'] = job_target.tasks[stage.job.current_task_index].name
-
-                        if stage.job.status == JobStatus.FAILED:
-                            target['task_id'] = job_target.tasks[stage.job.current_task_index].id
-                            target['task_name'] = job_target.tasks[stage.job.current_task_index].name
-                            target['task_error'] = job_target.tasks[stage.job.current_task_index].error_message
-
-                        targets.append(target)
+                for stage in stage_objects:
+                    stages.append(self.stage_data(stage, current_tasks))
 
-                    data['targets'] = targets
+            result = {"stages": stages}
 
-                    stages.append(data)
+            if len(stages) == per_page:
+                result['next_before_id'] = stages[-1]['id']
 
-            return {"stages": stages}
+            return result
         else:
 
             with self.framework.database.session() as session:
-                stage = session.query(Stage).filter(Stage.id == stage_id).first()
+                stage = session.query(Stage).options(job_targets_loader(Stage)).filter(Stage.id == stage_id).first()
 
                 if stage is None:
                     raise cherrypy.HTTPError(400, "Unknown Stage "+str(stage_id))
 
-                data = {'id': stage.id,
-                        'job_id': stage.job.id,
-                        'app': stage.app,
-                        'branch': stage.branch,
-                        'status': stage.job.status.value,
-                        'created_at': self.framework.unix_time_millis(stage.job.created_at),
-                        'updated_at': self.framework.unix_time_millis(stage.job.updated_at)}
+                data = self.stage_data(stage, load_current_tasks(session, [stage.job]))
+                data['critical_path'] = critical_path(session, stage.job, self.framework.unix_time_millis,
+                                                      stage.task_dependencies)
 
-                if stage.job.tags is not None:
-                    data['tags'] = [{key: value} for key, value in stage.job.tags.iteritems()]
-
-                if stage.job.stopped_at is not None:
-                    data['stopped_at'] = self.framework.unix_time_millis(stage.job.stopped_at)
-
-                targets = []
+                return data
 
-                for job_target in stage.job.targets:
-                    target = {'target': job_target.worker.target}
+    def stage_data(self, stage, current_tasks):
+        data = {'id': stage.id,
+                'job_id': stage.job.id,
+                'app': stage.app,
+                'branch': stage.branch,
+                'revision': stage.revision,
+                'artifact_digest': stage.artifact_digest,
+                'status': stage.job.status.value,
+                'created_at': self.framework.unix_time_millis(stage.job.created_at),
+                'updated_at': self.framework.unix_time_millis(stage.job.updated_at)}
 
-                    if stage.job.status == JobStatus.RUNNING:
-                        target['task_id'] = job_target.tasks[stage.job.current_task_index].id
-                        target['task_name'] = job_target.tasks[stage.job.current_task_index].name
+        if stage.job.tags is not None:
+            data['tags'] = [{key: value} for key, value in stage.job.tags.iteritems()]
 
-                    if stage.job.status == JobStatus.FAILED:
-                        target['task_id'] = job_target.tasks[stage.job.current_task_index].id
-                        target['task_name'] = job_target.tasks[stage.job.current_task_index].name
-                        target['task_error'] = job_target.tasks[stage.job.current_task_index].error_message
+        if stage.job.stopped_at is not None:
+            data['stopped_at'] = self.framework.unix_time_millis(stage.job.stopped_at)
 
-                    targets.append(target)
-                data['targets'] = targets
+        data['targets'] = targets_data(stage.job, current_tasks)
 
-                return data
+        return data
 
     @cherrypy.tools.json_in()
     @cherrypy.tools.json_out()
@@ -394,6 +378,6 @@ class FrameworkAPI(AbstractFrameworkAPI):
         except ModelValidationError as e:
             raise cherrypy.HTTPError(400, "Invalid JSON payload " + json.dumps(e.message))
 
-        stage, job = self.framework.stage_app(stage_validator)
+        stage, job, cached = self.framework.stage_app(stage_validator)
 
-        return {"stage_id": stage.id, "job_id": job.id}
+        return {"stage_id": stage.id, "job_id": job.id, "cached": cached}
@@ -0,0 +1,120 @@
+import json
+import time
+
+import cherrypy
+
+from hqlib.sql.models import Task, JobTarget
+from hqcodedeployer.framework.bulk import foreign_key
+from hqcodedeployer.framework.graph import job_targets_loader
+
+KEEPALIVE_INTERVAL = 15
+SNAPSHOT_INTERVAL = 1
+POLL_INTERVAL = 5
+
+
+class JobEventsAPI(object):
+
+    # Streams progress of a single stage, deploy or rollback as server sent events.
+    #
+    # A "job" event is sent whenever the job status or current task index changes and a "task"
+    # event whenever the task a target is on or its status changes. The stream ends once the job
+    # has stopped. Mounted as the events child of a FrameworkAPI, e.g. /cd/deploy/events/<id>.
+    #
+    # A stream reloads its job after the framework reconciled it, at most every SNAPSHOT_INTERVAL seconds,
+    # and otherwise every POLL_INTERVAL seconds for changes made elsewhere, e.g. by the API.
+
+    exposed = True
+
+    def __init__(self, framework, model, permission):
+        self.framework = framework
+        self.model = model
+        self._cp_config = {'tools.auth.on': True,
+                           'tools.auth.permission': permission,
+                           'response.stream': True}
+
+    def GET(self, object_id):
+        with self.framework.database.session() as session:
+            if session.query(self.model).filter(self.model.id == object_id).first() is None:
+                raise cherrypy.HTTPError(404, "Unknown id " + str(object_id))
+
+        cherrypy.response.headers['Content-Type'] = 'text/event-stream'
+        cherrypy.response.headers['Cache-Control'] = 'no-cache'
+
+        return self.stream(object_id)
+
+    def snapshot(self, object_id):
+        job_target_key = foreign_key(Task.job_target)
+
+        with self.framework.database.session() as session:
+            obj = session.query(self.model).options(job_targets_loader(self.model)). \
+                filter(self.model.id == object_id).first()
+            job = obj.job
+
+            workers = dict((job_target.id, job_target.worker.target) for job_target in job.targets)
+
+            tasks = {}
+            for task in session.query(Task).join(Task.job_target).filter(JobTarget.job_id == job.id). \
+                    order_by(Task.order):
+                target_id = getattr(task, job_target_key)
+
+                # Keep the first task that is not finished, or the last task if all are
+                if target_id not in tasks or tasks[target_id]['status'] == 'FINISHED':
+                    tasks[target_id] = {'target': workers[target_id],
+                                        'task_id': task.id,
+                                        'task_name': task.name,
+                                        'status': task.status.value}
+                    if task.error_message is not None:
+                        tasks[target_id]['task_error'] = task.error_message
+
+            job_data = {'id': obj.id,
+                        'job_id': job.id,
+                        'status': job.status.value,
+                        'current_task_index': job.current_task_index}
+
+            return job_data, tasks, job.stopped_at is not None
+
+    def stream(self, object_id):
+        job_data, tasks, stopped = self.snapshot(object_id)
+        snapshot_at = time.time()
+        job_id = job_data['job_id']
+        version = self.framework.watch_job(job_id)
+
+        try:
+            last_job = None
+            last_tasks = {}
+            last_sent = time.time()
+
+            while True:
+                if job_data != last_job:
+                    yield self.event('job', job_data)
+                    last_job = job_data
+                    last_sent = time.time()
+
+                for target_id, task_data in sorted(tasks.iteritems()):
+                    if last_tasks.get(target_id) != task_data:
+                        yield self.event('task', task_data)
+                        last_sent = time.time()
+
+                last_tasks = tasks
+
+                if stopped:
+                    return
+
+                if time.time() - last_sent > KEEPALIVE_INTERVAL:
+                    yield ": keepalive\n\n"
+                    last_sent = time.time()
+
+                version = self.framework.wait_for_job_change(job_id, version, POLL_INTERVAL)
+
+                # Several changes in a row only cost one snapshot per interval
+                delay = SNAPSHOT_INTERVAL - (time.time() - snapshot_at)
+                if delay > 0:
+                    time.sleep(delay)
+
+                job_data, tasks, stopped = self.snapshot(object_id)
+                snapshot_at = time.time()
+        finally:
+            self.framework.unwatch_job(job_id)
+
+    def event(self, name, data):
+        return "event: " + name + "\ndata: " + json.dumps(data) + "\n\n"
@@ -0,0 +1,112 @@
+import re
+
+VARIABLE_REGEX = re.compile("{(.*?)}")
+TEMPLATE_CACHE_SIZE = 4096
+
+_template_cache = {}
+
+
+class TemplateError(Exception):
+
+    def __init__(self, message):
+        super(TemplateError, self).__init__(message)
+        self.message = message
+
+
+class Template(object):
+
+    # A string split once into literal and {variable} segments. Unknown variables are left as they are.
+
+    def __init__(self, text):
+        self.text = text
+        self.segments = []
+        self.variables = set()
+
+        position = 0
+        for match in VARIABLE_REGEX.finditer(text):
+            if match.start() > position:
+                self.segments.append((False, text[position:match.start()]))
+            self.segments.append((True, match.group(1)))
+            self.variables.add(match.group(1))
+            position = match.end()
+
+        if position < len(text):
+            self.segments.append((False, text[position:]))
+
+    def render(self, variables):
+        if len(self.variables) == 0:
+            return self.text
+
+        parts = []
+        for is_variable, value in self.segments:
+            if is_variable:
+                if value in variables:
+                    parts.append(variables[value])
+                else:
+                    parts.append("{" + value + "}")
+            else:
+                parts.append(value)
+
+        return "".join(parts)
+
+
+def compile_template(text):
+    template = _template_cache.get(text)
+
+    if template is None:
+        if len(_template_cache) >= TEMPLATE_CACHE_SIZE:
+            _template_cache.clear()
+        template = Template(text)
+        _template_cache[text] = template
+
+    return template
+
+
+def resolve_variables(variables, *layers):
+    # Merges variable layers on top of the plain variables and resolves references between them.
+    #
+    # Values in later layers override earlier ones and may reference any variable. References are
+    # resolved in dependency order so chained variables do not depend on dict ordering. A variable
+    # referencing its own name gets the value it had in an earlier layer. Cycles raise TemplateError.
+
+    definitions = {}
+    for key, value in variables.iteritems():
+        definitions[key] = [(None, value)]
+
+    for layer in layers:
+        if layer is None:
+            continue
+        for key, value in layer.iteritems():
+            definitions.setdefault(key, []).append((compile_template(value), value))
+
+    resolved = {}
+    resolving = []
+
+    def resolve(key, depth):
+        if (key, depth) in resolved:
+            return resolved[(key, depth)]
+
+        if (key, depth) in resolving:
+            chain = [name for name, _ in resolving[resolving.index((key, depth)):]] + [key]
+            raise TemplateError("Variable reference cycle " + " -> ".join(chain))
+
+        template, value = definitions[key][depth]
+
+        if template is not None:
+            resolving.append((key, depth))
+
+            values = {}
+            for var_key in template.variables:
+                if var_key == key:
+                    if depth > 0:
+                        values[var_key] = resolve(var_key, depth - 1)
+                elif var_key in definitions:
+                    values[var_key] = resolve(var_key, len(definitions[var_key]) - 1)
+
+            value = template.render(values)
+            resolving.pop()
+
+        resolved[(key, depth)] = value
+        return value
+
+    return dict((key, resolve(key, len(definition) - 1)) for key, definition in definitions.iteritems())
@@ -0,0 +1,77 @@
+import heapq
+import threading
+
+DEFAULT_TASK_TIMEOUT = 60
+
+
+def task_timeouts(tasks, processor_timeouts=None):
+    # Seconds each task may go without an update before it is lost, by task order.
+    # A task's own timeout wins, otherwise the slowest of its processors, otherwise the default.
+    timeouts = []
+
+    for task_data in tasks:
+        if task_data.timeout is not None:
+            timeouts.append(task_data.timeout)
+            continue
+
+        timeout = DEFAULT_TASK_TIMEOUT
+        if processor_timeouts is not None:
+            for action in task_data.actions:
+                timeout = max(timeout, processor_timeouts.get(action.processor, DEFAULT_TASK_TIMEOUT))
+
+        timeouts.append(timeout)
+
+    return timeouts
+
+
+class DeadlineQueue(object):
+
+    # Running task deadlines in a heap so a tick only looks at the tasks that are due.
+    # Re-touching a task pushes a new entry, older entries for it are skipped when popped.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.heap = []
+        self.deadlines = {}
+
+    def __contains__(self, task_id):
+        return task_id in self.deadlines
+
+    def track(self, task_id, last_seen, timeout):
+        with self.lock:
+            if task_id in self.deadlines:
+                return
+
+        self.touch(task_id, last_seen, timeout)
+
+    def touch(self, task_id, last_seen, timeout=None):
+        with self.lock:
+            if timeout is None:
+                if task_id not in self.deadlines:
+                    return
+                timeout = self.deadlines[task_id][1]
+
+            deadline = last_seen + timeout
+            self.deadlines[task_id] = (deadline, timeout)
+            heapq.heappush(self.heap, (deadline, task_id))
+
+    def discard(self, task_id):
+        with self.lock:
+            self.deadlines.pop(task_id, None)
+
+    def expired(self, now):
+        # Removes and returns (task id, last seen, timeout) for every task past its deadline
+        expired = []
+
+        with self.lock:
+            while len(self.heap) > 0 and self.heap[0][0] <= now:
+                deadline, task_id = heapq.heappop(self.heap)
+                current = self.deadlines.get(task_id)
+
+                if current is None or current[0] != deadline:
+                    continue
+
+                del self.deadlines[task_id]
+                expired.append((task_id, deadline - current[1], current[1]))
+
+        return expired
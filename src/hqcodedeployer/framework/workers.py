@@ -0,0 +1,149 @@
+import json
+import threading
+import time
+
+from schematics.types import IntType
+
+
+class WorkerIndex(object):
+
+    # Workers of one datacenter indexed by environment, tag key/value, app and target name so that
+    # selecting deploy targets is a set intersection instead of a scan of every worker.
+    #
+    # sync() is given the current worker list and only re-indexes workers that appeared, went
+    # away or changed their tags. Selections keep the order of that list.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.synced_at = None
+        self.workers = {}
+        self.positions = {}
+        self.signatures = {}
+        self.by_environment = {}
+        self.by_tag = {}
+        self.by_app = {}
+        self.by_target = {}
+
+    def sync(self, workers):
+        with self.lock:
+            seen = set()
+            self.positions = {}
+
+            for position, worker in enumerate(workers):
+                seen.add(worker.id)
+                self.positions[worker.id] = position
+                signature = json.dumps([worker.target, worker.tags], sort_keys=True)
+
+                if self.signatures.get(worker.id) != signature:
+                    if worker.id in self.workers:
+                        self.remove(worker.id)
+                    self.add(worker, signature)
+                else:
+                    self.workers[worker.id] = worker
+
+            for worker_id in set(self.workers) - seen:
+                self.remove(worker_id)
+
+            self.synced_at = time.time()
+
+    def add(self, worker, signature):
+        self.workers[worker.id] = worker
+        self.signatures[worker.id] = signature
+        self.by_target[worker.target] = worker.id
+
+        for key, value in worker.tags.iteritems():
+            if key == 'environment':
+                self.by_environment.setdefault(value, set()).add(worker.id)
+            elif key == 'apps':
+                for app in value:
+                    self.by_app.setdefault(app, set()).add(worker.id)
+            elif isinstance(value, basestring):
+                self.by_tag.setdefault((key, value), set()).add(worker.id)
+
+    def remove(self, worker_id):
+        # Unindex using the target and tags the worker was indexed with, the worker object may have changed since
+        del self.workers[worker_id]
+        target, tags = json.loads(self.signatures.pop(worker_id))
+
+        if self.by_target.get(target) == worker_id:
+            del self.by_target[target]
+
+        for key, value in tags.iteritems():
+            if key == 'environment':
+                self.discard(self.by_environment, value, worker_id)
+            elif key == 'apps':
+                for app in value:
+                    self.discard(self.by_app, app, worker_id)
+            elif isinstance(value, basestring):
+                self.discard(self.by_tag, (key, value), worker_id)
+
+    def discard(self, index, key, worker_id):
+        ids = index.get(key)
+
+        if ids is not None:
+            ids.discard(worker_id)
+            if len(ids) == 0:
+                del index[key]
+
+    def select(self, environment=None, tags=None, app=None, targets=None):
+        with self.lock:
+            candidates = []
+
+            if environment is not None:
+                candidates.append(self.by_environment.get(environment, set()))
+
+            if tags is not None:
+                for key, value in tags.iteritems():
+                    if key == 'environment':
+                        candidates.append(self.by_environment.get(value, set()))
+                    else:
+                        candidates.append(self.by_tag.get((key, value), set()))
+
+            if app is not None:
+                candidates.append(self.by_app.get(app, set()))
+
+            if targets is not None:
+                candidates.append(set(self.by_target[target] for target in targets if target in self.by_target))
+
+            if len(candidates) == 0:
+                ids = set(self.workers)
+            else:
+                candidates.sort(key=len)
+                ids = set.intersection(*candidates)
+
+            return [self.workers[worker_id] for worker_id in sorted(ids, key=self.positions.get)]
+
+    def has_app(self, worker, app):
+        with self.lock:
+            return worker.id in self.by_app.get(app, set())
+
+
+class WorkerIndexMixin(object):
+
+    # Worker indexes per datacenter, refreshed from get_workers at most every worker_index_ttl seconds
+    # so selecting targets does not scan every worker on each request.
+
+    def __init__(self, *args, **kwargs):
+        super(WorkerIndexMixin, self).__init__(*args, **kwargs)
+        self.worker_indexes = {}
+        self.worker_indexes_lock = threading.Lock()
+
+    def config_class(self):
+        config_class = super(WorkerIndexMixin, self).config_class()
+
+        class ConfigValidator(config_class):
+            worker_index_ttl = IntType(min_value=0, default=10)
+
+        return ConfigValidator
+
+    def worker_index(self, datacenter):
+        with self.worker_indexes_lock:
+            index = self.worker_indexes.get(datacenter)
+            if index is None:
+                index = WorkerIndex()
+                self.worker_indexes[datacenter] = index
+
+            if index.synced_at is None or time.time() - index.synced_at >= self.config.worker_index_ttl:
+                index.sync(self.get_workers(datacenter))
+
+        return index
@@ -1,5 +1,6 @@
 from hqlib.sql import Base
 from sqlalchemy import Column, Integer, ForeignKey, String, DateTime
+from sqlalchemy.dialects.postgresql import JSON
 from sqlalchemy.orm import relationship
 
 class Deploy(Base):
@@ -12,3 +13,8 @@ class Deploy(Base):
     job = relationship('Job', uselist=False)
     stage_id = Column(Integer, ForeignKey('cd_stages.id'), nullable=False)
     stage = relationship('Stage', uselist=False)
+    batch_size = Column(Integer)
+    max_in_flight = Column(Integer)
+    sync_tasks = Column(JSON)
+    task_timeouts = Column(JSON)
+    task_dependencies = Column(JSON)
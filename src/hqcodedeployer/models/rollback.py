@@ -1,5 +1,6 @@
 from hqlib.sql import Base
 from sqlalchemy import Column, Integer, ForeignKey, String
+from sqlalchemy.dialects.postgresql import JSON
 from sqlalchemy.orm import relationship
 
 
@@ -13,3 +14,6 @@ class Rollback(Base):
     type = Column(String, nullable=False)
     job_id = Column(Integer, ForeignKey('jobs.id'), nullable=False)
     job = relationship('Job', uselist=False)
+    sync_tasks = Column(JSON)
+    task_timeouts = Column(JSON)
+    task_dependencies = Column(JSON)
@@ -1,5 +1,6 @@
 from hqlib.sql import Base
 from sqlalchemy import Column, Integer, ForeignKey, String
+from sqlalchemy.dialects.postgresql import JSON
 from sqlalchemy.orm import relationship
 
 
@@ -13,3 +14,8 @@ class Stage(Base):
     branch = Column(String, nullable=False)
     job_id = Column(Integer, ForeignKey('jobs.id'), nullable=False)
     job = relationship('Job', uselist=False)
+    task_timeouts = Column(JSON)
+    task_dependencies = Column(JSON)
+    artifact_digest = Column(String)
+    revision = Column(String)
+    build_key = Column(String, index=True)
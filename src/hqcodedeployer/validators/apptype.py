@@ -1,11 +1,33 @@
 from schematics.models import Model
-from schematics.types import StringType
+from schematics.types import StringType, IntType
 from schematics.types.compound import ListType, ModelType, DictType
-from hqcodedeployer.validators.task import TaskValidator
+from schematics.exceptions import ValidationError
+from hqcodedeployer.validators.task import TaskValidator, check_dependencies
 
 
 class AppTypeValidator(Model):
 
     variables = DictType(StringType)
+    processor_timeouts = DictType(IntType(min_value=1))
     tasks = ListType(ModelType(TaskValidator))
 
+    def validate_tasks(self, data, value):
+
+        if value is None:
+            return value
+
+        for task in value:
+            task.validate()
+
+        if any(task.depends_on is not None for task in value):
+            names = [task.name for task in value]
+
+            if len(set(names)) != len(names):
+                raise ValidationError("Tasks need unique names when depends_on is used")
+
+            tasks = sorted(value, key=lambda x: x.priority)
+
+            check_dependencies(dict(zip([task.name for task in tasks], TaskValidator.task_dependencies(tasks))),
+                               "Task")
+
+        return value
@@ -1,5 +1,5 @@
 from schematics.models import Model
-from schematics.types import StringType, IntType
+from schematics.types import StringType, IntType, BooleanType
 from schematics.types.compound import ListType, DictType, ModelType
 from hqcodedeployer.validators.task import TaskValidator
 from schematics.exceptions import ValidationError
@@ -15,9 +15,19 @@ class DeployValidator(Model):
     tags = DictType(StringType())
     deploy_variables = DictType(StringType())
     deploy_tasks = ListType(ModelType(TaskValidator))
+    batch_size = IntType(min_value=1)
+    batch_percentage = IntType(min_value=1, max_value=100)
+    max_in_flight = IntType(min_value=1)
+    parallel = BooleanType(default=False)
 
     def validate_targets(self, data, value):
         if data['min_nodes'] is None and value is None:
             raise ValidationError('min_nodes or targets must be given')
 
         return value
+
+    def validate_batch_percentage(self, data, value):
+        if data['batch_size'] is not None and value is not None:
+            raise ValidationError('batch_size and batch_percentage cannot both be given')
+
+        return value
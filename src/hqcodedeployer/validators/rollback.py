@@ -1,5 +1,5 @@
 from schematics.models import Model
-from schematics.types import StringType
+from schematics.types import StringType, BooleanType
 from schematics.types.compound import ListType, ModelType, DictType
 from hqcodedeployer.validators.task import TaskValidator
 
@@ -13,3 +13,4 @@ class RollbackValidator(Model):
     tags = DictType(StringType())
     rollback_variables = DictType(StringType())
     rollback_tasks = ListType(ModelType(TaskValidator))
+    parallel = BooleanType(default=False)
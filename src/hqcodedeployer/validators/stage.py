@@ -1,5 +1,5 @@
 from schematics.models import Model
-from schematics.types import StringType
+from schematics.types import StringType, BooleanType
 from schematics.types.compound import ListType, ModelType, DictType
 from hqcodedeployer.validators.task import TaskValidator
 
@@ -13,3 +13,4 @@ class StageValidator(Model):
     tags = DictType(StringType())
     stage_variables = DictType(StringType())
     stage_tasks = ListType(ModelType(TaskValidator))
+    force = BooleanType(default=False)
@@ -1,18 +1,49 @@
 from schematics.models import Model
-from schematics.types import StringType, IntType
+from schematics.types import StringType, IntType, BooleanType
 from schematics.types.compound import ListType, DictType, ModelType
+from schematics.exceptions import ValidationError
+
+
+def check_dependencies(dependencies, kind):
+    # dependencies maps names to the names they depend on, all of them have to exist and form no cycle
+    for name, depends_on in dependencies.iteritems():
+        for dependency in depends_on:
+            if dependency not in dependencies:
+                raise ValidationError(kind + " " + name + " depends on unknown " + kind + " " + dependency)
+
+    visited = set()
+
+    def visit(name, path):
+        if name in path:
+            raise ValidationError(kind + " dependency cycle " + " -> ".join(path[path.index(name):] + [name]))
+
+        if name in visited:
+            return
+
+        for dependency in dependencies[name]:
+            visit(dependency, path + [name])
+
+        visited.add(name)
+
+    for name in sorted(dependencies):
+        visit(name, [])
 
 
 class ActionValidator(Model):
 
+    name = StringType()
     processor = StringType(required=True)
     arguments = DictType(StringType)
+    depends_on = ListType(StringType)
 
 
 class TaskValidator(Model):
 
     name = StringType(required=True)
     priority = IntType(required=True)
+    sync = BooleanType(default=False)
+    timeout = IntType(min_value=1)
+    depends_on = ListType(StringType)
     actions = ListType(ModelType(ActionValidator), min_size=1, required=True)
 
     def validate_actions(self, data, value):
@@ -20,4 +51,53 @@ class TaskValidator(Model):
         for action in value:
             action.validate()
 
+        if self.has_action_graph(value):
+            names = [action.name for action in value]
+
+            if None in names or len(set(names)) != len(names):
+                raise ValidationError("Actions need unique names when depends_on is used")
+
+            check_dependencies(dict((action.name, dependencies)
+                                    for action, dependencies in zip(value, self.action_dependencies(value))),
+                               "Action")
+
         return value
+
+    @staticmethod
+    def has_action_graph(actions):
+        return any(action.depends_on is not None for action in actions)
+
+    @staticmethod
+    def action_dependencies(actions):
+        # Actions without depends_on keep running after the action before them
+        dependencies = []
+
+        for index, action in enumerate(actions):
+            if action.depends_on is not None:
+                dependencies.append(list(action.depends_on))
+            elif index > 0:
+                dependencies.append([actions[index - 1].name])
+            else:
+                dependencies.append([])
+
+        return dependencies
+
+    @staticmethod
+    def task_dependencies(tasks):
+        # Tasks, sorted by priority, without depends_on wait for every task of the priority before theirs
+        dependencies = []
+        previous = []
+        current = []
+
+        for index, task in enumerate(tasks):
+            if index > 0 and task.priority != tasks[index - 1].priority:
+                previous = current
+                current = []
+            current.append(task.name)
+
+            if task.depends_on is not None:
+                dependencies.append(list(task.depends_on))
+            else:
+                dependencies.append(list(previous))
+
+        return dependencies
@@ -1,23 +1,113 @@
 from hqworker.worker import AbstractWorker
 from hqcodedeployer.worker.processors import processors
+from hqcodedeployer.worker.messaging.heartbeat import Heartbeat
+from hqcodedeployer.worker.messaging.publisher import publish
+from hqcodedeployer.worker.artifacts import ArtifactCache
+from hqcodedeployer.worker.peers import PeerServer
+from schematics.types import StringType, IntType
 from abc import ABCMeta, abstractmethod
+import os
 
 
 class CDWorker(AbstractWorker):
 
     __metaclass__ = ABCMeta
 
+    current_task_id = None
+    peer_server = None
+
     @abstractmethod
     def get_tags(self):
         return {}
 
+    def config_class(self):
+        class ConfigValidator(super(CDWorker, self).config_class()):
+
+            heartbeat_url = StringType()
+            heartbeat_exchange = StringType(default='hq-task-events')
+            heartbeat_interval = IntType(min_value=1, default=15)
+            artifact_cache_path = StringType(default='/var/cache/hq-codedeployer/artifacts')
+            artifact_cache_size = IntType(min_value=1, default=10)
+            artifact_peer_port = IntType()
+            artifact_peer_address = StringType()
+            artifact_peer_token = StringType()
+            git_mirror_path = StringType(default='/var/cache/hq-codedeployer/git')
+            wheel_cache_path = StringType(default='/var/cache/hq-codedeployer/wheels')
+            venv_pool_path = StringType(default='/var/cache/hq-codedeployer/venvs')
+            bundle_store_path = StringType(default='/var/cache/hq-codedeployer/bundles')
+            action_pool_size = IntType(min_value=1, default=4)
+
+        return ConfigValidator
+
+    def artifact_cache(self):
+        if not os.path.isdir(self.config.artifact_cache_path):
+            os.makedirs(self.config.artifact_cache_path)
+
+        return ArtifactCache(self.config.artifact_cache_path, self.config.artifact_cache_size)
+
+    def start_peer_server(self):
+        # Other workers of a deploy may fetch artifacts from this one
+        if self.config.artifact_peer_port is None or self.peer_server is not None:
+            return
+
+        if self.config.artifact_peer_address is None or self.config.artifact_peer_token is None:
+            self.logger.error("artifact_peer_port needs artifact_peer_address and artifact_peer_token. "
+                              "Not serving artifacts to peers")
+            return
+
+        try:
+            self.peer_server = PeerServer(self.config.artifact_peer_address, self.config.artifact_peer_port,
+                                          self.config.artifact_peer_token, self.artifact_cache())
+        except EnvironmentError as e:
+            self.logger.error("Error starting artifact peer server " + str(e) + ". Not serving artifacts to peers")
+            return
+
+        self.peer_server.start()
+
+    def report_artifact(self, digest):
+        # The framework records artifact digests sent over the task event exchange
+        if self.config.heartbeat_url is None or self.current_task_id is None:
+            self.logger.warning("Cannot report artifact " + digest + " without a heartbeat_url")
+            return
+
+        try:
+            publish(self.config.heartbeat_url, self.config.heartbeat_exchange,
+                    {'task_id': self.current_task_id, 'artifact': digest})
+        except Exception as e:
+            self.logger.error("Error reporting artifact " + digest + " " + str(e))
+
     def do_work(self, action):
         if action.processor in processors:
-            exit_code, message = processors[action.processor](self).do_work(action.arguments)
-            return exit_code, message
+            if self.config.heartbeat_url is None:
+                return self.run_action(action.processor, action.arguments)
+
+            # Heartbeats and artifact reports are sent for the task the action belongs to
+            if not hasattr(action, 'task_id'):
+                self.logger.error("Actions carry no task_id, heartbeat_url cannot be used with this worker")
+                return -1, "Actions carry no task_id, heartbeat_url cannot be used with this worker"
+
+            self.current_task_id = action.task_id
+
+            # Keep the framework from timing out long actions while they are still running
+            with Heartbeat(self.config.heartbeat_url, self.config.heartbeat_exchange, action.task_id,
+                           self.config.heartbeat_interval):
+                return self.run_action(action.processor, action.arguments)
         else:
             return -1, "Unknown processor "+action.processor
 
+    def run_action(self, processor, arguments):
+        if processor not in processors:
+            return -1, "Unknown processor "+processor
+
+        try:
+            processor_class = processors[processor]
+        except Exception as e:
+            # A missing dependency or broken plugin fails the action instead of the worker
+            self.logger.error("Error loading processor " + processor + " " + str(e))
+            return -1, "Error loading processor " + processor + " " + str(e)
+
+        return processor_class(self).do_work(arguments)
+
     @abstractmethod
     def on_register(self):
         pass
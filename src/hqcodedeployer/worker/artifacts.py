@@ -0,0 +1,146 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import urllib2
+
+DIGEST_CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(file_name):
+    sha = hashlib.sha256()
+
+    with open(file_name, 'rb') as f:
+        for chunk in iter(lambda: f.read(DIGEST_CHUNK_SIZE), b''):
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+
+def artifact_path(root, digest):
+    # Artifacts are spread over 256 directories so no single directory gets too large
+    return os.path.join(root, digest[:2], digest)
+
+
+def is_digest(digest):
+    if len(digest) != 64:
+        return False
+
+    try:
+        int(digest, 16)
+    except ValueError:
+        return False
+
+    return True
+
+
+def place_file(source, destination):
+    # Hardlinks the file into place when possible, otherwise copies it. The destination only ever
+    # appears complete because both are done under a temporary name and renamed.
+    directory = os.path.dirname(destination)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    fd, tmp_name = tempfile.mkstemp(dir=directory, prefix=".hq-")
+    os.close(fd)
+
+    try:
+        os.unlink(tmp_name)
+        try:
+            os.link(source, tmp_name)
+        except OSError:
+            shutil.copyfile(source, tmp_name)
+        os.rename(tmp_name, destination)
+    except EnvironmentError:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+        raise
+
+
+class ArtifactCache(object):
+
+    # Artifacts a worker already has, stored by SHA-256 digest. Each hit refreshes the artifact's
+    # mtime and prune() drops the least recently used artifacts beyond max_artifacts.
+
+    def __init__(self, path, max_artifacts):
+        self.path = path
+        self.max_artifacts = max_artifacts
+
+    def get(self, digest):
+        file_name = artifact_path(self.path, digest)
+
+        if not os.path.isfile(file_name):
+            return None
+
+        os.utime(file_name, None)
+        return file_name
+
+    def put(self, file_name, digest):
+        place_file(file_name, artifact_path(self.path, digest))
+        self.prune()
+        return artifact_path(self.path, digest)
+
+    def fetch(self, url, digest, timeout, headers=None):
+        # Downloads url into the cache, raises ValueError when it does not match the digest
+        fd, tmp_name = tempfile.mkstemp(dir=self.path, prefix=".hq-")
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                response = urllib2.urlopen(urllib2.Request(url, headers=headers or {}), timeout=timeout)
+
+                try:
+                    reader = DigestReader(response)
+                    for chunk in iter(lambda: reader.read(DIGEST_CHUNK_SIZE), b''):
+                        f.write(chunk)
+                finally:
+                    response.close()
+
+            if reader.hexdigest() != digest:
+                raise ValueError("Artifact " + url + " does not match its digest")
+
+            return self.put(tmp_name, digest)
+        finally:
+            os.unlink(tmp_name)
+
+    def prune(self):
+        artifacts = []
+
+        for directory in os.listdir(self.path):
+            directory = os.path.join(self.path, directory)
+            if not os.path.isdir(directory):
+                continue
+
+            for name in os.listdir(directory):
+                if is_digest(name):
+                    file_name = os.path.join(directory, name)
+                    artifacts.append((os.stat(file_name).st_mtime, file_name))
+
+        artifacts.sort(reverse=True)
+
+        for _, file_name in artifacts[self.max_artifacts:]:
+            try:
+                os.unlink(file_name)
+            except OSError:
+                pass
+
+
+class DigestReader(object):
+
+    # File like wrapper hashing everything read through it
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.sha.update(data)
+        return data
+
+    def drain(self):
+        # Readers like tarfile may stop before the end, the digest has to cover the whole stream
+        for chunk in iter(lambda: self.read(DIGEST_CHUNK_SIZE), b''):
+            pass
+
+    def hexdigest(self):
+        return self.sha.hexdigest()
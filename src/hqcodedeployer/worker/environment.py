@@ -0,0 +1,113 @@
+import collections
+import os
+import threading
+
+# Variables every shell sets for itself, they are never part of a source diff
+SHELL_VARIABLES = frozenset(['_', 'SHLVL', 'PWD', 'OLDPWD'])
+
+# Parsed environments of the most recently used .HQ_ENV files, oldest first
+ENV_CACHE_SIZE = 16
+_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class Environment(collections.Mapping):
+
+    # Immutable process environment, copy it with dict() to change it for a single command
+
+    def __init__(self, variables):
+        self.variables = variables
+
+    def __getitem__(self, key):
+        return self.variables[key]
+
+    def __iter__(self):
+        return iter(self.variables)
+
+    def __len__(self):
+        return len(self.variables)
+
+
+def parse_env(text):
+    # KEY=VALUE lines. Lines starting with a tab, or without a key, continue the previous value.
+    # A -KEY line is a tombstone for a variable that was unset, its value is None.
+    variables = {}
+    key = None
+
+    for line in text.split("\n"):
+        name, sep, value = line.partition("=")
+
+        if line.startswith("\t") and key is not None:
+            variables[key] += "\n" + line[1:]
+        elif sep and is_name(name):
+            key = name
+            variables[key] = value
+        elif not sep and line.startswith("-") and is_name(line[1:]):
+            key = None
+            variables[line[1:]] = None
+        elif key is not None:
+            variables[key] += "\n" + line
+
+    return variables
+
+
+def is_name(name):
+    return len(name) > 0 and not name[0].isdigit() and all(c.isalnum() or c == '_' for c in name)
+
+
+def read_env(file_name):
+    # The worker's environment with the .HQ_ENV layer applied. The file is parsed once and cached by
+    # path and mtime, so every action of a task after a source shares the same parsed environment.
+    # Only the ENV_CACHE_SIZE most recently read files are kept.
+    try:
+        st = os.stat(file_name)
+        version = (st.st_mtime, st.st_size)
+    except OSError:
+        version = None
+
+    with _cache_lock:
+        cached = _cache.pop(file_name, None)
+        if cached is not None:
+            _cache[file_name] = cached
+
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    variables = os.environ.copy()
+
+    if version is not None:
+        with open(file_name) as f:
+            for key, value in parse_env(f.read().rstrip("\n")).iteritems():
+                if value is None:
+                    variables.pop(key, None)
+                else:
+                    variables[key] = value
+
+    environment = Environment(variables)
+
+    with _cache_lock:
+        _cache.pop(file_name, None)
+        _cache[file_name] = (version, environment)
+
+        while len(_cache) > ENV_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+    return environment
+
+
+def write_env_diff(file_name, variables):
+    # Only what differs from the worker's own environment is written, variables of the worker's
+    # environment that are gone get a tombstone
+    lines = []
+
+    for key in sorted(set(variables) | set(os.environ)):
+        if key in SHELL_VARIABLES:
+            continue
+
+        if key not in variables:
+            lines.append("-" + key)
+        elif os.environ.get(key) != variables[key]:
+            lines.append(key + "=" + variables[key].replace("\n", "\n\t"))
+
+    with open(file_name, "w") as f:
+        f.write("\n".join(lines) + "\n")
@@ -0,0 +1,149 @@
+import grp
+import os
+import pwd
+import shutil
+import stat
+
+try:
+    # scandir based walk for python 2, os.walk already uses scandir on python 3.5+
+    from scandir import walk
+except ImportError:
+    from os import walk
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+MODE_BITS = {
+    'u': {'r': stat.S_IRUSR, 'w': stat.S_IWUSR, 'x': stat.S_IXUSR, 's': stat.S_ISUID},
+    'g': {'r': stat.S_IRGRP, 'w': stat.S_IWGRP, 'x': stat.S_IXGRP, 's': stat.S_ISGID},
+    'o': {'r': stat.S_IROTH, 'w': stat.S_IWOTH, 'x': stat.S_IXOTH, 's': 0},
+}
+
+
+def walk_tree(path):
+    # Yields path and everything below it without following symlinks
+    yield path
+
+    if os.path.isdir(path) and not os.path.islink(path):
+        for root, dirs, files in walk(path):
+            for name in dirs + files:
+                yield os.path.join(root, name)
+
+
+def parse_mode(mode, current):
+    # Octal modes like 755 or symbolic ones like u+x,go-w the way chmod understands them
+    if mode.isdigit():
+        return int(mode, 8)
+
+    for clause in mode.split(","):
+        who = ""
+        while len(clause) > 0 and clause[0] in "ugoa":
+            who += clause[0]
+            clause = clause[1:]
+
+        if who == "" or "a" in who:
+            who = "ugo"
+
+        if len(clause) == 0 or clause[0] not in "+-=":
+            raise ValueError("Invalid mode " + mode)
+
+        op = clause[0]
+        bits = 0
+        cleared = 0
+
+        for who_char in who:
+            cleared |= sum(MODE_BITS[who_char].values())
+            for perm in clause[1:]:
+                if perm == 'X':
+                    if stat.S_ISDIR(current) or current & (stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH):
+                        bits |= MODE_BITS[who_char]['x']
+                elif perm == 't':
+                    bits |= stat.S_ISVTX
+                elif perm in MODE_BITS[who_char]:
+                    bits |= MODE_BITS[who_char][perm]
+                else:
+                    raise ValueError("Invalid mode " + mode)
+
+        if op == '+':
+            current |= bits
+        elif op == '-':
+            current &= ~bits
+        else:
+            current = (current & ~cleared) | bits
+
+    return current
+
+
+def owner_ids(owner, group):
+    uid = -1
+    gid = -1
+
+    if owner is not None and owner != "":
+        uid = int(owner) if owner.isdigit() else pwd.getpwnam(owner).pw_uid
+
+    if group is not None and group != "":
+        gid = int(group) if group.isdigit() else grp.getgrnam(group).gr_gid
+
+    return uid, gid
+
+
+def copy_file(source, destination):
+    # Copies contents, mode and times like cp -p without starting a process. Python 2 has no
+    # os.sendfile, so the data goes through user space in large chunks.
+    with open(source, 'rb') as src:
+        with open(destination, 'wb') as dst:
+            shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+
+    shutil.copystat(source, destination)
+
+
+def copy_tree(source, destination):
+    # cp -r: copies into destination when it is an existing directory
+    if os.path.isdir(destination) and not os.path.islink(destination):
+        destination = os.path.join(destination, os.path.basename(source.rstrip("/")))
+
+    if os.path.islink(source):
+        os.symlink(os.readlink(source), destination)
+    elif not os.path.isdir(source):
+        copy_file(source, destination)
+    else:
+        for root, dirs, files in walk(source):
+            target_root = os.path.join(destination, os.path.relpath(root, source))
+
+            if not os.path.isdir(target_root):
+                os.makedirs(target_root)
+                shutil.copystat(root, target_root)
+
+            for name in dirs + files:
+                path = os.path.join(root, name)
+                target = os.path.join(target_root, name)
+
+                if os.path.islink(path):
+                    os.symlink(os.readlink(path), target)
+                elif name in files:
+                    copy_file(path, target)
+
+
+def link_tree(source, destination):
+    # Recreates source at destination with every file hardlinked, copies across filesystems.
+    # Files already at destination are replaced.
+    for root, dirs, files in walk(source):
+        target_root = os.path.join(destination, os.path.relpath(root, source))
+
+        if not os.path.isdir(target_root):
+            os.makedirs(target_root)
+            shutil.copystat(root, target_root)
+
+        for name in dirs + files:
+            path = os.path.join(root, name)
+            target = os.path.join(target_root, name)
+
+            if (os.path.islink(path) or name in files) and os.path.lexists(target):
+                os.unlink(target)
+
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), target)
+            elif name in files:
+                try:
+                    os.link(path, target)
+                except OSError:
+                    copy_file(path, target)
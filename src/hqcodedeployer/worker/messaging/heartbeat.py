@@ -0,0 +1,57 @@
+import json
+import logging
+import threading
+
+import pika
+
+
+class Heartbeat(threading.Thread):
+
+    # Publishes {task_id, heartbeat} for a running task every interval seconds so the
+    # framework does not consider long running actions lost. Publishing errors are only logged,
+    # a missed heartbeat must never fail the action itself.
+
+    def __init__(self, url, exchange, task_id, interval):
+        super(Heartbeat, self).__init__()
+        self.daemon = True
+        self.logger = logging.getLogger("hq.worker.codedeployer.heartbeat")
+        self.url = url
+        self.exchange = exchange
+        self.task_id = task_id
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        connection = None
+        channel = None
+        body = json.dumps({'task_id': self.task_id, 'heartbeat': True})
+
+        while not self.stopped.wait(self.interval):
+            try:
+                if connection is None or not connection.is_open:
+                    connection = pika.BlockingConnection(pika.URLParameters(self.url))
+                    channel = connection.channel()
+
+                channel.basic_publish(exchange=self.exchange, routing_key='', body=body)
+            except Exception as e:
+                self.logger.warning("Error sending heartbeat for task " + str(self.task_id) + " " + str(e))
+                self.close(connection, channel)
+                connection = None
+                channel = None
+
+        self.close(connection, channel)
+
+    def close(self, connection, channel):
+        for resource in [channel, connection]:
+            if resource is not None:
+                try:
+                    resource.close()
+                except Exception:
+                    pass
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stopped.set()
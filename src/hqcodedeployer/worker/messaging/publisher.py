@@ -0,0 +1,13 @@
+import json
+
+import pika
+
+
+def publish(url, exchange, message):
+    # One off publish of a json message to a fanout exchange
+    connection = pika.BlockingConnection(pika.URLParameters(url))
+
+    try:
+        connection.channel().basic_publish(exchange=exchange, routing_key='', body=json.dumps(message))
+    finally:
+        connection.close()
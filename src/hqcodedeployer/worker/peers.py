@@ -0,0 +1,68 @@
+import BaseHTTPServer
+import SocketServer
+import hmac
+import logging
+import os
+import shutil
+import threading
+import time
+
+from hqcodedeployer.worker.artifacts import is_digest
+
+# How long a request waits for an artifact the worker is still fetching itself
+PEER_WAIT = 120
+TOKEN_HEADER = 'X-HQ-Peer-Token'
+
+
+class PeerRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if not hmac.compare_digest(self.headers.get(TOKEN_HEADER) or '', self.server.token):
+            self.send_error(403)
+            return
+
+        digest = self.path.strip("/")
+
+        if not is_digest(digest):
+            self.send_error(404)
+            return
+
+        file_name = None
+        deadline = time.time() + PEER_WAIT
+
+        while file_name is None:
+            file_name = self.server.cache.get(digest)
+            if file_name is None:
+                if time.time() > deadline:
+                    self.send_error(404)
+                    return
+                time.sleep(0.5)
+
+        with open(file_name, 'rb') as f:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(os.fstat(f.fileno()).st_size))
+            self.end_headers()
+            shutil.copyfileobj(f, self.wfile)
+
+    def log_message(self, format, *args):
+        self.server.logger.debug(format % args)
+
+
+class PeerServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    # Serves the worker's artifact cache to other workers of the same deploy at /<digest>. Only
+    # requests carrying the token shared by all workers in TOKEN_HEADER are answered.
+
+    daemon_threads = True
+
+    def __init__(self, address, port, token, cache):
+        BaseHTTPServer.HTTPServer.__init__(self, (address, port), PeerRequestHandler)
+        self.logger = logging.getLogger("hq.worker.codedeployer.peers")
+        self.token = token
+        self.cache = cache
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
@@ -1,41 +1,95 @@
-from hqcodedeployer.worker.processors.mkdir import MkDirWorker
-from hqcodedeployer.worker.processors.tar import TarWorker, UnTarWorker
-from hqcodedeployer.worker.processors.copy import CopyWorker
-from hqcodedeployer.worker.processors.move import MoveWorker
-from hqcodedeployer.worker.processors.git import Clone
-from hqcodedeployer.worker.processors.bundle import Install as BundleInstall
-from hqcodedeployer.worker.processors.symlink import Symlink
-from hqcodedeployer.worker.processors.venv import Venv
-from hqcodedeployer.worker.processors.file import Touch, Write, Download
-from hqcodedeployer.worker.processors.rake import RakeWorker
-from hqcodedeployer.worker.processors.bluepill import Bluepill
-from hqcodedeployer.worker.processors.gem import Copy as GemCopy
-from hqcodedeployer.worker.processors.pip import Install as PipInstall, Wheel as PipWheel
-from hqcodedeployer.worker.processors.puppet import PuppetWorker
-from hqcodedeployer.worker.processors.source import SourceWorker
-from hqcodedeployer.worker.processors.chown import ChownWorker
-from hqcodedeployer.worker.processors.chmod import ChmodWorker
-
-processors = {
-    'mkdir': MkDirWorker,
-    'tar': TarWorker,
-    'untar': UnTarWorker,
-    'copy': CopyWorker,
-    'move': MoveWorker,
-    'git:clone': Clone,
-    'bundle:install': BundleInstall,
-    "symlink": Symlink,
-    "venv": Venv,
-    "file:touch": Touch,
-    "file:write": Write,
-    "file:download": Download,
-    "rake": RakeWorker,
-    "bluepill": Bluepill,
-    "gem:copy": GemCopy,
-    "pip:install": PipInstall,
-    "pip:wheel": PipWheel,
-    "puppet": PuppetWorker,
-    "source": SourceWorker,
-    "chown": ChownWorker,
-    "chmod": ChmodWorker,
+import importlib
+import logging
+import threading
+
+ENTRY_POINT_GROUP = 'hqcodedeployer.processors'
+
+# Processor names to the module and class implementing them. Modules are only imported once a
+# processor is used so workers do not pay for processors they never run.
+BUILTIN_PROCESSORS = {
+    'mkdir': 'hqcodedeployer.worker.processors.mkdir:MkDirWorker',
+    'tar': 'hqcodedeployer.worker.processors.tar:TarWorker',
+    'untar': 'hqcodedeployer.worker.processors.tar:UnTarWorker',
+    'copy': 'hqcodedeployer.worker.processors.copy:CopyWorker',
+    'move': 'hqcodedeployer.worker.processors.move:MoveWorker',
+    'git:clone': 'hqcodedeployer.worker.processors.git:Clone',
+    'bundle:install': 'hqcodedeployer.worker.processors.bundle:Install',
+    "symlink": 'hqcodedeployer.worker.processors.symlink:Symlink',
+    "venv": 'hqcodedeployer.worker.processors.venv:Venv',
+    "file:touch": 'hqcodedeployer.worker.processors.file:Touch',
+    "file:write": 'hqcodedeployer.worker.processors.file:Write',
+    "file:download": 'hqcodedeployer.worker.processors.file:Download',
+    "rake": 'hqcodedeployer.worker.processors.rake:RakeWorker',
+    "bluepill": 'hqcodedeployer.worker.processors.bluepill:Bluepill',
+    "gem:copy": 'hqcodedeployer.worker.processors.gem:Copy',
+    "pip:install": 'hqcodedeployer.worker.processors.pip:Install',
+    "pip:wheel": 'hqcodedeployer.worker.processors.pip:Wheel',
+    "puppet": 'hqcodedeployer.worker.processors.puppet:PuppetWorker',
+    "source": 'hqcodedeployer.worker.processors.source:SourceWorker',
+    "chown": 'hqcodedeployer.worker.processors.chown:ChownWorker',
+    "chmod": 'hqcodedeployer.worker.processors.chmod:ChmodWorker',
+    "artifact:store": 'hqcodedeployer.worker.processors.artifact:Store',
+    "artifact:fetch": 'hqcodedeployer.worker.processors.artifact:Fetch',
+    "actions:graph": 'hqcodedeployer.worker.processors.graph:Graph',
 }
+
+
+class ProcessorRegistry(object):
+
+    # Maps processor names to processor classes, importing each class on first use.
+    #
+    # Names that are not built in are looked up in the hqcodedeployer.processors setuptools entry
+    # point group, which is only scanned the first time an unknown name is asked for.
+
+    def __init__(self, paths):
+        self.logger = logging.getLogger("hq.worker.codedeployer.processors")
+        self.lock = threading.RLock()
+        self.paths = dict(paths)
+        self.classes = {}
+        self.entry_points = None
+
+    def __contains__(self, name):
+        return name in self.paths or name in self.plugin_entry_points()
+
+    def __getitem__(self, name):
+        with self.lock:
+            processor = self.classes.get(name)
+
+            if processor is None:
+                if name in self.paths:
+                    module_name, _, class_name = self.paths[name].partition(":")
+                    processor = getattr(importlib.import_module(module_name), class_name)
+                elif name in self.plugin_entry_points():
+                    processor = self.plugin_entry_points()[name].load()
+                else:
+                    raise KeyError(name)
+
+                self.classes[name] = processor
+
+            return processor
+
+    def plugin_entry_points(self):
+        with self.lock:
+            if self.entry_points is None:
+                self.entry_points = self.scan_entry_points()
+
+            return self.entry_points
+
+    def scan_entry_points(self):
+        entry_points = {}
+
+        try:
+            import pkg_resources
+        except ImportError:
+            return entry_points
+
+        for entry_point in pkg_resources.iter_entry_points(ENTRY_POINT_GROUP):
+            if entry_point.name in self.paths:
+                self.logger.warning("Ignoring processor plugin " + entry_point.name +
+                                    ", a built in processor has that name")
+                continue
+            entry_points[entry_point.name] = entry_point
+
+        return entry_points
+
+processors = ProcessorRegistry(BUILTIN_PROCESSORS)
@@ -0,0 +1,82 @@
+from hqworker.processor import ActionProcessor
+from hqcodedeployer.worker.artifacts import file_digest, artifact_path, is_digest, place_file
+from hqcodedeployer.worker.peers import TOKEN_HEADER
+import os
+
+# Peers may hold a request while they are still fetching the artifact themselves
+PEER_TIMEOUT = 180
+
+
+class Store(ActionProcessor):
+
+    def __init__(self, worker):
+        super(Store, self).__init__(worker, "artifact:store", ["file", "store"])
+
+    def work(self):
+        try:
+            digest = file_digest(self.args['file'])
+        except EnvironmentError as e:
+            return -1, "Error reading artifact " + str(e)
+
+        stored = artifact_path(self.args['store'], digest)
+
+        # Identical builds have the same digest and are only stored once
+        if os.path.isfile(stored):
+            self.logger.info("Artifact " + digest + " is already stored")
+        else:
+            try:
+                place_file(self.args['file'], stored)
+            except EnvironmentError as e:
+                return -1, "Error storing artifact " + str(e)
+
+        self.worker.report_artifact(digest)
+
+        return 0, ""
+
+
+class Fetch(ActionProcessor):
+
+    def __init__(self, worker):
+        super(Fetch, self).__init__(worker, "artifact:fetch", ["digest", "url", "file", "peer"])
+
+    def work(self):
+        digest = self.args['digest']
+
+        if not is_digest(digest):
+            return -1, "Invalid artifact digest " + digest
+
+        try:
+            cache = self.worker.artifact_cache()
+            cached = cache.get(digest)
+        except EnvironmentError as e:
+            return -1, "Error opening artifact cache " + str(e)
+
+        if cached is None:
+            sources = [(self.args['url'].rstrip("/") + "/" + digest[:2] + "/" + digest, None)]
+
+            # Try the peer assigned by the framework first and fall back to the origin
+            if self.args.get('peer'):
+                token = self.worker.config.artifact_peer_token
+                if token is not None:
+                    sources.insert(0, (self.args['peer'].rstrip("/") + "/" + digest, {TOKEN_HEADER: token}))
+                else:
+                    self.logger.warning("Not fetching from peer without an artifact_peer_token")
+
+            for url, headers in sources:
+                try:
+                    cached = cache.fetch(url, digest, PEER_TIMEOUT, headers)
+                    break
+                except Exception as e:
+                    error = "Error fetching artifact " + str(e)
+                    self.logger.warning(error)
+            else:
+                return -1, error
+        else:
+            self.logger.info("Artifact " + digest + " found in cache")
+
+        try:
+            place_file(cached, self.args['file'])
+        except EnvironmentError as e:
+            return -1, "Error placing artifact " + str(e)
+
+        return 0, ""
@@ -1,12 +1,110 @@
 from hqworker.processor import ActionProcessor
+from hqcodedeployer.worker.fs import link_tree, copy_file
+from hqcodedeployer.worker.environment import read_env
+import hashlib
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+
+BUNDLE_PATH = os.path.join("vendor", "bundle")
+CONFIG_PATH = ".bundle"
+
+
+def ruby_version(env, cwd):
+    # Asked in the checkout every time, rbenv and chruby pick the ruby from its .ruby-version
+    return subprocess.check_output(['ruby', '-e', 'print RUBY_VERSION + "-" + RUBY_PLATFORM'], cwd=cwd, env=env)
+
+
+def copy_config(source, destination):
+    # bundle config rewrites .bundle/config in place, so it is copied instead of hardlinked
+    if not os.path.isdir(destination):
+        os.makedirs(destination)
+
+    for name in os.listdir(source):
+        path = os.path.join(source, name)
+        target = os.path.join(destination, name)
+
+        if os.path.isfile(path) and not os.path.islink(path):
+            if os.path.lexists(target):
+                os.unlink(target)
+            copy_file(path, target)
+
+
+def place_bundle(source, destination):
+    # Hardlinks the installed gems and copies the bundler config from one checkout or store to another
+    if os.path.isdir(os.path.join(source, BUNDLE_PATH)):
+        link_tree(os.path.join(source, BUNDLE_PATH), os.path.join(destination, BUNDLE_PATH))
+
+    if os.path.isdir(os.path.join(source, CONFIG_PATH)):
+        copy_config(os.path.join(source, CONFIG_PATH), os.path.join(destination, CONFIG_PATH))
 
 
 class Install(ActionProcessor):
 
+    # Installed bundles are kept in the worker's bundle_store_path keyed by the hash of Gemfile.lock and
+    # the ruby version. An unchanged lockfile hardlinks the stored bundle into place without running
+    # bundler. Stored bundles are shared, apps must not modify installed gems.
+
     def __init__(self, worker):
-        super(Install, self).__init__(worker, "bundle:install", ['cwd'])
+        super(Install, self).__init__(worker, "bundle:install", ['cwd', 'jobs'])
 
     def work(self):
+        cwd = self.args['cwd']
+        env = read_env(cwd+"/.HQ_ENV")
+
+        try:
+            with open(os.path.join(cwd, "Gemfile.lock"), 'rb') as f:
+                lock = f.read()
+            key = hashlib.sha256(ruby_version(env, cwd) + "\n" + lock).hexdigest()
+        except (EnvironmentError, subprocess.CalledProcessError):
+            self.logger.warning("Can not key the bundle of " + cwd + ". Skipping bundle store")
+            return self.bundle_install(cwd, env)
+
+        store_path = self.worker.config.bundle_store_path
+        stored = os.path.join(store_path, key)
+
+        if os.path.isdir(stored):
+            self.logger.info("Using stored bundle " + key)
+
+            try:
+                place_bundle(stored, cwd)
+            except EnvironmentError as e:
+                return -1, "Error linking stored bundle " + str(e)
+
+            return 0, ""
+
+        exitCode, error = self.bundle_install(cwd, env)
+
+        if exitCode == 0:
+            try:
+                self.store_bundle(cwd, store_path, stored)
+            except EnvironmentError as e:
+                self.logger.warning("Error storing bundle " + key + " " + str(e))
+
+        return exitCode, error
+
+    def bundle_install(self, cwd, env):
+        jobs = self.args.get('jobs') or str(multiprocessing.cpu_count())
+
+        return self.run_command(["bundle", "install", "--deployment", "--without", "development", "test",
+                                 "--jobs", jobs], cwd=cwd, env=env)
+
+    def store_bundle(self, cwd, store_path, stored):
+        if not os.path.isdir(store_path):
+            os.makedirs(store_path)
+
+        build = tempfile.mkdtemp(dir=store_path, prefix=".hq-")
+
+        try:
+            place_bundle(cwd, build)
+        except EnvironmentError:
+            shutil.rmtree(build, ignore_errors=True)
+            raise
 
-        return self.run_command(["bundle", "install", "--deployment", "--without", "development", "test"],
-                                cwd=self.args['cwd'], env=self.read_env_file(self.args['cwd']+"/.HQ_ENV"))
+        try:
+            os.rename(build, stored)
+        except OSError:
+            # Another build of the same lockfile finished first
+            shutil.rmtree(build, ignore_errors=True)
@@ -1,4 +1,7 @@
 from hqworker.processor import ActionProcessor
+from hqcodedeployer.worker.fs import walk_tree, parse_mode
+import os
+import stat
 
 
 class ChmodWorker(ActionProcessor):
@@ -7,9 +10,25 @@ class ChmodWorker(ActionProcessor):
         super(ChmodWorker, self).__init__(worker, "chmod", ["options", "mode", "file"])
 
     def work(self):
-        if self.args["options"] is not None:
-            cmd_list = ['chmod', self.args["options"], self.args["mode"], self.args["file"]]
+        options = self.args.get("options")
+
+        # Options other than -R are still handed to chmod itself
+        if options is not None and options != "-R":
+            return self.run_command(['chmod', options, self.args["mode"], self.args["file"]])
+
+        if options == "-R":
+            paths = walk_tree(self.args["file"])
         else:
-            cmd_list = ['chmod', self.args["mode"], self.args["file"]]
+            paths = [self.args["file"]]
+
+        try:
+            for path in paths:
+                if os.path.islink(path) and path != self.args["file"]:
+                    continue
+                os.chmod(path, stat.S_IMODE(parse_mode(self.args["mode"], os.stat(path).st_mode)))
+        except ValueError as e:
+            return -1, str(e)
+        except EnvironmentError as e:
+            return -1, "Error changing mode " + str(e)
 
-        return self.run_command(cmd_list)
+        return 0, ""
@@ -1,4 +1,6 @@
 from hqworker.processor import ActionProcessor
+from hqcodedeployer.worker.fs import walk_tree, owner_ids
+import os
 
 
 class ChownWorker(ActionProcessor):
@@ -9,20 +11,35 @@ class ChownWorker(ActionProcessor):
     def work(self):
         group = self.args["group"]
         owner = self.args["owner"]
+        options = self.args.get("options")
 
-        if group is not None:
-            group = ":{0}".format(group)
-        else:
-            group = ""
+        # Options other than -R are still handed to chown itself
+        if options is not None and options != "-R":
+            if group is not None:
+                group = ":{0}".format(group)
+            else:
+                group = ""
 
-        if owner is None:
-            owner = ""
+            if owner is None:
+                owner = ""
 
-        ownership = "{0}{1}".format(owner, group)
+            ownership = "{0}{1}".format(owner, group)
 
-        if self.args["options"] is not None:
-            cmd_list = ['chown', self.args["options"], ownership, self.args["file"]]
-        else:
-            cmd_list = ['chown', ownership, self.args["file"]]
+            return self.run_command(['chown', options, ownership, self.args["file"]])
 
-        return self.run_command(cmd_list)
+        try:
+            uid, gid = owner_ids(owner, group)
+        except KeyError as e:
+            return -1, "Unknown owner or group " + str(e)
+
+        try:
+            os.chown(self.args["file"], uid, gid)
+
+            if options == "-R":
+                for path in walk_tree(self.args["file"]):
+                    if path != self.args["file"]:
+                        os.lchown(path, uid, gid)
+        except EnvironmentError as e:
+            return -1, "Error changing owner " + str(e)
+
+        return 0, ""
@@ -1,4 +1,5 @@
 from hqworker.processor import ActionProcessor
+from hqcodedeployer.worker.fs import copy_tree
 
 
 class CopyWorker(ActionProcessor):
@@ -7,5 +8,9 @@ class CopyWorker(ActionProcessor):
         super(CopyWorker, self).__init__(worker, "copy", ["from", "to"])
 
     def work(self):
-        return 0, ""
+        try:
+            copy_tree(self.args["from"], self.args["to"])
+        except EnvironmentError as e:
+            return -1, "Error copying " + self.args["from"] + " " + str(e)
 
+        return 0, ""
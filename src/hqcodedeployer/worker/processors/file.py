@@ -1,6 +1,16 @@
 from hqworker.processor import ActionProcessor
-import urllib
+from hqcodedeployer.worker.artifacts import file_digest
 import base64
+import hashlib
+import httplib
+import os
+import threading
+import time
+import urllib2
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_TIMEOUT = 60
+DOWNLOAD_RETRIES = 3
 
 
 class Touch(ActionProcessor):
@@ -9,7 +19,13 @@ class Touch(ActionProcessor):
         super(Touch, self).__init__(worker, "file:touch", ["file"])
 
     def work(self):
-        return self.run_command(['touch', self.args["file"]])
+        try:
+            with open(self.args["file"], "a"):
+                os.utime(self.args["file"], None)
+        except EnvironmentError as e:
+            return -1, "Error touching file " + str(e)
+
+        return 0, ""
 
 
 class Write(ActionProcessor):
@@ -36,13 +52,170 @@ class Write(ActionProcessor):
 
 class Download(ActionProcessor):
 
+    # Streams url into <file>.part and renames it into place once complete. When an attempt fails the
+    # next one resumes with a range request, guarded by If-Range so a file that changed in between is
+    # downloaded again instead of being appended to. A .part left by an earlier action is never trusted.
+    # When digest is given the SHA-256 of the download is verified before the rename. connections > 1
+    # fetches ranges of the file in parallel when the server supports them.
+
     def __init__(self, worker):
-        super(Download, self).__init__(worker, "file:download", ["file", "url"])
+        super(Download, self).__init__(worker, "file:download", ["file", "url", "digest", "connections", "retries"])
 
     def work(self):
+        part = self.args['file'] + ".part"
+        retries = int(self.args.get('retries') or DOWNLOAD_RETRIES)
+        connections = int(self.args.get('connections') or 1)
+
+        # ETag or Last-Modified of the response the .part was started from
+        validator = {}
+
         try:
-            urllib.urlretrieve(self.args['url'], self.args['file'])
-        except Exception as e:
-            return -1, e.message
+            if os.path.lexists(part):
+                os.unlink(part)
+        except EnvironmentError as e:
+            return -1, "Error removing old partial download " + str(e)
+
+        for attempt in range(retries + 1):
+            if attempt > 0:
+                self.logger.warning("Retrying download of " + self.args['url'] + " (" + str(attempt) + ")")
+                time.sleep(min(2 ** attempt, 30))
+
+            try:
+                length = None
+                if connections > 1:
+                    length = self.range_length()
+
+                if length is not None and length >= connections * DOWNLOAD_CHUNK_SIZE:
+                    digest = self.download_ranges(part, length, connections)
+                else:
+                    digest = self.download(part, validator)
+                break
+            except (EnvironmentError, httplib.HTTPException) as e:
+                error = str(e)
+        else:
+            return -1, "Error downloading " + self.args['url'] + " " + error
+
+        if self.args.get('digest') is not None and digest != self.args['digest']:
+            os.unlink(part)
+            return -1, "Download digest " + digest + " does not match " + self.args['digest']
 
-        return 0, ""
\ No newline at end of file
+        try:
+            os.rename(part, self.args['file'])
+        except EnvironmentError as e:
+            return -1, "Error moving download into place " + str(e)
+
+        return 0, ""
+
+    def download(self, part, validator):
+        sha = hashlib.sha256()
+        offset = 0
+
+        # Hash what an earlier attempt already got and ask for the rest only. Without a validator
+        # there is no way to tell the file did not change, so start over.
+        if os.path.isfile(part) and validator.get('value') is not None:
+            with open(part, 'rb') as f:
+                for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+                    sha.update(chunk)
+                    offset += len(chunk)
+
+        request = urllib2.Request(self.args['url'])
+        if offset > 0:
+            request.add_header('Range', 'bytes=' + str(offset) + '-')
+            request.add_header('If-Range', validator['value'])
+
+        try:
+            response = urllib2.urlopen(request, timeout=DOWNLOAD_TIMEOUT)
+        except urllib2.HTTPError as e:
+            # The partial file already is the whole file
+            if e.code == 416 and offset > 0 and e.info().getheader('Content-Range') == 'bytes */' + str(offset):
+                return sha.hexdigest()
+            raise
+
+        info = response.info()
+
+        if offset > 0 and response.getcode() == 206:
+            # A range has to start where the part ends, anything else and the next attempt starts over
+            if not (info.getheader('Content-Range') or '').startswith('bytes ' + str(offset) + '-'):
+                os.unlink(part)
+                validator.clear()
+                raise httplib.HTTPException("Unexpected range " + str(info.getheader('Content-Range')))
+        elif offset > 0:
+            # If-Range answers with the whole file when it changed
+            sha = hashlib.sha256()
+            offset = 0
+
+        # Weak ETags can not be used with If-Range
+        etag = info.getheader('ETag')
+        if etag is None or etag.startswith('W/'):
+            etag = None
+        validator['value'] = etag or info.getheader('Last-Modified')
+
+        received = 0
+
+        with open(part, 'ab' if offset > 0 else 'wb') as f:
+            for chunk in iter(lambda: response.read(DOWNLOAD_CHUNK_SIZE), b''):
+                sha.update(chunk)
+                f.write(chunk)
+                received += len(chunk)
+
+        # A connection closed early just looks like the end of the body
+        length = info.getheader('Content-Length')
+        if length is not None and received != int(length):
+            raise httplib.IncompleteRead(str(received) + " of " + length + " bytes")
+
+        return sha.hexdigest()
+
+    def range_length(self):
+        request = urllib2.Request(self.args['url'])
+        request.get_method = lambda: 'HEAD'
+        response = urllib2.urlopen(request, timeout=DOWNLOAD_TIMEOUT)
+
+        if response.info().getheader('Accept-Ranges') != 'bytes':
+            return None
+
+        length = response.info().getheader('Content-Length')
+        if length is None:
+            return None
+
+        return int(length)
+
+    def download_ranges(self, part, length, connections):
+        with open(part, 'wb') as f:
+            f.truncate(length)
+
+        size = (length + connections - 1) // connections
+        errors = []
+
+        def download_range(start):
+            end = min(start + size, length) - 1
+
+            try:
+                request = urllib2.Request(self.args['url'])
+                request.add_header('Range', 'bytes=' + str(start) + '-' + str(end))
+                response = urllib2.urlopen(request, timeout=DOWNLOAD_TIMEOUT)
+
+                if response.getcode() != 206:
+                    raise httplib.HTTPException("Server ignored range request")
+
+                with open(part, 'r+b') as f:
+                    f.seek(start)
+                    for chunk in iter(lambda: response.read(DOWNLOAD_CHUNK_SIZE), b''):
+                        f.write(chunk)
+
+                    if f.tell() != end + 1:
+                        raise httplib.HTTPException("Short range " + str(start) + "-" + str(end))
+            except (EnvironmentError, httplib.HTTPException) as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=download_range, args=(start,)) for start in range(0, length, size)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if len(errors) > 0:
+            # Ranges may have holes, the next attempt starts over
+            os.unlink(part)
+            raise errors[0]
+
+        return file_digest(part)
@@ -1,34 +1,114 @@
 from hqworker.processor import ActionProcessor
-import subprocess
+import fcntl
+import hashlib
+import os
+
+
+def read_head(git_dir):
+    # Resolves HEAD by reading the ref files directly instead of running git rev-parse
+    with open(os.path.join(git_dir, "HEAD")) as f:
+        head = f.read().strip()
+
+    if not head.startswith("ref: "):
+        return head
+
+    ref = head[5:]
+
+    if os.path.isfile(os.path.join(git_dir, ref)):
+        with open(os.path.join(git_dir, ref)) as f:
+            return f.read().strip()
+
+    with open(os.path.join(git_dir, "packed-refs")) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 2 and parts[1] == ref:
+                return parts[0]
+
+    raise EnvironmentError("Unknown ref " + ref)
 
 
 class Clone(ActionProcessor):
 
+    # Keeps a bare mirror of every repo on the worker and only fetches what changed since the last
+    # clone. The build directory is cloned from the mirror, which hardlinks the objects instead of
+    # transferring them again. depth makes a shallow clone and sparse limits the checkout to the
+    # given space separated paths.
+
     def __init__(self, worker):
-        super(Clone, self).__init__(worker, "git:clone", ['repo', 'branch', 'cwd'])
+        super(Clone, self).__init__(worker, "git:clone", ['repo', 'branch', 'cwd', 'revision', 'depth', 'sparse'])
 
     def work(self):
+        repo = self.args['repo']
+        branch = self.args.get('branch')
+        revision = self.args.get('revision')
+        cwd = self.args['cwd']
+
+        mirror_path = self.worker.config.git_mirror_path
+        if not os.path.isdir(mirror_path):
+            os.makedirs(mirror_path)
+
+        mirror = os.path.join(mirror_path, hashlib.sha1(repo).hexdigest() + ".git")
+
+        # Only one build at a time may update a mirror
+        with open(mirror + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
 
-        exitCode, error = self.run_command(['/usr/bin/git', 'clone', self.args['repo'], self.args['cwd']])
-        
-        if exitCode == 0 and self.args['branch'] is not None:
-            exitCode, error = self.run_command(['/usr/bin/git', 'checkout', self.args['branch']], cwd=self.args['cwd'])
+            if os.path.isdir(mirror):
+                exitCode, error = self.run_command(['/usr/bin/git', 'fetch', '--prune', 'origin'], cwd=mirror)
+            else:
+                exitCode, error = self.run_command(['/usr/bin/git', 'clone', '--mirror', repo, mirror])
+
+            if exitCode != 0:
+                return exitCode, error
+
+            clone = ['/usr/bin/git', 'clone', '--no-checkout']
+            if self.args.get('depth') is not None:
+                # Shallow clones need the file protocol, they can not hardlink the objects anyway
+                clone += ['--depth', self.args['depth'], '--no-single-branch', 'file://' + mirror, cwd]
+            else:
+                clone += [mirror, cwd]
+
+            exitCode, error = self.run_command(clone)
+
+        if exitCode == 0:
+            exitCode, error = self.run_command(['/usr/bin/git', 'remote', 'set-url', 'origin', repo], cwd=cwd)
+
+        if exitCode == 0 and self.args.get('sparse') is not None:
+            exitCode, error = self.run_command(['/usr/bin/git', 'config', 'core.sparseCheckout', 'true'], cwd=cwd)
+
+            if exitCode == 0:
+                try:
+                    with open(cwd+"/.git/info/sparse-checkout", "w") as f:
+                        f.write("\n".join(self.args['sparse'].split()) + "\n")
+                except EnvironmentError:
+                    exitCode = -1
+                    error = "Error creating sparse checkout file"
+
+        if exitCode == 0:
+            exitCode, error = self.run_command(['/usr/bin/git', 'checkout', revision or branch or 'master'], cwd=cwd)
+
+            # The revision may be older than the shallow history
+            if exitCode != 0 and revision is not None and self.args.get('depth') is not None:
+                exitCode, error = self.run_command(['/usr/bin/git', 'fetch', '--unshallow', 'file://' + mirror],
+                                                   cwd=cwd)
+                if exitCode == 0:
+                    exitCode, error = self.run_command(['/usr/bin/git', 'checkout', revision], cwd=cwd)
 
         if exitCode == 0:
             try:
-                with open(self.args['cwd']+"/BRANCH", "w") as f:
-                    f.write(self.args['branch'])
+                with open(cwd+"/BRANCH", "w") as f:
+                    f.write(branch or '')
             except EnvironmentError:
                 exitCode = -1
                 error = "Error creating branch file"
 
         if exitCode == 0:
             try:
-                with open(self.args['cwd']+"/REVISION", "w") as f:
-                    sha = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=self.args['cwd'])
-                    f.write(sha)
+                sha = read_head(cwd+"/.git")
+                with open(cwd+"/REVISION", "w") as f:
+                    f.write(sha + "\n")
             except EnvironmentError:
                 exitCode = -1
                 error = "Error creating revision file"
-        
-        return exitCode, error
\ No newline at end of file
+
+        return exitCode, error
@@ -0,0 +1,101 @@
+from hqworker.processor import ActionProcessor
+import threading
+
+
+class Graph(ActionProcessor):
+
+    # Runs the actions of a task that declared depends_on. Every action whose dependencies finished
+    # is started, up to the worker's action_pool_size at a time. After a failure no
+    # new actions are started and the first failure is returned once the running ones finished.
+
+    def __init__(self, worker):
+        super(Graph, self).__init__(worker, "actions:graph", [])
+        self.arguments = {}
+
+    def do_work(self, arguments):
+        # The flattened <index>:<field> arguments are not known up front
+        self.arguments = arguments or {}
+        return super(Graph, self).do_work(arguments)
+
+    def work(self):
+        actions = self.parse_actions()
+        pool_size = self.worker.config.action_pool_size
+
+        pending = set(range(len(actions)))
+        running = set()
+        done = set()
+        finished = []
+        failure = None
+        condition = threading.Condition()
+
+        def run(index):
+            name, processor, arguments, dependencies = actions[index]
+
+            try:
+                result = self.worker.run_action(processor, arguments)
+            except Exception as e:
+                result = (-1, "Error running action " + name + " " + str(e))
+
+            with condition:
+                finished.append((index, result))
+                condition.notify()
+
+        with condition:
+            while len(done) < len(actions):
+                if failure is None:
+                    for index in sorted(pending):
+                        if len(running) >= pool_size:
+                            break
+
+                        if actions[index][3] <= done:
+                            self.logger.info("Starting action " + actions[index][0])
+                            pending.discard(index)
+                            running.add(index)
+                            thread = threading.Thread(target=run, args=(index,))
+                            thread.daemon = True
+                            thread.start()
+
+                if len(running) == 0:
+                    break
+
+                while len(finished) == 0:
+                    condition.wait()
+
+                for index, (exit_code, message) in finished:
+                    running.discard(index)
+                    done.add(index)
+
+                    if exit_code != 0 and failure is None:
+                        failure = (exit_code, "Action " + actions[index][0] + " failed: " + str(message))
+
+                del finished[:]
+
+        if failure is not None:
+            return failure
+
+        if len(done) < len(actions):
+            return -1, "Actions could not be scheduled"
+
+        return 0, ""
+
+    def parse_actions(self):
+        actions = {}
+
+        for key, value in self.arguments.iteritems():
+            index, sep, field = key.partition(":")
+            if not sep or not index.isdigit():
+                continue
+
+            action = actions.setdefault(int(index), {'arguments': {}})
+            if field.startswith("arg:"):
+                action['arguments'][field[4:]] = value
+            else:
+                action[field] = value
+
+        parsed = []
+        for index in range(len(actions)):
+            action = actions[index]
+            dependencies = set(int(dependency) for dependency in action['depends_on'].split(",") if dependency)
+            parsed.append((action['name'], action['processor'], action['arguments'], dependencies))
+
+        return parsed
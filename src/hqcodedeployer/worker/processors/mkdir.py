@@ -1,4 +1,5 @@
 from hqworker.processor import ActionProcessor
+import os
 
 
 class MkDirWorker(ActionProcessor):
@@ -7,4 +8,10 @@ class MkDirWorker(ActionProcessor):
         super(MkDirWorker, self).__init__(worker, "mkdir", ["dir"])
 
     def work(self):
-        return self.run_command(['mkdir', '-p', self.args["dir"]])
+        try:
+            if not os.path.isdir(self.args["dir"]):
+                os.makedirs(self.args["dir"])
+        except EnvironmentError as e:
+            return -1, "Error creating directory " + str(e)
+
+        return 0, ""
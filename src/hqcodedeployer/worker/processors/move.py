@@ -1,4 +1,5 @@
 from hqworker.processor import ActionProcessor
+import shutil
 
 
 class MoveWorker(ActionProcessor):
@@ -7,6 +8,9 @@ class MoveWorker(ActionProcessor):
         super(MoveWorker, self).__init__(worker, "move", ["from", "to"])
 
     def work(self):
-        return self.run_command(['mv', self.args["from"], self.args["to"]])
-
+        try:
+            shutil.move(self.args["from"], self.args["to"])
+        except (EnvironmentError, shutil.Error) as e:
+            return -1, "Error moving " + self.args["from"] + " " + str(e)
 
+        return 0, ""
@@ -1,81 +1,169 @@
 from hqworker.processor import ActionProcessor
-from virtualenvapi.manage import VirtualEnvironment, PackageInstallationException
+from hqcodedeployer.worker.artifacts import place_file
+from virtualenvapi.manage import VirtualEnvironment
+from multiprocessing.pool import ThreadPool
+import hashlib
+import os
+import shutil
+import tempfile
+
+PYTHON = "python2.7"
+
+
+def requirements_hash(requirements, python=PYTHON):
+    sha = hashlib.sha256(python + "\n")
+
+    with open(requirements, 'rb') as f:
+        sha.update(f.read())
+
+    return sha.hexdigest()
+
+
+def write_marker(marker, digest):
+    # Written under a temporary name and renamed, the old marker may still be linked elsewhere
+    fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(marker), prefix=".hq-")
+
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(digest)
+        os.rename(tmp_name, marker)
+    except EnvironmentError:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+        raise
+
+
+def requirement_lines(requirements):
+    lines = []
+
+    with open(requirements) as f:
+        for line in f.readlines():
+            line = line.strip().replace(" ", "")
+            if line.startswith("#"):
+                continue
+            if not line:
+                continue
+            lines.append(line)
+
+    return lines
 
 
 class Install(ActionProcessor):
 
+    # Installs the whole requirements file with one pip run. The requirements hash is recorded in the
+    # venv so installing the same requirements into it again is skipped.
+
     def __init__(self, worker):
         super(Install, self).__init__(worker, "pip:install", ['venv', 'wheel-dir', 'requirements'])
 
     def work(self):
 
-        env = VirtualEnvironment(path=self.args['venv'], python="python2.7")
+        env = VirtualEnvironment(path=self.args['venv'], python=PYTHON)
+        env.open_or_create()
 
-        if self.args['wheel-dir'] is not None:
-            exitCode, error = self.install_from_file(self.args['requirements'], env, wheel=self.args['wheel-dir'])
-        else:
-            exitCode, error = self.install_from_file(self.args['requirements'], env)
+        try:
+            digest = requirements_hash(self.args['requirements'])
+        except EnvironmentError as e:
+            return -1, "Error reading requirements " + str(e)
+
+        marker = os.path.join(self.args['venv'], ".hq-requirements")
+
+        if os.path.isfile(marker):
+            with open(marker) as f:
+                if f.read().strip() == digest:
+                    self.logger.info("Python requirements " + digest + " already installed")
+                    return 0, ""
+
+        exitCode, error = self.install_from_file(self.args['requirements'], env, wheel=self.args.get('wheel-dir'))
+
+        if exitCode == 0:
+            try:
+                write_marker(marker, digest)
+            except EnvironmentError:
+                return -1, "Error creating requirements marker"
 
         return exitCode, error
 
     def install_from_file(self, requirements, env, wheel=None):
-        with open(requirements) as f:
-
-            options = []
-
-            if wheel is not None:
-                options.append('--no-index')
-                options.append('--find-links='+wheel)
-                options.append('--use-wheel')
-
-            for line in f.readlines():
-                line = line.replace("/n", "").replace("/t", "")
-                line = line.strip().replace(" ", "")
-                if line.startswith("#"):
-                    continue
-                if not line:
-                    continue
-                try:
-                    self.logger.info("Installing python package "+line)
-                    env.install(line, options=options)
-                    self.logger.info("Installed python package "+line)
-                except PackageInstallationException as e:
-                    return -1, "Error installing package "+line+" Message: "+e.message[1]
+        options = []
 
-        return 0, ""
+        if wheel is not None:
+            options.append('--no-index')
+            options.append('--find-links='+wheel)
+            options.append('--use-wheel')
+
+        self.logger.info("Installing python packages from "+requirements)
+        return self.run_command([os.path.join(env.path, 'bin', 'pip'), 'install', '-r', requirements] + options)
 
 
 class Wheel(ActionProcessor):
 
+    # Wheels are cached per requirements hash in the worker's wheel_cache_path and only built when the
+    # requirements changed. With jobs set every requirement is first wheeled on its own in a pool, a final
+    # pip run then only has to resolve the dependencies against the built wheels.
+
     def __init__(self, worker):
-        super(Wheel, self).__init__(worker, "pip:wheel", ['venv', 'wheel-dir', 'requirements'])
+        super(Wheel, self).__init__(worker, "pip:wheel", ['venv', 'wheel-dir', 'requirements', 'jobs'])
 
     def work(self):
-        env = VirtualEnvironment(path=self.args['venv'], python="python2.7")
+        env = VirtualEnvironment(path=self.args['venv'], python=PYTHON)
 
         env.install('wheel')
 
-        exit_code, error = self.wheel_from_file(self.args['requirements'], env, self.args['wheel-dir'])
+        try:
+            digest = requirements_hash(self.args['requirements'])
+        except EnvironmentError as e:
+            return -1, "Error reading requirements " + str(e)
 
-        return exit_code, error
+        cache = os.path.join(self.worker.config.wheel_cache_path, digest)
 
-    def wheel_from_file(self, requirements, env, wheel):
-        with open(requirements) as f:
-
-            options = ['--wheel-dir='+wheel]
-
-            for line in f.readlines():
-                line = line.replace("/n", "").replace("/t", "")
-                line = line.strip().replace(" ", "")
-                if line.startswith("#"):
-                    continue
-                if not line:
-                    continue
-                try:
-                    self.logger.info("Wheeling python package "+line)
-                    env.wheel(line, options=options)
-                    self.logger.info("Wheeled python package "+line)
-                except PackageInstallationException as e:
-                    return -1, "Error wheeling package "+line+" Message: "+e.message[1]
+        if not os.path.isdir(cache):
+            if not os.path.isdir(self.worker.config.wheel_cache_path):
+                os.makedirs(self.worker.config.wheel_cache_path)
+
+            build = tempfile.mkdtemp(dir=self.worker.config.wheel_cache_path, prefix=".hq-")
+
+            exit_code, error = self.wheel_from_file(self.args['requirements'], env, build)
+
+            if exit_code != 0:
+                shutil.rmtree(build, ignore_errors=True)
+                return exit_code, error
+
+            try:
+                os.rename(build, cache)
+            except OSError:
+                # Another build of the same requirements finished first
+                shutil.rmtree(build, ignore_errors=True)
+        else:
+            self.logger.info("Using cached wheels for python requirements " + digest)
+
+        try:
+            for name in os.listdir(cache):
+                place_file(os.path.join(cache, name), os.path.join(self.args['wheel-dir'], name))
+        except EnvironmentError as e:
+            return -1, "Error copying wheels " + str(e)
 
         return 0, ""
+
+    def wheel_from_file(self, requirements, env, wheel):
+        pip = os.path.join(env.path, 'bin', 'pip')
+
+        jobs = int(self.args.get('jobs') or 1)
+
+        if jobs > 1:
+            def wheel_requirement(line):
+                self.logger.info("Wheeling python package "+line)
+                return line, self.run_command([pip, 'wheel', '--no-deps', '--wheel-dir='+wheel, line])
+
+            pool = ThreadPool(jobs)
+            try:
+                results = pool.map(wheel_requirement, requirement_lines(requirements))
+            finally:
+                pool.close()
+
+            for line, (exit_code, error) in results:
+                if exit_code != 0:
+                    return -1, "Error wheeling package "+line+" Message: "+error
+
+        self.logger.info("Wheeling python packages from "+requirements)
+        return self.run_command([pip, 'wheel', '--wheel-dir='+wheel, '--find-links='+wheel, '-r', requirements])
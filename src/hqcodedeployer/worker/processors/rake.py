@@ -1,4 +1,5 @@
 from hqworker.processor import ActionProcessor
+from hqcodedeployer.worker.environment import read_env
 
 
 class RakeWorker(ActionProcessor):
@@ -8,8 +9,10 @@ class RakeWorker(ActionProcessor):
 
     def work(self):
 
-        env = self.read_env_file(self.args['cwd']+"/.HQ_ENV")
-        env['RAILS_ENV'] = self.worker.get_tags()['environment']
+        environment = self.worker.get_tags()['environment']
+
+        env = dict(read_env(self.args['cwd']+"/.HQ_ENV"))
+        env['RAILS_ENV'] = environment
 
         return self.run_command(['bundle', 'exec', 'rake', self.args["command"],
-                                 "RAILS_ENV="+self.worker.get_tags()['environment']], cwd=self.args["cwd"], env=env)
+                                 "RAILS_ENV="+environment], cwd=self.args["cwd"], env=env)
@@ -1,4 +1,5 @@
 from hqworker.processor import ActionProcessor
+from hqcodedeployer.worker.environment import read_env, write_env_diff
 import subprocess
 
 class SourceWorker(ActionProcessor):
@@ -8,13 +9,30 @@ class SourceWorker(ActionProcessor):
 
     def work(self):
 
-        env = self.read_env_file(self.args['cwd']+"/.HQ_ENV")
+        env_file = self.args['cwd']+"/.HQ_ENV"
+        env = read_env(env_file)
 
-        proc = subprocess.Popen(["sh", "-c", "source "+self.args['input_file']+"; env"],
+        # . only looks through PATH for names without a slash, source also looked in cwd
+        input_file = self.args['input_file']
+        if "/" not in input_file:
+            input_file = "./" + input_file
+
+        proc = subprocess.Popen(["sh", "-c", ". "+input_file+" && env -0"],
                                 stdout=subprocess.PIPE, env=env, cwd=self.args['cwd'])
+        output = proc.communicate()[0]
 
-        with open(self.args['cwd']+"/.HQ_ENV", 'w') as f:
-            f.write(proc.communicate()[0])
+        if proc.returncode != 0:
+            return proc.returncode, "Error sourcing " + self.args['input_file']
 
-        return 0, ""
+        variables = {}
+        for line in output.split("\0"):
+            key, sep, value = line.partition("=")
+            if sep:
+                variables[key] = value
 
+        try:
+            write_env_diff(env_file, variables)
+        except EnvironmentError as e:
+            return -1, "Error writing environment " + str(e)
+
+        return 0, ""
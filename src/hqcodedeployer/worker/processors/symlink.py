@@ -1,4 +1,5 @@
 from hqworker.processor import ActionProcessor
+import os
 
 
 class Symlink(ActionProcessor):
@@ -13,7 +14,20 @@ class Symlink(ActionProcessor):
         if self.args['target'] is None:
             return -1, "Target not provided"
 
-        exitCode, error = self.run_command(['/bin/ln', '-sfn', self.args['source'], self.args['target']])
+        target = self.args['target']
 
-        return exitCode, error
+        # Same as ln -sfn, a real directory gets the link inside it, anything else is replaced
+        if os.path.isdir(target) and not os.path.islink(target):
+            target = os.path.join(target, os.path.basename(self.args['source'].rstrip("/")))
 
+        tmp_target = target + ".hq-tmp"
+
+        try:
+            if os.path.lexists(tmp_target):
+                os.unlink(tmp_target)
+            os.symlink(self.args['source'], tmp_target)
+            os.rename(tmp_target, target)
+        except EnvironmentError as e:
+            return -1, "Error creating symlink " + str(e)
+
+        return 0, ""
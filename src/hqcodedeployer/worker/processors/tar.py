@@ -1,26 +1,233 @@
 from hqworker.processor import ActionProcessor
+from hqcodedeployer.worker.artifacts import DigestReader, DIGEST_CHUNK_SIZE
+from hqcodedeployer.worker.processors.file import DOWNLOAD_TIMEOUT
+import distutils.spawn
+import errno
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import threading
+import urllib2
+
+# Compressors reading a tar stream on stdin and writing to stdout, and the matching decompressors
+COMPRESSORS = {
+    'pigz': ['pigz', '-c'],
+    'zstd': ['zstd', '-T0', '-q', '-c'],
+}
+DECOMPRESSORS = {
+    'pigz': ['pigz', '-d', '-c'],
+    'zstd': ['zstd', '-d', '-q', '-c'],
+}
+
+
+def compression_tool(compression):
+    # gzip archives are written with pigz when it is installed, it is multi threaded and gzip compatible
+    if compression == 'gzip' and distutils.spawn.find_executable('pigz') is not None:
+        return 'pigz'
+
+    if compression in COMPRESSORS:
+        return compression
+
+    return None
+
+
+def safe_members(archive, root):
+    root = os.path.realpath(root)
+
+    for member in archive:
+        path = os.path.realpath(os.path.join(root, member.name))
+        if path != root and not path.startswith(root + os.sep):
+            raise tarfile.TarError("Archive member " + member.name + " is outside of the extract directory")
+        yield member
+
+
+def merge_tree(source, destination):
+    # Moves everything in source into destination the way tar -x extracts over an existing tree.
+    # Directories are merged, files and symlinks replace what is there, anything else in destination stays.
+    for name in os.listdir(source):
+        path = os.path.join(source, name)
+        target = os.path.join(destination, name)
+        target_is_dir = os.path.isdir(target) and not os.path.islink(target)
+
+        if os.path.isdir(path) and not os.path.islink(path):
+            if target_is_dir:
+                merge_tree(path, target)
+                shutil.copystat(path, target)
+                continue
+            elif os.path.lexists(target):
+                os.unlink(target)
+        elif target_is_dir:
+            raise OSError(errno.EISDIR, "Can not replace directory with a file", target)
+
+        os.rename(path, target)
+
+
+def extract_archive(reader, compression, extract_dir):
+    tool = compression_tool(compression)
+
+    if compression == 'gzip' and tool is None:
+        archive = tarfile.open(fileobj=reader, mode='r|gz')
+    elif compression == 'none':
+        archive = tarfile.open(fileobj=reader, mode='r|')
+    elif tool is not None:
+        extract_piped(reader, DECOMPRESSORS[tool], extract_dir)
+        return
+    else:
+        raise tarfile.TarError("Unknown compression " + compression)
+
+    with archive:
+        archive.extractall(extract_dir, members=safe_members(archive, extract_dir))
+
+
+def stop_process(proc):
+    # Kills a compressor that is no longer read from and reaps it
+    try:
+        proc.kill()
+    except OSError:
+        pass
+    proc.wait()
+
+
+def extract_piped(reader, command, extract_dir):
+    proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    errors = []
+
+    def feed():
+        try:
+            for chunk in iter(lambda: reader.read(DIGEST_CHUNK_SIZE), b''):
+                proc.stdin.write(chunk)
+        except EnvironmentError as e:
+            errors.append(e)
+        finally:
+            try:
+                proc.stdin.close()
+            except EnvironmentError:
+                pass
+
+    feeder = threading.Thread(target=feed)
+    feeder.daemon = True
+    feeder.start()
+
+    try:
+        with tarfile.open(fileobj=proc.stdout, mode='r|') as archive:
+            archive.extractall(extract_dir, members=safe_members(archive, extract_dir))
+    except Exception:
+        stop_process(proc)
+        raise
+    finally:
+        proc.stdout.close()
+        feeder.join()
+
+    proc.wait()
+
+    # A read error, e.g. a timeout, looks like the end of the archive to the decompressor
+    if len(errors) > 0:
+        raise errors[0]
+
+    if proc.returncode != 0:
+        raise tarfile.TarError(command[0] + " exited with " + str(proc.returncode))
+
+
+def write_archive(fileobj, mode, directory, archive_file):
+    # Adds everything in directory to the archive except the archive file itself
+    archive_file = os.path.realpath(archive_file)
+
+    with tarfile.open(fileobj=fileobj, mode=mode) as archive:
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if os.path.realpath(path) != archive_file:
+                archive.add(path, arcname=name)
 
 
 class UnTarWorker(ActionProcessor):
 
+    # Extracts file, or streams url straight into the extraction without an intermediate file. When
+    # digest is given the SHA-256 of the archive is verified while it is read and nothing is moved into
+    # dir unless it matches. The archive is merged into dir like tar -x does. compression is gzip
+    # (default), zstd or none.
+
     def __init__(self, worker):
-        super(UnTarWorker, self).__init__(worker, "untar", ["file", "dir"])
+        super(UnTarWorker, self).__init__(worker, "untar", ["file", "dir", "url", "digest", "compression"])
 
     def work(self):
-        return self.run_command(['/bin/tar', '-xzvf', self.args["file"]], cwd=self.args["dir"])
+        compression = self.args.get('compression') or 'gzip'
+
+        try:
+            if self.args.get('url') is not None:
+                source = urllib2.urlopen(self.args['url'], timeout=DOWNLOAD_TIMEOUT)
+            else:
+                source = open(self.args['file'], 'rb')
+        except Exception as e:
+            return -1, "Error opening archive " + str(e)
+
+        reader = DigestReader(source)
+
+        try:
+            extract_dir = tempfile.mkdtemp(dir=self.args['dir'], prefix=".hq-")
+        except EnvironmentError as e:
+            source.close()
+            return -1, "Error creating extract directory " + str(e)
+
+        try:
+            try:
+                extract_archive(reader, compression, extract_dir)
+                reader.drain()
+            finally:
+                source.close()
+
+            if self.args.get('digest') is not None and reader.hexdigest() != self.args['digest']:
+                return -1, "Archive digest " + reader.hexdigest() + " does not match " + self.args['digest']
+
+            merge_tree(extract_dir, self.args['dir'])
+        except (EnvironmentError, tarfile.TarError, urllib2.URLError) as e:
+            return -1, "Error extracting archive " + str(e)
+        finally:
+            shutil.rmtree(extract_dir, ignore_errors=True)
+
+        return 0, ""
 
 
 class TarWorker(ActionProcessor):
 
+    # Archives dir into file with the tarfile module. compression is gzip (default), zstd or none,
+    # gzip and zstd are compressed multi threaded when pigz or zstd are installed. extra_args are
+    # still passed to /bin/tar for archives that need its options.
+
     def __init__(self, worker):
-        super(TarWorker, self).__init__(worker, "tar", ["extra_args", "file", "dir"])
+        super(TarWorker, self).__init__(worker, "tar", ["extra_args", "file", "dir", "compression"])
 
     def work(self):
-        if 'extra_args' in self.args:
+        if self.args.get('extra_args') is not None:
             extra_args = self.args['extra_args'].split()
             cmd_list = ['/bin/tar'] + extra_args + ['-zcf', self.args["file"], '.']
-        else:
-            cmd_ist = ['/bin/tar', '-zcf', self.args["file"], '.']
+            return self.run_command(cmd_list, cwd=self.args["dir"])
+
+        compression = self.args.get('compression') or 'gzip'
+        tool = compression_tool(compression)
+
+        try:
+            with open(self.args['file'], 'wb') as f:
+                if tool is not None:
+                    proc = subprocess.Popen(COMPRESSORS[tool], stdin=subprocess.PIPE, stdout=f)
+                    try:
+                        write_archive(proc.stdin, 'w|', self.args['dir'], self.args['file'])
+                    except Exception:
+                        stop_process(proc)
+                        raise
+                    finally:
+                        proc.stdin.close()
 
-        return self.run_command(cmd_list, cwd=self.args["dir"])
+                    if proc.wait() != 0:
+                        return -1, tool + " exited with " + str(proc.returncode)
+                elif compression == 'gzip':
+                    write_archive(f, 'w|gz', self.args['dir'], self.args['file'])
+                elif compression == 'none':
+                    write_archive(f, 'w|', self.args['dir'], self.args['file'])
+                else:
+                    return -1, "Unknown compression " + compression
+        except (EnvironmentError, tarfile.TarError) as e:
+            return -1, "Error creating archive " + str(e)
 
+        return 0, ""
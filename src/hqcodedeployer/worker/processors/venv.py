@@ -1,16 +1,140 @@
 from hqworker.processor import ActionProcessor
-from virtualenvapi.manage import VirtualEnvironment, PackageInstallationException
+from hqcodedeployer.worker.processors.pip import requirements_hash, PYTHON
+from virtualenvapi.manage import VirtualEnvironment
+import os
+import shutil
+import tempfile
+
+# Files holding the absolute venv path that have to be rewritten instead of hardlinked
+REWRITE_SUFFIXES = ('.pth', '.egg-link', '.cfg')
+
+# Files at the top of a venv that processors write to later, a clone gets its own copy
+COPY_FILES = ('.hq-requirements', '.hq-venv-path')
+
+
+def clone_venv(source, source_path, destination):
+    # Hardlinks a pooled venv into place. Scripts and path files mention the path the venv was built
+    # at, those are written out again with the new path.
+    for root, dirs, files in os.walk(source):
+        target_root = os.path.join(destination, os.path.relpath(root, source))
+
+        if not os.path.isdir(target_root):
+            os.makedirs(target_root)
+
+        for name in dirs + files:
+            path = os.path.join(root, name)
+            target = os.path.join(target_root, name)
+
+            if os.path.islink(path):
+                link = os.readlink(path)
+                if link.startswith(source_path):
+                    link = destination + link[len(source_path):]
+                os.symlink(link, target)
+            elif name in files:
+                if os.path.basename(root) == 'bin' or name.endswith(REWRITE_SUFFIXES):
+                    with open(path, 'rb') as f:
+                        contents = f.read()
+
+                    if source_path in contents and '\0' not in contents:
+                        with open(target, 'wb') as f:
+                            f.write(contents.replace(source_path, destination))
+                        shutil.copymode(path, target)
+                        continue
+
+                if root == source and name in COPY_FILES:
+                    shutil.copy2(path, target)
+                    continue
+
+                os.link(path, target)
 
 
 class Venv(ActionProcessor):
 
+    # Without requirements the venv is just created. With requirements a venv with them installed is
+    # kept in the worker's venv_pool_path, keyed by requirements hash and python version, and hardlinked
+    # into dir. Pooled venvs are shared, apps must not modify files inside their venv. A dir that
+    # already holds files is used as it is and the requirements are installed into it.
+
     def __init__(self, worker):
-        super(Venv, self).__init__(worker, "venv", ['dir'])
+        super(Venv, self).__init__(worker, "venv", ['dir', 'requirements', 'wheel-dir'])
 
     def work(self):
 
-        env = VirtualEnvironment(path=self.args['dir'], python="python2.7")
+        if self.args.get('requirements') is None:
+            env = VirtualEnvironment(path=self.args['dir'], python=PYTHON)
+            env.open_or_create()
+            return 0, ""
 
-        env.open_or_create()
+        existed = os.path.isdir(self.args['dir'])
+
+        if existed and len(os.listdir(self.args['dir'])) > 0:
+            env = VirtualEnvironment(path=self.args['dir'], python=PYTHON)
+            env.open_or_create()
+            return self.install_requirements(self.args['dir'])
+
+        try:
+            digest = requirements_hash(self.args['requirements'])
+        except EnvironmentError as e:
+            return -1, "Error reading requirements " + str(e)
+
+        pool_path = self.worker.config.venv_pool_path
+        pooled = os.path.join(pool_path, digest)
+
+        if not os.path.isdir(pooled):
+            if not os.path.isdir(pool_path):
+                os.makedirs(pool_path)
+
+            exitCode, error = self.build_venv(pool_path, pooled)
+            if exitCode != 0:
+                return exitCode, error
+        else:
+            self.logger.info("Using pooled venv for python requirements " + digest)
+
+        try:
+            with open(os.path.join(pooled, ".hq-venv-path")) as f:
+                pooled_path = f.read()
+
+            clone_venv(pooled, pooled_path, os.path.abspath(self.args['dir']))
+        except EnvironmentError as e:
+            if not existed:
+                shutil.rmtree(self.args['dir'], ignore_errors=True)
+            return -1, "Error cloning venv " + str(e)
 
         return 0, ""
+
+    def install_requirements(self, path):
+        options = []
+        if self.args.get('wheel-dir') is not None:
+            options = ['--no-index', '--find-links='+self.args['wheel-dir'], '--use-wheel']
+
+        self.logger.info("Installing python requirements " + self.args['requirements'] + " into " + path)
+        return self.run_command([os.path.join(path, 'bin', 'pip'), 'install', '-r', self.args['requirements']] +
+                                options)
+
+    def build_venv(self, pool_path, pooled):
+        build = tempfile.mkdtemp(dir=pool_path, prefix=".hq-")
+
+        env = VirtualEnvironment(path=build, python=PYTHON)
+        env.open_or_create()
+
+        exitCode, error = self.install_requirements(build)
+
+        if exitCode == 0:
+            try:
+                with open(os.path.join(build, ".hq-venv-path"), "w") as f:
+                    f.write(build)
+                with open(os.path.join(build, ".hq-requirements"), "w") as f:
+                    f.write(os.path.basename(pooled))
+            except EnvironmentError as e:
+                exitCode, error = -1, "Error pooling venv " + str(e)
+
+        if exitCode == 0:
+            try:
+                os.rename(build, pooled)
+                return 0, ""
+            except OSError:
+                # Another build of the same requirements finished first
+                pass
+
+        shutil.rmtree(build, ignore_errors=True)
+        return exitCode, error
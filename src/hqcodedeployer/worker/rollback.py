@@ -28,3 +28,4 @@ class Worker(CDWorker):
 
     def on_register(self):
         self.logger.info("Registered Code Deployer Rollback Worker")
+        self.start_peer_server()
@@ -26,3 +26,4 @@ class Worker(CDWorker):
 
     def on_register(self):
         self.logger.info("Registered Code Deployer Stage Worker")
+        self.start_peer_server()
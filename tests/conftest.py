@@ -0,0 +1,55 @@
+import contextlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+
+@pytest.fixture
+def session():
+    # Database tests need the framework dependencies and a scratch postgres database, the models use
+    # postgres only column types. Point HQ_TEST_DATABASE_URL at one to run them.
+    url = os.environ.get('HQ_TEST_DATABASE_URL')
+    if url is None:
+        pytest.skip("HQ_TEST_DATABASE_URL is not set")
+
+    sqlalchemy = pytest.importorskip('sqlalchemy')
+    pytest.importorskip('hqlib.sql')
+    from sqlalchemy.orm import sessionmaker
+    from hqlib.sql import Base
+    import hqcodedeployer.models
+
+    engine = sqlalchemy.create_engine(url)
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+
+    try:
+        yield session
+    finally:
+        session.close()
+        Base.metadata.drop_all(engine)
+        engine.dispose()
+
+
+@contextlib.contextmanager
+def count_queries(session):
+    from sqlalchemy import event
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = session.get_bind()
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+# Modules still written against python 2 only APIs like dict.iteritems
+python2_only = pytest.mark.skipif(sys.version_info[0] > 2, reason="python 2 only")
@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+pytest.importorskip('schematics')
+
+from hqcodedeployer.framework.apptypes import AppTypeRegistry, AppTypeError
+
+APP_TYPE = {'tasks': [{'name': 'build', 'priority': 1, 'actions': [{'processor': 'mkdir', 'arguments': {'dir': '/tmp'}}]}]}
+
+
+def test_get_before_load_all_is_unavailable():
+    registry = AppTypeRegistry("stage")
+
+    with pytest.raises(AppTypeError) as e:
+        registry.get("python")
+
+    assert e.value.status == 503
+
+
+def test_load_all_missing_path(tmpdir):
+    registry = AppTypeRegistry("stage")
+    registry.load_all(str(tmpdir.join("missing")))
+
+    with pytest.raises(AppTypeError) as e:
+        registry.get("python")
+
+    assert e.value.status == 404
+
+
+def test_load_all_and_get(tmpdir):
+    tmpdir.join("python-stage.json").write(json.dumps(APP_TYPE))
+
+    registry = AppTypeRegistry("stage")
+    registry.load_all(str(tmpdir))
+
+    assert registry.get("python").tasks[0].name == "build"
+    assert registry.get("python") is registry.get("python")
@@ -0,0 +1,43 @@
+import pytest
+
+pytest.importorskip('hqlib')
+
+from hqcodedeployer.framework.builds import resolve_revision, pin_revision
+
+REVISION = "0123456789abcdef0123456789abcdef01234567"
+
+
+def test_resolve_revision_passes_commits_through():
+    assert resolve_revision("/nonexistent", REVISION, 1) == REVISION
+
+
+def test_resolve_revision_unknown_repo(tmpdir):
+    assert resolve_revision(str(tmpdir.join("missing")), "master", 5) is None
+
+
+def test_pin_revision_sets_clone_revision():
+    rendered = [('build', [('git:clone', {'repo': 'repo', 'branch': 'master', 'cwd': '/tmp'}),
+                           ('mkdir', {'dir': '/tmp'})])]
+
+    pin_revision(rendered, REVISION)
+
+    assert rendered[0][1][0][1]['revision'] == REVISION
+    assert 'revision' not in rendered[0][1][1][1]
+
+
+def test_pin_revision_keeps_explicit_revision():
+    rendered = [('build', [('git:clone', {'repo': 'repo', 'revision': 'v1', 'cwd': '/tmp'})])]
+
+    pin_revision(rendered, REVISION)
+
+    assert rendered[0][1][0][1]['revision'] == 'v1'
+
+
+def test_pin_revision_in_action_graph():
+    rendered = [('build', [('actions:graph', {'0:processor': 'git:clone', '0:arg:repo': 'repo',
+                                              '1:processor': 'mkdir', '1:arg:dir': '/tmp'})])]
+
+    pin_revision(rendered, REVISION)
+
+    assert rendered[0][1][0][1]['0:arg:revision'] == REVISION
+    assert '1:arg:revision' not in rendered[0][1][0][1]
@@ -0,0 +1,72 @@
+import logging
+import time
+
+import pytest
+
+pytest.importorskip('pika')
+pytest.importorskip('hqframework')
+
+from hqcodedeployer.framework.events import TaskEventMixin
+
+
+class Framework(TaskEventMixin):
+
+    logger = logging.getLogger("hq.framework.codedeployer.test")
+
+    def __init__(self):
+        super(Framework, self).__init__()
+        self.reconciled = []
+
+    def reconcile_job(self, job_id):
+        self.reconciled.append(job_id)
+
+
+def test_wait_for_job_change_returns_new_version():
+    framework = Framework()
+    version = framework.watch_job(1)
+
+    framework.notify_job_change(1)
+
+    assert framework.wait_for_job_change(1, version, 5) == version + 1
+
+
+def test_other_jobs_do_not_end_the_wait():
+    framework = Framework()
+    version = framework.watch_job(1)
+    framework.watch_job(2)
+
+    framework.notify_job_change(2)
+
+    started = time.time()
+    assert framework.wait_for_job_change(1, version, 0.2) == version
+    assert time.time() - started >= 0.2
+
+
+def test_unwatched_jobs_are_not_tracked():
+    framework = Framework()
+
+    framework.notify_job_change(1)
+    framework.watch_job(1)
+    framework.unwatch_job(1)
+
+    assert framework.job_watchers == {}
+
+
+def test_process_job_wakes_the_job_watchers():
+    framework = Framework()
+    version = framework.watch_job(1)
+
+    framework.process_job(1)
+
+    assert framework.reconciled == [1]
+    assert framework.wait_for_job_change(1, version, 0) == version + 1
+
+
+def test_status_messages_do_not_launch_tasks():
+    # Only process_job moves jobs forward, so a task can never be launched twice by an event and a tick
+    framework = Framework()
+
+    framework.task_event(1, {'task_id': 1})
+    framework.process_job(1)
+
+    assert framework.reconciled == [1]
@@ -0,0 +1,123 @@
+import datetime
+
+from tests.conftest import count_queries
+
+
+def create_stage(session, targets=3, tasks=4):
+    from hqlib.sql.models import Job, JobTarget, Task, TaskStatus, Worker
+    from hqcodedeployer.models import Stage
+
+    job = Job(name='App Stage test', datacenter='test', user_assignment_id=1)
+    session.add(job)
+
+    for target_index in range(targets):
+        worker = Worker(target='worker' + str(target_index), framework='codedeployer-stage', datacenter='test',
+                        tags={})
+        job_target = JobTarget(job=job, worker=worker)
+
+        for task_index in range(tasks):
+            session.add(Task(name='task' + str(task_index), order=task_index, job_target=job_target,
+                             status=TaskStatus.PENDING))
+
+    stage = Stage(app='test', type='test', branch='master', job=job)
+    session.add(stage)
+    session.commit()
+
+    job_id = job.id
+    session.expunge_all()
+    return job_id
+
+
+def test_load_job_graph_is_one_query(session):
+    from hqcodedeployer.framework.graph import load_job_graph
+    from hqcodedeployer.models import Stage
+
+    job_id = create_stage(session)
+
+    with count_queries(session) as statements:
+        stage = load_job_graph(session, Stage, job_id)
+
+        for job_target in stage.job.targets:
+            job_target.worker.target
+            for task in job_target.tasks:
+                task.status
+
+    assert len(statements) == 1
+    assert len(stage.job.targets) == 3
+    assert all(len(job_target.tasks) == 4 for job_target in stage.job.targets)
+
+
+def test_commit_keeps_job_graph_loaded(session):
+    from hqcodedeployer.framework.graph import load_job_graph
+    from hqcodedeployer.models import Stage
+
+    job_id = create_stage(session)
+    stage = load_job_graph(session, Stage, job_id)
+
+    stage.job.targets[0].tasks[0].stopped_at = datetime.datetime.now()
+    session.commit()
+
+    with count_queries(session) as statements:
+        for job_target in stage.job.targets:
+            job_target.worker.target
+            for task in job_target.tasks:
+                task.status
+
+    assert len(statements) == 0
+
+
+def test_task_status_counts_is_one_query(session):
+    from hqlib.sql.models import TaskStatus
+    from hqcodedeployer.framework.graph import TaskStatusCounts
+
+    job_id = create_stage(session)
+
+    with count_queries(session) as statements:
+        counts = TaskStatusCounts(session, job_id)
+
+    assert len(statements) == 1
+    assert counts.total == 12
+    assert counts.all(TaskStatus.PENDING)
+    assert not counts.some(TaskStatus.FAILED)
+
+
+def finish_tasks(session, job_id, stopped_at):
+    # stopped_at maps task orders to the seconds after the job was created they stopped at on every target
+    from hqlib.sql.models import Job, TaskStatus
+
+    job = session.query(Job).get(job_id)
+
+    for job_target in job.targets:
+        for task in job_target.tasks:
+            if task.order in stopped_at:
+                task.status = TaskStatus.FINISHED
+                task.stopped_at = job.created_at + datetime.timedelta(seconds=stopped_at[task.order])
+
+    session.commit()
+    return job
+
+
+def unix_time_millis(value):
+    return int((value - datetime.datetime(1970, 1, 1)).total_seconds() * 1000)
+
+
+def test_critical_path_in_order(session):
+    from hqcodedeployer.framework.graph import critical_path
+
+    job = finish_tasks(session, create_stage(session, targets=2), {0: 1, 1: 3, 2: 4})
+    path = critical_path(session, job, unix_time_millis)
+
+    assert path['duration'] == 4000
+    assert path['tasks'] == [{'name': 'task0', 'duration': 1000}, {'name': 'task1', 'duration': 2000},
+                             {'name': 'task2', 'duration': 1000}, {'name': 'task3', 'duration': None}]
+
+
+def test_critical_path_follows_the_longest_dependency(session):
+    from hqcodedeployer.framework.graph import critical_path
+
+    # task0 -> (task1, task2) -> task3, task2 took longer
+    job = finish_tasks(session, create_stage(session, targets=2), {0: 1, 1: 2, 2: 5, 3: 6})
+    path = critical_path(session, job, unix_time_millis, [[], [0], [0], [1, 2]])
+
+    assert path['duration'] == 6000
+    assert [task['name'] for task in path['tasks']] == ['task0', 'task2', 'task3']
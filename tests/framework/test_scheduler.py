@@ -0,0 +1,108 @@
+import pytest
+
+pytest.importorskip('schematics')
+pytest.importorskip('hqlib')
+
+from schematics.exceptions import ValidationError
+
+from hqlib.sql.models import TaskStatus
+from hqcodedeployer.framework.scheduler import GraphScheduler, resolve_task_dependencies
+from tests.conftest import python2_only
+
+
+class Task(object):
+
+    def __init__(self, name, status=None):
+        self.name = name
+        self.status = status or TaskStatus.PENDING
+
+
+class Target(object):
+
+    def __init__(self, name, statuses):
+        self.name = name
+        self.tasks = [Task('task' + str(index), status) for index, status in enumerate(statuses)]
+
+
+class TaskData(object):
+
+    def __init__(self, name, priority, depends_on=None):
+        self.name = name
+        self.priority = priority
+        self.depends_on = depends_on
+
+
+def launched(scheduler):
+    return [(target.name, task.name) for target, task in scheduler.launchable()]
+
+
+# build -> (test, lint) -> package
+DEPENDENCIES = [[], [0], [0], [1, 2]]
+
+
+def targets(*statuses):
+    return [Target('target' + str(index), target_statuses) for index, target_statuses in enumerate(statuses)]
+
+
+def test_launches_every_ready_task():
+    F, P = TaskStatus.FINISHED, TaskStatus.PENDING
+    scheduler = GraphScheduler(targets([F, P, P, P], [P, P, P, P]), DEPENDENCIES, sync_tasks=[])
+
+    assert launched(scheduler) == [('target0', 'task1'), ('target0', 'task2'), ('target1', 'task0')]
+
+
+def test_sync_tasks_wait_for_every_target():
+    F, P = TaskStatus.FINISHED, TaskStatus.PENDING
+    scheduler = GraphScheduler(targets([F, P, P, P], [P, P, P, P]), DEPENDENCIES, sync_tasks=[1])
+
+    assert launched(scheduler) == [('target0', 'task2'), ('target1', 'task0')]
+
+
+def test_every_task_is_a_sync_task_by_default():
+    F, P, R = TaskStatus.FINISHED, TaskStatus.PENDING, TaskStatus.RUNNING
+    scheduler = GraphScheduler(targets([F, P, P, P], [R, P, P, P]), DEPENDENCIES)
+
+    assert launched(scheduler) == []
+
+
+def test_batch_size_limits_started_targets():
+    F, P, R = TaskStatus.FINISHED, TaskStatus.PENDING, TaskStatus.RUNNING
+    scheduler = GraphScheduler(targets([R, P, P, P], [P, P, P, P], [P, P, P, P], [F, F, F, F]),
+                               DEPENDENCIES, batch_size=2, sync_tasks=[])
+
+    assert launched(scheduler) == [('target1', 'task0')]
+
+
+def test_max_in_flight_limits_running_tasks():
+    F, P, R = TaskStatus.FINISHED, TaskStatus.PENDING, TaskStatus.RUNNING
+    scheduler = GraphScheduler(targets([F, R, P, P], [P, P, P, P], [P, P, P, P]),
+                               DEPENDENCIES, max_in_flight=3, sync_tasks=[])
+
+    assert launched(scheduler) == [('target0', 'task2'), ('target1', 'task0')]
+
+
+def test_lost_tasks_are_relaunched_past_the_limits():
+    F, P, L = TaskStatus.FINISHED, TaskStatus.PENDING, TaskStatus.LOST
+    scheduler = GraphScheduler(targets([F, L, L, P], [P, P, P, P]), DEPENDENCIES, batch_size=1, max_in_flight=1,
+                               sync_tasks=[])
+
+    assert launched(scheduler) == [('target0', 'task1'), ('target0', 'task2')]
+
+
+def test_tasks_in_order_have_no_dependencies():
+    assert resolve_task_dependencies([TaskData('a', 1), TaskData('b', 2)]) is None
+
+
+@python2_only
+def test_tasks_without_depends_on_wait_for_the_previous_priority():
+    tasks = [TaskData('a', 1), TaskData('b', 1), TaskData('c', 2), TaskData('d', 3, ['a'])]
+
+    assert resolve_task_dependencies(tasks) == [[], [], [0, 1], [0]]
+
+
+@python2_only
+def test_task_dependency_cycles_are_rejected():
+    tasks = [TaskData('a', 1, ['b']), TaskData('b', 2)]
+
+    with pytest.raises(ValidationError):
+        resolve_task_dependencies(tasks)
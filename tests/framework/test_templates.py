@@ -0,0 +1,46 @@
+import pytest
+
+from hqcodedeployer.framework.templates import compile_template, resolve_variables, TemplateError
+from tests.conftest import python2_only
+
+
+def test_render_replaces_known_variables():
+    template = compile_template("{build_path}/{app_name}-{stage_id}.tar")
+
+    assert template.variables == {'build_path', 'app_name', 'stage_id'}
+    assert template.render({'build_path': '/srv', 'app_name': 'app', 'stage_id': '1'}) == "/srv/app-1.tar"
+
+
+def test_render_leaves_unknown_variables():
+    assert compile_template("{known} {unknown}").render({'known': 'a'}) == "a {unknown}"
+
+
+def test_compile_template_is_cached():
+    assert compile_template("{a}") is compile_template("{a}")
+
+
+@python2_only
+def test_resolve_variables_follows_chains():
+    variables = resolve_variables({'name': 'app'}, {'dir': '{base}/{name}', 'base': '/srv/{env}', 'env': 'prod'})
+
+    assert variables['dir'] == "/srv/prod/app"
+
+
+@python2_only
+def test_resolve_variables_later_layers_win():
+    variables = resolve_variables({'name': 'app'}, {'dir': '/srv'}, {'dir': '/opt/{name}'})
+
+    assert variables['dir'] == "/opt/app"
+
+
+@python2_only
+def test_resolve_variables_self_reference_uses_lower_layer():
+    variables = resolve_variables({'path': '/bin'}, {'path': '/opt/bin:{path}'})
+
+    assert variables['path'] == "/opt/bin:/bin"
+
+
+@python2_only
+def test_resolve_variables_rejects_cycles():
+    with pytest.raises(TemplateError):
+        resolve_variables({}, {'a': '{b}', 'b': '{a}'})
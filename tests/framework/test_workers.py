@@ -0,0 +1,79 @@
+import pytest
+
+pytest.importorskip('schematics')
+
+from hqcodedeployer.framework.workers import WorkerIndex, WorkerIndexMixin
+from tests.conftest import python2_only
+
+
+class Worker(object):
+
+    def __init__(self, id, target, tags):
+        self.id = id
+        self.target = target
+        self.tags = tags
+
+
+class Config(object):
+
+    worker_index_ttl = 10
+
+
+class Framework(WorkerIndexMixin):
+
+    def __init__(self, workers):
+        super(Framework, self).__init__()
+        self.config = Config()
+        self.workers = workers
+        self.get_workers_calls = 0
+
+    def get_workers(self, datacenter):
+        self.get_workers_calls += 1
+        return self.workers
+
+
+def workers():
+    return [Worker(3, 'c', {'environment': 'prod', 'apps': ['web']}),
+            Worker(1, 'a', {'environment': 'prod', 'apps': []}),
+            Worker(2, 'b', {'environment': 'qa', 'apps': ['web'], 'rack': '1'})]
+
+
+@python2_only
+def test_select_keeps_get_workers_order():
+    index = WorkerIndex()
+    index.sync(workers())
+
+    assert [worker.target for worker in index.select()] == ['c', 'a', 'b']
+    assert [worker.target for worker in index.select(environment='prod')] == ['c', 'a']
+
+
+@python2_only
+def test_select_intersects():
+    index = WorkerIndex()
+    index.sync(workers())
+
+    assert [worker.target for worker in index.select(app='web', tags={'rack': '1'})] == ['b']
+    assert index.select(environment='prod', targets=['b']) == []
+
+
+@python2_only
+def test_sync_reindexes_changed_and_removed_workers():
+    index = WorkerIndex()
+    index.sync(workers())
+    index.sync([Worker(3, 'c', {'environment': 'qa', 'apps': []})])
+
+    assert [worker.target for worker in index.select(environment='qa')] == ['c']
+    assert index.select(app='web') == []
+
+
+@python2_only
+def test_worker_index_refreshes_after_ttl():
+    framework = Framework(workers())
+
+    framework.worker_index('dc1')
+    framework.worker_index('dc1')
+    assert framework.get_workers_calls == 1
+
+    framework.worker_indexes['dc1'].synced_at -= Config.worker_index_ttl
+    framework.worker_index('dc1')
+    assert framework.get_workers_calls == 2
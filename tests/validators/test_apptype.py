@@ -0,0 +1,43 @@
+import pytest
+
+pytest.importorskip('schematics')
+
+from schematics.exceptions import ModelValidationError
+
+from hqcodedeployer.validators import AppTypeValidator
+from tests.conftest import python2_only
+
+
+def app_type(tasks):
+    return AppTypeValidator({'tasks': [dict(task, actions=[{'processor': 'mkdir'}]) for task in tasks]})
+
+
+@python2_only
+def test_tasks_with_dependencies_are_valid():
+    app_type([{'name': 'build', 'priority': 1}, {'name': 'test', 'priority': 2, 'depends_on': ['build']},
+              {'name': 'lint', 'priority': 2, 'depends_on': ['build']}, {'name': 'package', 'priority': 3}]).validate()
+
+
+@python2_only
+def test_tasks_depending_on_unknown_tasks_are_rejected():
+    with pytest.raises(ModelValidationError) as e:
+        app_type([{'name': 'build', 'priority': 1}, {'name': 'test', 'priority': 2, 'depends_on': ['compile']}]). \
+            validate()
+
+    assert "unknown Task compile" in str(e.value.messages)
+
+
+@python2_only
+def test_task_dependency_cycles_are_rejected():
+    # build waits for the priority 1 task test through its own priority
+    with pytest.raises(ModelValidationError) as e:
+        app_type([{'name': 'test', 'priority': 1, 'depends_on': ['build']}, {'name': 'build', 'priority': 2}]). \
+            validate()
+
+    assert "cycle" in str(e.value.messages)
+
+
+@python2_only
+def test_tasks_need_unique_names_with_depends_on():
+    with pytest.raises(ModelValidationError):
+        app_type([{'name': 'build', 'priority': 1}, {'name': 'build', 'priority': 2, 'depends_on': []}]).validate()
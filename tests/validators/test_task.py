@@ -0,0 +1,65 @@
+import pytest
+
+pytest.importorskip('schematics')
+
+from schematics.exceptions import ValidationError
+
+from hqcodedeployer.validators import TaskValidator
+from hqcodedeployer.validators.task import check_dependencies
+from tests.conftest import python2_only
+
+
+@python2_only
+def test_check_dependencies_accepts_a_graph():
+    check_dependencies({'build': [], 'test': ['build'], 'lint': ['build'], 'package': ['test', 'lint']}, "Action")
+
+
+@python2_only
+def test_check_dependencies_rejects_unknown_names():
+    with pytest.raises(ValidationError) as e:
+        check_dependencies({'build': [], 'test': ['compile']}, "Action")
+
+    assert "unknown Action compile" in str(e.value)
+
+
+@python2_only
+def test_check_dependencies_rejects_cycles():
+    with pytest.raises(ValidationError) as e:
+        check_dependencies({'a': ['c'], 'b': ['a'], 'c': ['b']}, "Task")
+
+    assert "cycle" in str(e.value)
+
+
+@python2_only
+def test_check_dependencies_rejects_self_dependencies():
+    with pytest.raises(ValidationError):
+        check_dependencies({'a': ['a']}, "Task")
+
+
+class Action(object):
+
+    def __init__(self, name, depends_on=None):
+        self.name = name
+        self.depends_on = depends_on
+
+
+def test_actions_without_depends_on_run_after_the_previous_action():
+    actions = [Action('a'), Action('b'), Action('c', []), Action('d', ['a', 'c'])]
+
+    assert TaskValidator.has_action_graph(actions)
+    assert TaskValidator.action_dependencies(actions) == [[], ['a'], [], ['a', 'c']]
+    assert not TaskValidator.has_action_graph([Action('a'), Action('b')])
+
+
+class Task(object):
+
+    def __init__(self, name, priority, depends_on=None):
+        self.name = name
+        self.priority = priority
+        self.depends_on = depends_on
+
+
+def test_tasks_without_depends_on_wait_for_the_previous_priority():
+    tasks = [Task('a', 1), Task('b', 1), Task('c', 2), Task('d', 3, ['a']), Task('e', 3)]
+
+    assert TaskValidator.task_dependencies(tasks) == [[], [], ['a', 'b'], ['a'], ['c']]
@@ -0,0 +1,89 @@
+import hashlib
+import os
+
+import pytest
+
+pytest.importorskip('hqworker')
+
+from hqcodedeployer.worker.artifacts import ArtifactCache, artifact_path, file_digest, is_digest, place_file
+
+
+def digest_of(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def test_file_digest(tmpdir):
+    source = tmpdir.join("artifact")
+    source.write_binary(b"artifact")
+
+    assert file_digest(str(source)) == digest_of(b"artifact")
+    assert is_digest(file_digest(str(source)))
+    assert not is_digest("not a digest")
+
+
+def test_place_file_creates_directories(tmpdir):
+    source = tmpdir.join("artifact")
+    source.write_binary(b"artifact")
+    destination = tmpdir.join("a", "b", "artifact")
+
+    place_file(str(source), str(destination))
+
+    assert destination.read_binary() == b"artifact"
+
+
+def test_put_and_get(tmpdir):
+    cache = ArtifactCache(str(tmpdir.mkdir("cache")), 10)
+    source = tmpdir.join("artifact")
+    source.write_binary(b"artifact")
+    digest = digest_of(b"artifact")
+
+    assert cache.get(digest) is None
+
+    stored = cache.put(str(source), digest)
+
+    assert stored == artifact_path(cache.path, digest)
+    assert cache.get(digest) == stored
+    assert open(stored, 'rb').read() == b"artifact"
+
+
+def test_prune_keeps_most_recent(tmpdir):
+    cache = ArtifactCache(str(tmpdir.mkdir("cache")), 2)
+    digests = []
+
+    for index in range(3):
+        data = b"artifact" + str(index).encode()
+        source = tmpdir.join("artifact" + str(index))
+        source.write_binary(data)
+        digests.append(digest_of(data))
+        os.utime(cache.put(str(source), digests[-1]), (index, index))
+
+    cache.prune()
+
+    assert cache.get(digests[0]) is None
+    assert cache.get(digests[1]) is not None
+    assert cache.get(digests[2]) is not None
+
+
+def test_fetch_verifies_digest(tmpdir):
+    cache = ArtifactCache(str(tmpdir.mkdir("cache")), 10)
+    source = tmpdir.join("artifact")
+    source.write_binary(b"artifact")
+    url = "file://" + str(source)
+
+    stored = cache.fetch(url, digest_of(b"artifact"), 5)
+    assert open(stored, 'rb').read() == b"artifact"
+
+    with pytest.raises(ValueError):
+        cache.fetch(url, digest_of(b"something else"), 5)
+
+    assert cache.get(digest_of(b"something else")) is None
+    assert [name for name in os.listdir(cache.path) if name.startswith(".hq-")] == []
+
+
+def test_fetch_error_leaves_no_temp_file(tmpdir):
+    cache = ArtifactCache(str(tmpdir.mkdir("cache")), 10)
+
+    with pytest.raises(EnvironmentError):
+        cache.fetch("file://" + str(tmpdir.join("missing")), digest_of(b"artifact"), 5)
+
+    assert os.listdir(cache.path) == []
@@ -0,0 +1,55 @@
+import os
+import subprocess
+
+import pytest
+
+pytest.importorskip('hqworker')
+
+from hqcodedeployer.worker.processors.bundle import place_bundle, ruby_version
+
+
+def checkout(tmpdir):
+    cwd = tmpdir.mkdir("checkout")
+    cwd.mkdir("vendor").mkdir("bundle").join("gem.rb").write("gem\n")
+    cwd.mkdir(".bundle").join("config").write("BUNDLE_PATH: vendor/bundle\n")
+    return cwd
+
+
+def test_gems_are_linked_and_config_is_copied(tmpdir):
+    cwd = checkout(tmpdir)
+    stored = str(tmpdir.join("stored"))
+
+    place_bundle(str(cwd), stored)
+
+    assert os.stat(os.path.join(stored, "vendor", "bundle", "gem.rb")).st_ino == \
+        cwd.join("vendor", "bundle", "gem.rb").stat().ino
+    assert os.stat(os.path.join(stored, ".bundle", "config")).st_ino != cwd.join(".bundle", "config").stat().ino
+
+    cwd.join(".bundle", "config").write("BUNDLE_WITHOUT: test\n")
+
+    assert open(os.path.join(stored, ".bundle", "config")).read() == "BUNDLE_PATH: vendor/bundle\n"
+
+
+def test_placing_replaces_an_existing_config(tmpdir):
+    cwd = checkout(tmpdir)
+    other = tmpdir.mkdir("other")
+    other.mkdir(".bundle").join("config").write("old\n")
+
+    place_bundle(str(cwd), str(other))
+
+    assert other.join(".bundle", "config").read() == "BUNDLE_PATH: vendor/bundle\n"
+
+
+def test_ruby_version_is_asked_in_the_checkout(tmpdir, monkeypatch):
+    calls = []
+
+    def check_output(command, cwd=None, env=None):
+        calls.append(cwd)
+        return "2.3.1-x86_64-linux"
+
+    monkeypatch.setattr(subprocess, 'check_output', check_output)
+
+    assert ruby_version({}, str(tmpdir.join("a"))) == "2.3.1-x86_64-linux"
+    ruby_version({}, str(tmpdir.join("b")))
+
+    assert calls == [str(tmpdir.join("a")), str(tmpdir.join("b"))]
@@ -0,0 +1,168 @@
+import hashlib
+import threading
+
+import pytest
+
+pytest.importorskip('hqworker')
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from hqcodedeployer.worker.processors import file as file_processors
+from hqcodedeployer.worker.processors.file import Download
+
+BODY = b"".join(bytes(bytearray([index % 256])) * 1024 for index in range(64))
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+
+    # Serves server.body with a strong ETag, honours Range and If-Range and, while server.drops
+    # is above zero, closes the connection half way through a response
+
+    def do_GET(self):
+        server = self.server
+        body = server.body
+        server.requests.append(dict((key.lower(), value) for key, value in self.headers.items()))
+        start = 0
+
+        range_header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+
+        if range_header is not None and (if_range is None or if_range == server.etag):
+            start = int(range_header.split("=")[1].split("-")[0])
+
+            if start >= len(body):
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */' + str(len(body)))
+                self.end_headers()
+                return
+
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, len(body) - 1, len(body)))
+        else:
+            self.send_response(200)
+
+        self.send_header('ETag', server.etag)
+        self.send_header('Content-Length', str(len(body) - start))
+        self.end_headers()
+
+        if server.drops > 0:
+            server.drops -= 1
+            self.wfile.write(body[start:start + (len(body) - start) // 2])
+            self.wfile.flush()
+            self.connection.shutdown(2)
+            return
+
+        self.wfile.write(body[start:])
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = HTTPServer(('127.0.0.1', 0), StandInHandler)
+    server.body = BODY
+    server.etag = '"v1"'
+    server.drops = 0
+    server.requests = []
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(file_processors.time, 'sleep', lambda seconds: None)
+
+
+class Worker(object):
+    pass
+
+
+def download(server, tmpdir, **args):
+    processor = Download(Worker())
+    processor.args = dict({'file': str(tmpdir.join("download")), 'url': 'http://127.0.0.1:%d/file' % server.server_port,
+                           'digest': None, 'connections': None, 'retries': None}, **args)
+    return processor.work()
+
+
+def test_download(server, tmpdir):
+    assert download(server, tmpdir, digest=hashlib.sha256(BODY).hexdigest()) == (0, "")
+    assert tmpdir.join("download").read_binary() == BODY
+    assert not tmpdir.join("download.part").exists()
+
+
+def test_resumes_with_if_range(server, tmpdir):
+    server.drops = 1
+
+    assert download(server, tmpdir) == (0, "")
+    assert tmpdir.join("download").read_binary() == BODY
+    assert server.requests[1]['if-range'] == '"v1"'
+    assert server.requests[1]['range'] == 'bytes=%d-' % (len(BODY) // 2)
+
+
+def test_changed_file_is_downloaded_again(server, tmpdir):
+    server.drops = 1
+
+    class ChangingHandler(StandInHandler):
+        def do_GET(self):
+            if len(self.server.requests) == 1:
+                self.server.body = BODY[::-1]
+                self.server.etag = '"v2"'
+            StandInHandler.do_GET(self)
+
+    server.RequestHandlerClass = ChangingHandler
+
+    assert download(server, tmpdir) == (0, "")
+    assert tmpdir.join("download").read_binary() == BODY[::-1]
+
+
+def test_stale_part_is_not_trusted(server, tmpdir):
+    tmpdir.join("download.part").write_binary(BODY)
+
+    assert download(server, tmpdir) == (0, "")
+    assert tmpdir.join("download").read_binary() == BODY
+    assert 'range' not in server.requests[0]
+
+
+def test_digest_mismatch(server, tmpdir):
+    exit_code, message = download(server, tmpdir, digest=hashlib.sha256(b"other").hexdigest())
+
+    assert exit_code == -1
+    assert not tmpdir.join("download").exists()
+    assert not tmpdir.join("download.part").exists()
+
+
+def test_parallel_ranges(server, tmpdir, monkeypatch):
+    monkeypatch.setattr(file_processors, 'DOWNLOAD_CHUNK_SIZE', 1024)
+
+    class RangeHandler(StandInHandler):
+        def do_HEAD(self):
+            self.send_response(200)
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('Content-Length', str(len(self.server.body)))
+            self.end_headers()
+
+        def do_GET(self):
+            range_header = self.headers.get('Range')
+            start, end = [int(value) for value in range_header.split("=")[1].split("-")]
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, len(self.server.body)))
+            self.send_header('Content-Length', str(end - start + 1))
+            self.end_headers()
+            self.wfile.write(self.server.body[start:end + 1])
+
+    server.RequestHandlerClass = RangeHandler
+
+    assert download(server, tmpdir, connections='4', digest=hashlib.sha256(BODY).hexdigest()) == (0, "")
+    assert tmpdir.join("download").read_binary() == BODY
@@ -0,0 +1,52 @@
+import collections
+import os
+
+import pytest
+
+pytest.importorskip('hqworker')
+
+from hqcodedeployer.worker import environment
+from hqcodedeployer.worker.environment import parse_env, read_env, write_env_diff
+from tests.conftest import python2_only
+
+
+def test_parse_env():
+    variables = parse_env("PATH=/opt/bin:/bin\nMESSAGE=first\n\tsecond\n-HOME")
+
+    assert variables == {'PATH': '/opt/bin:/bin', 'MESSAGE': 'first\nsecond', 'HOME': None}
+
+
+def test_parse_env_old_continuation_lines():
+    assert parse_env("MESSAGE=first\nsecond line") == {'MESSAGE': 'first\nsecond line'}
+
+
+@python2_only
+def test_write_and_read_env_diff(tmpdir, monkeypatch):
+    monkeypatch.setattr(os, 'environ', {'HOME': '/root', 'PATH': '/bin', 'LANG': 'C'})
+    env_file = str(tmpdir.join(".HQ_ENV"))
+
+    write_env_diff(env_file, {'HOME': '/root', 'PATH': '/opt/bin:/bin', 'APP': 'multi\nline', 'PWD': '/tmp'})
+
+    assert open(env_file).read() == "APP=multi\n\tline\n-LANG\nPATH=/opt/bin:/bin\n"
+    assert dict(read_env(env_file)) == {'HOME': '/root', 'PATH': '/opt/bin:/bin', 'APP': 'multi\nline'}
+
+
+@python2_only
+def test_read_env_without_file(tmpdir, monkeypatch):
+    monkeypatch.setattr(os, 'environ', {'HOME': '/root'})
+
+    assert dict(read_env(str(tmpdir.join(".HQ_ENV")))) == {'HOME': '/root'}
+
+
+def test_read_env_keeps_the_most_recently_used_files(tmpdir, monkeypatch):
+    monkeypatch.setattr(os, 'environ', {'HOME': '/root'})
+    monkeypatch.setattr(environment, 'ENV_CACHE_SIZE', 2)
+    monkeypatch.setattr(environment, '_cache', collections.OrderedDict())
+    first, second, third = [str(tmpdir.join(name, ".HQ_ENV")) for name in ["first", "second", "third"]]
+
+    read_env(first)
+    read_env(second)
+    read_env(first)
+    read_env(third)
+
+    assert list(environment._cache) == [first, third]
@@ -0,0 +1,91 @@
+import os
+import stat
+
+import pytest
+
+pytest.importorskip('hqworker')
+
+from hqcodedeployer.worker.fs import parse_mode, owner_ids, walk_tree, copy_file, copy_tree, link_tree
+
+
+@pytest.mark.parametrize("mode,current,expected", [
+    ("755", 0o100644, 0o755),
+    ("u+x", 0o100644, 0o100744),
+    ("go-w", 0o100666, 0o100644),
+    ("a=r", 0o100777, 0o100444),
+    ("u=rwx,g=rx,o=", 0o100000, 0o100750),
+    ("+X", 0o040600, 0o040711),
+    ("+X", 0o100600, 0o100600),
+    ("+t", 0o040755, 0o041755),
+])
+def test_parse_mode(mode, current, expected):
+    assert parse_mode(mode, current) == expected
+
+
+def test_parse_mode_rejects_invalid_modes():
+    with pytest.raises(ValueError):
+        parse_mode("u*x", 0o100644)
+
+    with pytest.raises(ValueError):
+        parse_mode("u+q", 0o100644)
+
+
+def test_owner_ids():
+    assert owner_ids("1000", "") == (1000, -1)
+    assert owner_ids(None, "0") == (-1, 0)
+
+
+def test_walk_tree_does_not_follow_symlinks(tmpdir):
+    tmpdir.mkdir("tree").mkdir("a").join("file").write("file")
+    os.symlink(str(tmpdir.mkdir("outside")), str(tmpdir.join("tree", "link")))
+    tmpdir.join("outside", "hidden").write("hidden")
+
+    paths = set(os.path.relpath(path, str(tmpdir)) for path in walk_tree(str(tmpdir.join("tree"))))
+
+    assert paths == {"tree", os.path.join("tree", "a"), os.path.join("tree", "a", "file"), os.path.join("tree", "link")}
+
+
+def test_copy_file_keeps_mode(tmpdir):
+    source = tmpdir.join("script")
+    source.write("#!/bin/sh\n")
+    source.chmod(0o750)
+
+    copy_file(str(source), str(tmpdir.join("copy")))
+
+    assert tmpdir.join("copy").read() == "#!/bin/sh\n"
+    assert stat.S_IMODE(tmpdir.join("copy").stat().mode) == 0o750
+
+
+def test_copy_tree_into_existing_directory(tmpdir):
+    source = tmpdir.mkdir("app")
+    source.mkdir("lib").join("module.py").write("value = 1")
+    os.symlink("lib", str(source.join("current")))
+    destination = tmpdir.mkdir("releases")
+
+    copy_tree(str(source), str(destination))
+
+    assert destination.join("app", "lib", "module.py").read() == "value = 1"
+    assert os.readlink(str(destination.join("app", "current"))) == "lib"
+
+
+def test_copy_tree_to_new_path(tmpdir):
+    source = tmpdir.mkdir("app")
+    source.join("file").write("file")
+
+    copy_tree(str(source), str(tmpdir.join("copy")))
+
+    assert tmpdir.join("copy", "file").read() == "file"
+
+
+def test_link_tree_hardlinks_and_replaces(tmpdir):
+    source = tmpdir.mkdir("source")
+    source.mkdir("lib").join("module.py").write("new")
+    destination = tmpdir.mkdir("destination")
+    destination.mkdir("lib").join("module.py").write("old")
+    destination.join("lib", "local.py").write("local")
+
+    link_tree(str(source), str(destination))
+
+    assert destination.join("lib", "module.py").read() == "new"
+    assert destination.join("lib", "module.py").stat().ino == source.join("lib", "module.py").stat().ino
+    assert destination.join("lib", "local.py").read() == "local"
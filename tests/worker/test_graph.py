@@ -0,0 +1,91 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('hqworker')
+
+from hqcodedeployer.worker.processors.graph import Graph
+
+
+class Config(object):
+
+    action_pool_size = 2
+
+
+class Worker(object):
+
+    # Records the order actions started in and how many ran at once. Actions sleep for their
+    # "sleep" argument and fail when given "fail".
+
+    def __init__(self):
+        self.config = Config()
+        self.lock = threading.Lock()
+        self.started = []
+        self.running = 0
+        self.max_running = 0
+
+    def run_action(self, processor, arguments):
+        with self.lock:
+            self.started.append(arguments['name'])
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+
+        time.sleep(float(arguments.get('sleep', 0.05)))
+
+        with self.lock:
+            self.running -= 1
+
+        if 'fail' in arguments:
+            return 1, "failed"
+        return 0, ""
+
+
+def graph(worker, actions):
+    # actions are (name, depends_on indexes, extra arguments)
+    arguments = {}
+
+    for index, (name, depends_on, extra) in enumerate(actions):
+        prefix = str(index) + ":"
+        arguments[prefix + "name"] = name
+        arguments[prefix + "processor"] = "test"
+        arguments[prefix + "depends_on"] = ",".join(str(dependency) for dependency in depends_on)
+        arguments[prefix + "arg:name"] = name
+        for key, value in extra.items():
+            arguments[prefix + "arg:" + key] = value
+
+    processor = Graph(worker)
+    processor.arguments = arguments
+    return processor
+
+
+def test_runs_in_dependency_order():
+    worker = Worker()
+    processor = graph(worker, [('build', [], {}), ('test', [0], {}), ('lint', [0], {}), ('package', [1, 2], {})])
+
+    assert processor.work() == (0, "")
+    assert worker.started[0] == 'build'
+    assert set(worker.started[1:3]) == {'test', 'lint'}
+    assert worker.started[3] == 'package'
+    assert worker.max_running == 2
+
+
+def test_respects_action_pool_size():
+    worker = Worker()
+    worker.config.action_pool_size = 1
+    processor = graph(worker, [('a', [], {}), ('b', [], {}), ('c', [], {})])
+
+    assert processor.work() == (0, "")
+    assert worker.max_running == 1
+
+
+def test_failure_stops_new_actions():
+    worker = Worker()
+    processor = graph(worker, [('build', [], {'fail': '1'}), ('test', [0], {}), ('slow', [], {'sleep': '0.2'})])
+
+    exit_code, message = processor.work()
+
+    assert exit_code == 1
+    assert "build" in message
+    assert 'test' not in worker.started
+    assert 'slow' in worker.started
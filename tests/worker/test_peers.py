@@ -0,0 +1,55 @@
+import hashlib
+import threading
+
+import pytest
+
+pytest.importorskip('hqworker')
+
+from hqcodedeployer.worker.artifacts import ArtifactCache
+from hqcodedeployer.worker.peers import PeerServer, TOKEN_HEADER
+
+
+@pytest.fixture
+def peer(tmpdir):
+    cache = ArtifactCache(str(tmpdir.mkdir("peer")), 10)
+    source = tmpdir.join("artifact")
+    source.write_binary(b"artifact")
+    cache.put(str(source), hashlib.sha256(b"artifact").hexdigest())
+
+    server = PeerServer('127.0.0.1', 0, 'secret', cache)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_fetch_from_peer_with_token(peer, tmpdir):
+    cache = ArtifactCache(str(tmpdir.mkdir("cache")), 10)
+    digest = hashlib.sha256(b"artifact").hexdigest()
+    url = "http://127.0.0.1:%d/%s" % (peer.server_port, digest)
+
+    stored = cache.fetch(url, digest, 5, {TOKEN_HEADER: 'secret'})
+
+    assert open(stored, 'rb').read() == b"artifact"
+
+
+def test_peer_refuses_requests_without_token(peer, tmpdir):
+    cache = ArtifactCache(str(tmpdir.mkdir("cache")), 10)
+    digest = hashlib.sha256(b"artifact").hexdigest()
+    url = "http://127.0.0.1:%d/%s" % (peer.server_port, digest)
+
+    with pytest.raises(EnvironmentError):
+        cache.fetch(url, digest, 5)
+
+    with pytest.raises(EnvironmentError):
+        cache.fetch(url, digest, 5, {TOKEN_HEADER: 'wrong'})
+
+
+def test_bind_error(peer, tmpdir):
+    with pytest.raises(EnvironmentError):
+        PeerServer('127.0.0.1', peer.server_port, 'secret', ArtifactCache(str(tmpdir), 10))
@@ -0,0 +1,84 @@
+import logging
+import sys
+import threading
+
+import pytest
+
+pytest.importorskip('hqworker')
+
+import hqcodedeployer.worker
+from hqcodedeployer.worker import CDWorker
+from hqcodedeployer.worker.processors import ProcessorRegistry, BUILTIN_PROCESSORS
+
+
+@pytest.fixture
+def plugin_module(tmpdir, monkeypatch):
+    tmpdir.join('hq_test_processor.py').write("class Processor(object):\n    pass\n")
+    monkeypatch.syspath_prepend(str(tmpdir))
+    yield 'hq_test_processor'
+    sys.modules.pop('hq_test_processor', None)
+
+
+def test_modules_are_imported_on_first_use(plugin_module):
+    registry = ProcessorRegistry({'test': plugin_module + ':Processor'})
+    registry.entry_points = {}
+
+    assert 'test' in registry
+    assert plugin_module not in sys.modules
+
+    processor = registry['test']
+
+    assert processor.__name__ == 'Processor'
+    assert registry['test'] is processor
+
+
+def test_unknown_processors():
+    registry = ProcessorRegistry({})
+    registry.entry_points = {}
+
+    assert 'missing' not in registry
+    with pytest.raises(KeyError):
+        registry['missing']
+
+
+def test_entry_points_are_scanned_once():
+    registry = ProcessorRegistry(BUILTIN_PROCESSORS)
+    scans = []
+
+    def scan_entry_points():
+        scans.append(threading.current_thread())
+        return {}
+
+    registry.scan_entry_points = scan_entry_points
+
+    threads = [threading.Thread(target=lambda: 'missing' in registry) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(scans) == 1
+
+
+class Worker(object):
+
+    logger = logging.getLogger("hq.worker.codedeployer.test")
+
+
+def test_run_action_fails_on_processors_that_cannot_load(monkeypatch):
+    registry = ProcessorRegistry({'broken': 'hq_missing_processor_module:Processor'})
+    registry.entry_points = {}
+    monkeypatch.setattr(hqcodedeployer.worker, 'processors', registry)
+
+    exit_code, message = CDWorker.__dict__['run_action'](Worker(), 'broken', {})
+
+    assert exit_code == -1
+    assert "Error loading processor broken" in message
+
+
+def test_run_action_rejects_unknown_processors(monkeypatch):
+    registry = ProcessorRegistry({})
+    registry.entry_points = {}
+    monkeypatch.setattr(hqcodedeployer.worker, 'processors', registry)
+
+    assert CDWorker.__dict__['run_action'](Worker(), 'missing', {}) == (-1, "Unknown processor missing")
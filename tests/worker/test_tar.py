@@ -0,0 +1,132 @@
+import io
+import os
+import socket
+import subprocess
+import tarfile
+
+import pytest
+
+pytest.importorskip('hqworker')
+
+import urllib2
+
+from hqcodedeployer.worker.processors.file import DOWNLOAD_TIMEOUT
+from hqcodedeployer.worker.processors.tar import merge_tree, extract_archive, extract_piped, write_archive, \
+    UnTarWorker
+
+
+def test_merge_tree_keeps_files_not_in_archive(tmpdir):
+    extracted = tmpdir.mkdir("extracted")
+    extracted.mkdir("app").join("new.py").write("new")
+    extracted.join("app", "changed.py").write("changed")
+
+    target = tmpdir.mkdir("target")
+    target.mkdir("app").join("changed.py").write("old")
+    target.join("app", "local.cfg").write("local")
+
+    merge_tree(str(extracted), str(target))
+
+    assert target.join("app", "new.py").read() == "new"
+    assert target.join("app", "changed.py").read() == "changed"
+    assert target.join("app", "local.cfg").read() == "local"
+
+
+def test_merge_tree_replaces_symlinks(tmpdir):
+    extracted = tmpdir.mkdir("extracted")
+    extracted.mkdir("current").join("file").write("file")
+
+    target = tmpdir.mkdir("target")
+    os.symlink(str(tmpdir.mkdir("release")), str(target.join("current")))
+
+    merge_tree(str(extracted), str(target))
+
+    assert not target.join("current").islink()
+    assert target.join("current", "file").read() == "file"
+
+
+def test_merge_tree_will_not_replace_directory_with_file(tmpdir):
+    extracted = tmpdir.mkdir("extracted")
+    extracted.join("app").write("file")
+
+    target = tmpdir.mkdir("target")
+    target.mkdir("app").join("keep").write("keep")
+
+    with pytest.raises(OSError):
+        merge_tree(str(extracted), str(target))
+
+    assert target.join("app", "keep").read() == "keep"
+
+
+@pytest.mark.parametrize("mode,compression", [('w|gz', 'gzip'), ('w|', 'none')])
+def test_write_and_extract_archive(tmpdir, mode, compression):
+    source = tmpdir.mkdir("source")
+    source.mkdir("lib").join("module.py").write("value = 1")
+    source.join("README").write("readme")
+
+    archive = io.BytesIO()
+    write_archive(archive, mode, str(source), str(tmpdir.join("archive.tar")))
+    archive.seek(0)
+
+    extracted = tmpdir.mkdir("extracted")
+    extract_archive(archive, compression, str(extracted))
+
+    assert extracted.join("lib", "module.py").read() == "value = 1"
+    assert extracted.join("README").read() == "readme"
+
+
+class Popen(subprocess.Popen):
+
+    started = []
+
+    def __init__(self, *args, **kwargs):
+        super(Popen, self).__init__(*args, **kwargs)
+        Popen.started.append(self)
+
+
+def test_extract_piped_reaps_the_decompressor_on_errors(tmpdir, monkeypatch):
+    monkeypatch.setattr(subprocess, 'Popen', Popen)
+    Popen.started = []
+
+    with pytest.raises(tarfile.TarError):
+        extract_piped(io.BytesIO(b"not a tar archive" * 1000), ['cat'], str(tmpdir))
+
+    assert Popen.started[0].returncode is not None
+
+
+class FailingReader(object):
+
+    def __init__(self, data):
+        self.data = io.BytesIO(data)
+
+    def read(self, size):
+        data = self.data.read(size)
+        if len(data) == 0:
+            raise socket.timeout("timed out")
+        return data
+
+
+def test_extract_piped_raises_read_errors(tmpdir):
+    source = tmpdir.mkdir("source")
+    source.join("file").write("file")
+
+    archive = io.BytesIO()
+    write_archive(archive, 'w|', str(source), str(tmpdir.join("archive.tar")))
+
+    with pytest.raises(EnvironmentError):
+        extract_piped(FailingReader(archive.getvalue()), ['cat'], str(tmpdir.mkdir("target")))
+
+
+def test_untar_urls_time_out(tmpdir, monkeypatch):
+    timeouts = []
+
+    def urlopen(url, timeout=None):
+        timeouts.append(timeout)
+        raise urllib2.URLError("refused")
+
+    monkeypatch.setattr(urllib2, 'urlopen', urlopen)
+
+    processor = UnTarWorker(None)
+    processor.args = {'url': 'http://127.0.0.1:1/archive.tar.gz', 'dir': str(tmpdir)}
+
+    assert processor.work()[0] == -1
+    assert timeouts == [DOWNLOAD_TIMEOUT]
@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+pytest.importorskip('hqworker')
+pytest.importorskip('virtualenvapi')
+
+from hqcodedeployer.worker.processors import pip
+from hqcodedeployer.worker.processors.pip import Install, requirements_hash
+from hqcodedeployer.worker.processors.venv import clone_venv
+
+
+def pooled_venv(tmpdir):
+    pooled = tmpdir.mkdir("pooled")
+    pooled.mkdir("bin").join("pip").write("#!" + str(pooled) + "/bin/python\n")
+    pooled.mkdir("lib").join("module.py").write("value = 1\n")
+    pooled.join("lib", "app.pth").write(str(pooled) + "/src\n")
+    os.symlink(str(pooled.join("lib")), str(pooled.join("lib64")))
+    return pooled
+
+
+def test_clone_venv_rewrites_paths(tmpdir):
+    pooled = pooled_venv(tmpdir)
+    destination = str(tmpdir.join("app", "venv"))
+
+    clone_venv(str(pooled), str(pooled), destination)
+
+    assert open(os.path.join(destination, "bin", "pip")).read() == "#!" + destination + "/bin/python\n"
+    assert open(os.path.join(destination, "lib", "app.pth")).read() == destination + "/src\n"
+    assert os.readlink(os.path.join(destination, "lib64")) == destination + "/lib"
+    assert os.stat(os.path.join(destination, "lib", "module.py")).st_ino == pooled.join("lib", "module.py").stat().ino
+
+
+def test_clone_venv_into_existing_empty_dir(tmpdir):
+    pooled = pooled_venv(tmpdir)
+    destination = tmpdir.mkdir("venv")
+
+    clone_venv(str(pooled), str(pooled), str(destination))
+
+    assert destination.join("lib", "module.py").read() == "value = 1\n"
+
+
+class Environment(object):
+
+    def __init__(self, path, python=None):
+        self.path = path
+
+    def open_or_create(self):
+        pass
+
+
+def test_installing_into_a_clone_keeps_the_pool_marker(tmpdir, monkeypatch):
+    pooled = pooled_venv(tmpdir)
+    pooled.join(".hq-requirements").write("pooled digest")
+    pooled.join(".hq-venv-path").write(str(pooled))
+    destination = str(tmpdir.join("venv"))
+
+    clone_venv(str(pooled), str(pooled), destination)
+
+    requirements = tmpdir.join("requirements.txt")
+    requirements.write("six\n")
+    monkeypatch.setattr(pip, 'VirtualEnvironment', Environment)
+
+    processor = Install(None)
+    processor.args = {'venv': destination, 'requirements': str(requirements)}
+    processor.install_from_file = lambda requirements, env, wheel=None: (0, "")
+
+    assert processor.work() == (0, "")
+    assert open(os.path.join(destination, ".hq-requirements")).read() == requirements_hash(str(requirements))
+    assert pooled.join(".hq-requirements").read() == "pooled digest"
+    assert pooled.join(".hq-venv-path").read() == str(pooled)